@@ -0,0 +1,228 @@
+# Native handling of plink .bed/.bim/.fam files
+import os
+import sys
+import shutil
+import filecmp
+import numpy as np
+import pandas as pd
+
+# plink 1 .bed magic number, SNP-major mode
+BED_MAGIC = b'\x6c\x1b\x01'
+BUFFER_SIZE = 16 * 1024 * 1024
+
+# 2-bit codes -> count of A1 allele (bim column 5): 00 hom A1, 01 missing, 10 het, 11 hom A2
+CODE_TO_GENOTYPE = np.array([2, -1, 1, 0], dtype=np.int8)
+# every byte value -> its 4 genotypes, lowest bits first
+BYTE_LUT = CODE_TO_GENOTYPE[(np.arange(256)[:, None] >> (2 * np.arange(4))) & 3]
+
+
+def count_lines(path):
+    # count lines in large buffered blocks, without loading the file
+    n = 0
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(BUFFER_SIZE), b''):
+            n += block.count(b'\n')
+    return n
+
+
+def bytes_per_snp(n_samples):
+    # each SNP is a block of 2-bit genotypes, padded to whole bytes
+    return (n_samples + 3) // 4
+
+
+def check_bed(prefix, n_samples):
+    # validate magic number and size; returns number of SNPs
+    n_snps = count_lines('{}.bim'.format(prefix))
+    with open('{}.bed'.format(prefix), 'rb') as f:
+        if f.read(3) != BED_MAGIC:
+            sys.exit('ERROR: {}.bed is not a SNP-major plink .bed file\n'.format(prefix))
+    expected = len(BED_MAGIC) + n_snps * bytes_per_snp(n_samples)
+    if os.path.getsize('{}.bed'.format(prefix)) != expected:
+        sys.exit('ERROR: {}.bed size does not match {} SNPs x {} samples in .bim/.fam\n'.format(prefix, n_snps, n_samples))
+    return n_snps
+
+
+def merge_bfiles(prefixes, out):
+    """
+    Concatenate per-chromosome bfiles sharing one .fam into [out].bed/.bim/.fam.
+    SNP-major .bed payloads are just appended after a single magic header, so this is I/O-bound.
+    Returns the total number of SNPs.
+    """
+    fam = '{}.fam'.format(prefixes[0])
+    for prefix in prefixes[1:]:
+        if not filecmp.cmp(fam, '{}.fam'.format(prefix), shallow=False):
+            sys.exit('ERROR: {}.fam differs from {}; samples must be identical to merge natively (use --merge_method plink)\n'.format(prefix, fam))
+    n_samples = count_lines(fam)
+    n_snps = 0
+    with open('{}.bed'.format(out), 'wb') as bed, open('{}.bim'.format(out), 'wb') as bim:
+        bed.write(BED_MAGIC)
+        for prefix in prefixes:
+            n_snps += check_bed(prefix, n_samples)
+            with open('{}.bed'.format(prefix), 'rb') as f:
+                f.seek(len(BED_MAGIC))
+                shutil.copyfileobj(f, bed, BUFFER_SIZE)
+            with open('{}.bim'.format(prefix), 'rb') as f:
+                shutil.copyfileobj(f, bim, BUFFER_SIZE)
+    shutil.copyfile(fam, '{}.fam'.format(out))
+    return n_snps
+
+
+def decode(raw, n_samples, samples=None, dtype='int8', impute=False):
+    """
+    Decode packed .bed rows (n_snps x bytes_per_snp, uint8) into genotypes (n_snps x n_samples).
+    samples: optional positions of samples to keep, only their bytes are decoded
+    dtype: int8 (missing = -1) or float32/float64 (missing = NaN)
+    impute: replace missing genotypes with the SNP mean
+    """
+    if samples is None:
+        geno = BYTE_LUT[raw].reshape(raw.shape[0], -1)[:, :n_samples]
+    else:
+        samples = np.asarray(samples)
+        geno = CODE_TO_GENOTYPE[(raw[:, samples // 4] >> (2 * (samples % 4)).astype(np.uint8)) & 3]
+    if np.dtype(dtype).kind == 'f' or impute:
+        missing = geno < 0
+        geno = geno.astype(np.float32 if np.dtype(dtype).kind != 'f' else dtype)
+        geno[missing] = np.nan
+        if impute:
+            means = np.nanmean(np.where(missing.all(axis=1, keepdims=True), 0, geno), axis=1)
+            geno = np.where(missing, means[:, None], geno).astype(geno.dtype)
+            if np.dtype(dtype).kind != 'f':
+                # rounded means for integer output
+                geno = np.rint(geno).astype(dtype)
+    return geno
+
+
+def standardize(geno):
+    # per-SNP standardized genotypes (rows), missing (NaN) set to the mean; monomorphic SNPs become 0
+    mean = np.nanmean(geno, axis=1, keepdims=True)
+    geno = np.where(np.isnan(geno), mean, geno) - mean
+    std = np.sqrt((geno ** 2).mean(axis=1, keepdims=True))
+    return np.divide(geno, std, out=np.zeros_like(geno), where=std > 0)
+
+
+class BedReader(object):
+    """
+    Memory-mapped reader for a plink .bed/.bim/.fam triple.
+    Only the rows (SNPs) that are requested are paged in and decoded; the full matrix is never materialised.
+    """
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.bim = pd.read_csv('{}.bim'.format(prefix), sep=r'\s+', header=None,
+                               names=['CHR', 'SNP', 'CM', 'POS', 'A1', 'A2'],
+                               dtype={'CHR': str, 'SNP': str, 'A1': str, 'A2': str})
+        self.fam = pd.read_csv('{}.fam'.format(prefix), sep=r'\s+', header=None,
+                               names=['FID', 'IID', 'PAT', 'MAT', 'SEX', 'PHENO'], dtype=str)
+        self.n_snps = len(self.bim)
+        self.n_samples = len(self.fam)
+        check_bed(prefix, self.n_samples)
+        self.bed = np.memmap('{}.bed'.format(prefix), dtype=np.uint8, mode='r', offset=len(BED_MAGIC),
+                             shape=(self.n_snps, bytes_per_snp(self.n_samples)))
+
+    def snp_index(self, snps):
+        # positions of SNP IDs in the .bim, -1 if not found
+        index = pd.Index(self.bim['SNP'])
+        return index.get_indexer(snps)
+
+    def sample_index(self, iids):
+        # positions of sample IIDs in the .fam, -1 if not found
+        index = pd.Index(self.fam['IID'])
+        return index.get_indexer(iids)
+
+    def read(self, snps=None, samples=None, dtype='int8', impute=False):
+        """
+        Genotypes (len(snps) x len(samples)) as counts of A1.
+        snps/samples: positions (or boolean masks) in .bim/.fam; None for all
+        """
+        if snps is None:
+            raw = np.asarray(self.bed)
+        else:
+            raw = self.bed[np.asarray(snps)]
+        if samples is not None and np.asarray(samples).dtype == bool:
+            samples = np.flatnonzero(samples)
+        return decode(raw, self.n_samples, samples, dtype, impute)
+
+    def iter_blocks(self, snps=None, samples=None, block_size=1024, dtype='int8', impute=False):
+        # yield (snp positions, genotypes) blocks of at most block_size SNPs
+        if snps is None:
+            snps = np.arange(self.n_snps)
+        snps = np.asarray(snps)
+        if snps.dtype == bool:
+            snps = np.flatnonzero(snps)
+        for i in range(0, len(snps), block_size):
+            block = snps[i:i + block_size]
+            yield block, self.read(block, samples, dtype, impute)
+
+
+def read_individuals(path):
+    """
+    Individuals of a keep/exclude list: a table with a header naming IID (and FID) or ID (phenotype files,
+    subset-pop output), or a plink list without header, FID IID (or IID only) in the first columns.
+    Returns a frame with IID and, when given, FID.
+    """
+    table = pd.read_csv(path, sep=r'\s+', header=None, dtype=str, keep_default_na=False)
+    header = list(table.iloc[0]) if len(table) > 0 else []
+    if 'IID' in header or 'ID' in header or '#IID' in header:
+        table = table.iloc[1:]
+        table.columns = [x.lstrip('#') for x in header]
+        if 'IID' not in table.columns:
+            table = table.rename(columns={'ID': 'IID'})
+        return table[[x for x in ('FID', 'IID') if x in table.columns]].reset_index(drop=True)
+    if table.shape[1] == 1:
+        return pd.DataFrame({'IID': table[0]})
+    return pd.DataFrame({'FID': table[0], 'IID': table[1]})
+
+
+def sample_mask(fam, individuals, exclude=False):
+    # .fam rows listed in individuals (on FID and IID when the list has FIDs), or not listed with exclude
+    if 'FID' in individuals.columns:
+        listed = pd.MultiIndex.from_frame(fam[['FID', 'IID']]).isin(pd.MultiIndex.from_frame(individuals[['FID', 'IID']]))
+    else:
+        listed = fam['IID'].isin(individuals['IID']).to_numpy()
+    return ~listed if exclude else listed
+
+
+def repack(raw, samples):
+    """
+    Packed .bed rows (n_snps x bytes_per_snp, uint8) of the samples at the given sorted positions: their
+    2-bit codes are gathered and packed again four to a byte, padded with zero bits, without decoding.
+    """
+    codes = (raw[:, samples // 4] >> (2 * (samples % 4)).astype(np.uint8)) & 3
+    padding = -len(samples) % 4
+    if padding > 0:
+        codes = np.pad(codes, ((0, 0), (0, padding)))
+    codes = codes.reshape(raw.shape[0], -1, 4)
+    return (codes[:, :, 0] | (codes[:, :, 1] << 2) | (codes[:, :, 2] << 4) | (codes[:, :, 3] << 6)).astype(np.uint8)
+
+
+def subset_bfile(prefix, out, individuals, exclude=False):
+    """
+    Write [out].bed/.bim/.fam with the samples of [prefix] kept by individuals (or all others with exclude),
+    in .fam order like plink --keep/--exclude. The .bed is re-packed in blocks of about BUFFER_SIZE bytes read
+    from the memory map, so the work is I/O-bound. Returns (number of SNPs, number of samples kept).
+    """
+    fam = pd.read_csv('{}.fam'.format(prefix), sep=r'\s+', header=None, usecols=[0, 1], names=['FID', 'IID'],
+                      dtype=str, keep_default_na=False)
+    n_snps = check_bed(prefix, len(fam))
+    samples = np.flatnonzero(sample_mask(fam, individuals, exclude))
+    if len(samples) == 0:
+        raise Exception('no samples of {}.fam are left'.format(prefix))
+    block_size = max(1, BUFFER_SIZE // bytes_per_snp(len(fam)))
+    with open('{}.bed'.format(out), 'wb') as o:
+        o.write(BED_MAGIC)
+        if len(samples) == len(fam):
+            with open('{}.bed'.format(prefix), 'rb') as f:
+                f.seek(len(BED_MAGIC))
+                shutil.copyfileobj(f, o, BUFFER_SIZE)
+        elif n_snps > 0:
+            bed = np.memmap('{}.bed'.format(prefix), dtype=np.uint8, mode='r', offset=len(BED_MAGIC),
+                            shape=(n_snps, bytes_per_snp(len(fam))))
+            for i in range(0, n_snps, block_size):
+                o.write(repack(np.asarray(bed[i:i + block_size]), samples).tobytes())
+            del bed
+    shutil.copyfile('{}.bim'.format(prefix), '{}.bim'.format(out))
+    # .fam lines are copied as they are
+    with open('{}.fam'.format(prefix)) as f:
+        lines = f.readlines()
+    with open('{}.fam'.format(out), 'w') as o:
+        o.writelines(lines[i] for i in samples)
+    return n_snps, len(samples)
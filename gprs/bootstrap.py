@@ -0,0 +1,222 @@
+# Bootstrap confidence intervals and paired model comparisons for the prs-stat metrics
+import numpy as np
+import pandas as pd
+from gprs.parallel import check_status, run_functions
+from gprs.stats import MAX_ITER, MIDDLE_GROUP, TOP_GROUPS, covariate_design, h2l_r2
+
+BINARY_METRICS = ['AUC', 'PseudoR2', 'LiabilityR2'] + [name for (name, group) in TOP_GROUPS]
+QUANTITATIVE_METRICS = ['R2']
+# replicates weighted at once in one worker task, (replicates x samples) float arrays
+CHUNK_SIZE = 50
+
+
+def replicate_weights(rng, size, n):
+    # bootstrap resamples as (replicates x samples) counts: how often each sample is drawn
+    draws = rng.integers(0, n, size=(size, n)) + (np.arange(size) * n)[:, None]
+    return np.bincount(draws.ravel(), minlength=size * n).reshape(size, n).astype(np.float64)
+
+
+def ntile_bounds(length, groups, n=100):
+    # first and last rank of contiguous dplyr::ntile groups for a sample of this length
+    larger_size, smaller_size = -(-length // n), length // n
+    n_larger = length % n
+    threshold = larger_size * n_larger
+
+    def ranks(g):
+        if g <= n_larger:
+            return (g - 1) * larger_size + 1, g * larger_size
+        return threshold + (g - n_larger - 1) * smaller_size + 1, threshold + (g - n_larger) * smaller_size
+    return ranks(min(groups))[0], ranks(max(groups))[1]
+
+
+def weighted_auc(w, y, score, flip):
+    """
+    AUC of one score under each row of weights, from case weights times the control weight ranked below
+    (ties count half). The direction is fixed from the full sample, as pROC keeps the direction of the roc object.
+    """
+    order = np.argsort(-score if flip else score, kind='stable')
+    ordered = score[order]
+    starts = np.concatenate([[0], np.flatnonzero(np.diff(ordered)) + 1])
+    cases = np.add.reduceat(w[:, order] * y[order], starts, axis=1)
+    controls = np.add.reduceat(w[:, order] * (1 - y[order]), starts, axis=1)
+    below = np.cumsum(controls, axis=1) - controls
+    return (cases * (below + controls / 2)).sum(axis=1) / (cases.sum(axis=1) * controls.sum(axis=1))
+
+
+def weighted_top_odds(w, y, score):
+    """
+    Odds ratios of the TOP_GROUPS percentiles against the middle group for each row of weights.
+    A sample drawn c times fills c consecutive ranks of the resample, so the number of its copies in a
+    percentile group is the overlap of those ranks with the group's rank interval.
+    """
+    order = np.argsort(score, kind='stable')
+    counts = w[:, order]
+    cases = y[order]
+    last = np.cumsum(counts, axis=1)
+    first = last - counts + 1
+    length = int(round(w[0].sum()))
+
+    def cases_controls(groups):
+        lo, hi = ntile_bounds(length, groups)
+        copies = np.clip(np.minimum(last, hi) - np.maximum(first, lo) + 1, 0, None)
+        return copies @ cases, copies @ (1 - cases)
+    middle_cases, middle_controls = cases_controls(MIDDLE_GROUP)
+    odds = {}
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for name, group in TOP_GROUPS:
+            top_cases, top_controls = cases_controls(group)
+            odds[name] = (middle_controls * top_cases) / (middle_cases * top_controls)
+    return odds
+
+
+def weighted_logistic(w, y, design, start=None, tol=1e-8):
+    """
+    IRLS of y on design under each row of weights at once, from the coefficients `start` when given
+    (resamples are close to the full-sample fit, so few iterations are needed).
+    Returns coefficients (replicates x columns), linear predictors (replicates x samples), log-likelihoods.
+    """
+    eta = np.zeros(w.shape) if start is None else np.tile(design @ start, (w.shape[0], 1))
+    coef = None
+    deviance = np.full(w.shape[0], np.inf)
+    for _ in range(MAX_ITER):
+        mu = 1 / (1 + np.exp(-eta))
+        iw = np.clip(w * mu * (1 - mu), 1e-12, None)
+        information = (design.T * iw[:, None, :]) @ design
+        rhs = (iw * eta + w * (y - mu)) @ design
+        coef = np.linalg.solve(information, rhs[:, :, None])[:, :, 0]
+        eta = coef @ design.T
+        mu = np.clip(1 / (1 + np.exp(-eta)), 1e-15, 1 - 1e-15)
+        new_deviance = -2 * (w * (y * np.log(mu) + (1 - y) * np.log(1 - mu))).sum(axis=1)
+        converged = np.abs(new_deviance - deviance) / (np.abs(new_deviance) + 0.1) < tol
+        deviance = new_deviance
+        if converged.all():
+            break
+    return coef, eta, -deviance / 2
+
+
+def binary_metrics(w, y, covariates, scores, flips, pop_prev):
+    # {metric: (replicates x models)} for binary traits
+    n = w.sum(axis=1)
+    mu0 = (w @ y) / n
+    loglik0 = n * (mu0 * np.log(mu0) + (1 - mu0) * np.log(1 - mu0))
+    metrics = {x: np.empty((w.shape[0], scores.shape[1])) for x in BINARY_METRICS}
+    for i in range(scores.shape[1]):
+        design = np.column_stack([covariates, scores[:, i]])
+        start = weighted_logistic(np.ones((1, len(y))), y, design)[0][0]
+        coef, eta, loglik = weighted_logistic(w, y, design, start)
+        metrics['PseudoR2'][:, i] = (1 - np.exp(2 / n * (loglik0 - loglik))) / (1 - np.exp(2 / n * loglik0))
+        # squared weighted correlation of the linear predictor with the phenotype
+        eta_mean = (w * eta).sum(axis=1) / n
+        cov = (w * (eta - eta_mean[:, None]) * (y - mu0[:, None])).sum(axis=1)
+        var = (w * (eta - eta_mean[:, None]) ** 2).sum(axis=1)
+        metrics['LiabilityR2'][:, i] = h2l_r2(pop_prev, cov ** 2 / (var * n * mu0 * (1 - mu0)), mu0)
+        metrics['AUC'][:, i] = weighted_auc(w, y, scores[:, i], flips[i])
+        for name, odds in weighted_top_odds(w, y, scores[:, i]).items():
+            metrics[name][:, i] = odds
+    return metrics
+
+
+def quantitative_metrics(w, y, covariates, scores):
+    # {'R2': (replicates x models)}, weighted least squares from normal equations shared across models
+    k = covariates.shape[1]
+    y = y - y.mean()
+    n = w.sum(axis=1)
+    xtwx = (covariates.T * w[:, None, :]) @ covariates
+    xtwy = w @ (covariates * y[:, None])
+    ywy = w @ (y ** 2)
+    tss = ywy - (w @ y) ** 2 / n
+    r2 = np.empty((w.shape[0], scores.shape[1]))
+    for i in range(scores.shape[1]):
+        s = scores[:, i] - scores[:, i].mean()
+        a = np.empty((w.shape[0], k + 1, k + 1))
+        a[:, :k, :k] = xtwx
+        a[:, :k, k] = a[:, k, :k] = w @ (covariates * s[:, None])
+        a[:, k, k] = w @ (s ** 2)
+        rhs = np.column_stack([xtwy, w @ (s * y)])
+        coef = np.linalg.solve(a, rhs[:, :, None])[:, :, 0]
+        r2[:, i] = 1 - (ywy - (coef * rhs).sum(axis=1)) / tss
+    return {'R2': r2}
+
+
+def metrics(w, y, covariates, scores, family, flips, pop_prev):
+    if family == 'binary':
+        return binary_metrics(w, y, covariates, scores, flips, pop_prev)
+    return quantitative_metrics(w, y, covariates, scores)
+
+
+def bootstrap_chunk(seed, size, y, covariates, scores, family, flips, pop_prev):
+    # one worker task: `size` replicates drawn from its own seed sequence
+    w = replicate_weights(np.random.default_rng(seed), size, len(y))
+    return metrics(w, y, covariates, scores, family, flips, pop_prev)
+
+
+def bootstrap(scores, pheno, family, pop_prev=None, replicates=1000, seed=1, jobs=1, chunk_size=CHUNK_SIZE):
+    """
+    Bootstrap the prs-stat metrics of every model on the same resamples, so models can be compared pairwise.
+    scores: {model: DataFrame from read_scores}; pheno: DataFrame from read_pheno.
+    Only individuals present in the phenotype file and in every score, with all covariates, are used.
+    Replicates are split in chunks, each with a child of SeedSequence(seed), so results do not depend on jobs.
+    Returns model names, {metric: estimates (models)}, {metric: (replicates x models)}.
+    """
+    models = list(scores)
+    # every metric is taken on the resampled rows of one covariate design
+    pheno = pheno.dropna().reset_index(drop=True)
+    ids = pd.Index(pheno['ID'])
+    for model in models:
+        ids = ids.intersection(pd.Index(scores[model]['ID']), sort=False)
+    print('{} individuals with phenotype and all {} scores'.format(len(ids), len(models)))
+    subset = pheno.set_index('ID').loc[ids].reset_index()
+    covariates = covariate_design(subset)
+    s = np.column_stack([scores[x].drop_duplicates('ID').set_index('ID').loc[ids, 'SCORE_STD'].to_numpy(np.float64) for x in models])
+    if family == 'binary':
+        y = (subset['PHENO'] == subset['PHENO'].max()).to_numpy(np.float64)
+        flips = np.median(s[y == 0], axis=0) > np.median(s[y == 1], axis=0)
+    else:
+        y = subset['PHENO'].to_numpy(np.float64)
+        flips = np.zeros(len(models), dtype=bool)
+    estimates = {x: v[0] for (x, v) in metrics(np.ones((1, len(y))), y, covariates, s, family, flips, pop_prev).items()}
+
+    sizes = [min(chunk_size, replicates - x) for x in range(0, replicates, chunk_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    calls = [(str(i), bootstrap_chunk, (seeds[i], sizes[i], y, covariates, s, family, flips, pop_prev), sizes[i])
+             for i in range(len(sizes))]
+    status, results = run_functions(calls, jobs)
+    check_status(status, 'bootstrap')
+    samples = {x: np.concatenate([results[str(i)][x] for i in range(len(sizes))]) for x in estimates}
+    return models, estimates, samples
+
+
+def confidence_intervals(models, estimates, samples, level=0.95):
+    # percentile intervals; replicates where a metric is undefined (e.g. no control in a top group) are left out
+    rows = []
+    alpha = (1 - level) / 2 * 100
+    for metric in estimates:
+        values = np.where(np.isfinite(samples[metric]), samples[metric], np.nan)
+        lower, upper = np.nanpercentile(values, [alpha, 100 - alpha], axis=0)
+        se = np.nanstd(values, axis=0, ddof=1)
+        for i, model in enumerate(models):
+            rows.append([model, metric, estimates[metric][i], se[i], lower[i], upper[i], int(np.isfinite(values[:, i]).sum())])
+    return pd.DataFrame(rows, columns=['Model', 'Metric', 'Estimate', 'SE', 'Lower', 'Upper', 'Replicates'])
+
+
+def paired_tests(models, estimates, samples, level=0.95):
+    """
+    Each model against the best model of every metric, from the differences on the same replicates:
+    percentile interval of the difference, and two-sided P as twice the smaller tail beyond zero.
+    """
+    rows = []
+    alpha = (1 - level) / 2 * 100
+    for metric in estimates:
+        values = np.where(np.isfinite(samples[metric]), samples[metric], np.nan)
+        best = int(np.nanargmax(np.where(np.isfinite(estimates[metric]), estimates[metric], np.nan)))
+        for i, model in enumerate(models):
+            if i == best:
+                continue
+            diff = values[:, best] - values[:, i]
+            diff = diff[~np.isnan(diff)]
+            if len(diff) == 0:
+                continue
+            lower, upper = np.percentile(diff, [alpha, 100 - alpha])
+            p = min(1.0, 2 * min((diff <= 0).mean(), (diff >= 0).mean()))
+            rows.append([metric, models[best], model, estimates[metric][best] - estimates[metric][i], lower, upper, p])
+    return pd.DataFrame(rows, columns=['Metric', 'Best', 'Model', 'Difference', 'Lower', 'Upper', 'P'])
@@ -28,7 +28,10 @@ def main():
 @click.option('--neff', metavar='<str>', default=None, help='Column header name for EFFECTIVE SAMPLE SIZE in sumstat')
 @click.option('--total', metavar='<int>', default=0, help='Total sample size for quantitative trait; DO NOT use with --Neff or --case_control')
 @click.option('--case_control', metavar='<int>', nargs=2, default=(0,0), help='Case and control sample size for binary trait, separated by a space (order does not matter); DO NOT use with --Neff or --total')
-def prepare_sumstat( file, sumstat, comment, symbol, out, snpid, chr, pos, ea, nea,  beta, se, pval, neff, total, case_control ):
+@click.option('--chunksize', metavar='<int>', default=1000000, help='Number of rows read at a time, so memory stays flat for large (or gzipped) summary statistics; 0 reads the whole file at once. default = 1000000')
+@click.option('--out_format', type=click.Choice(['tsv', 'parquet', 'both']), default='tsv', help='Output format: tab-separated .csv (default), per-chromosome .parquet partitions (requires pyarrow), or both')
+@click.option( '--force', is_flag=True, default=False, help='rebuild outputs even when the manifest shows their inputs and options are unchanged' )
+def prepare_sumstat( file, sumstat, comment, symbol, out, snpid, chr, pos, ea, nea,  beta, se, pval, neff, total, case_control, chunksize, out_format, force):
    gprs = GPRS()
    gprs.prepare_sumstat(file=file,
                         sumstat=sumstat,
@@ -36,7 +39,13 @@ def prepare_sumstat( file, sumstat, comment, symbol, out, snpid, chr, pos, ea, n
                         out=out,
                         symbol=symbol,
                         snpid=snpid, chr=chr, pos=pos, ea=ea, nea=nea, beta=beta, se=se, pval=pval, neff=neff,
-                        total=total, case_control=case_control)
+                        total=total, case_control=case_control, chunksize=chunksize, out_format=out_format, force=force)
+
+@click.command()
+@click.option('--sumstat', metavar='<str>', required=True, help='prefix of parquet summary statistics in sumstat folder to export as tab-separated .csv')
+def export_sumstat(sumstat):
+    gprs = GPRS()
+    gprs.export_sumstat(sumstat=sumstat)
 
 # @click.command()
 # @click.option( '--ref', metavar='<str>', help='path to population reference panel' )
@@ -102,21 +111,33 @@ def prepare_sumstat( file, sumstat, comment, symbol, out, snpid, chr, pos, ea, n
 @click.option( '--symbol', metavar='<str/int>', default='.', help='indicate the symbol or text after chrnb in vcf file, default = "." ; i.e. ALL.chr8.vcf.gz, you can put "." or ".vcf.gz"' )
 @click.option( '--extra_commands', metavar='<str>', default=' ', help='argument to add for plink 1 make-bed function' )
 @click.option('--merge/--no-merge', default=True, help='Whether to keep or skip merging step; use with --no-merge flag if not using LDPred2 model')
-def generate_plink_bfiles( merge, ref, sumstat, out, symbol,extra_commands):
+@click.option( '--jobs', metavar='<int>', default=1, help='number of chromosomes to run in parallel; default = 1' )
+@click.option( '--threads', metavar='<int>', default=None, type=int, help='total number of threads shared by all parallel plink jobs (passed as --threads)' )
+@click.option( '--memory', metavar='<int>', default=None, type=int, help='total memory in MB shared by all parallel plink jobs (passed as --memory)' )
+@click.option('--ref_cache/--no-ref_cache', default=True, help='Convert each reference VCF to bfiles once (cached in result/plink/ref_cache) and extract SNPs from the cached copy; use --no-ref_cache to read the VCF every time')
+@click.option('--merge_method', type=click.Choice(['native', 'plink']), default='native', help='native: concatenate per-chromosome .bed/.bim files directly (default); plink: use plink --merge-list')
+@click.option( '--force', is_flag=True, default=False, help='rebuild outputs even when the manifest shows their inputs and options are unchanged' )
+def generate_plink_bfiles( merge, ref, sumstat, out, symbol,extra_commands, jobs, threads, memory, ref_cache, merge_method, force):
     gprs = GPRS( ref=ref)
-    gprs.generate_plink_bfiles( merge = merge, out = out, symbol = symbol, sumstat=sumstat, extra_commands=extra_commands )
+    gprs.generate_plink_bfiles( merge = merge, out = out, symbol = symbol, sumstat=sumstat, extra_commands=extra_commands,
+                                jobs=jobs, threads=threads, memory=memory, ref_cache=ref_cache, merge_method=merge_method, force=force )
 
 @click.command()
 @click.option( '--plink_bfile_name', metavar='<str>', required=True, help='plink_bfile_name is [output_name] from [chrnb]_[output_name].bim/bed/fam' )
 @click.option( '--output_name', metavar='<str>', required=True, help='it is better if the output_name remain the same. The clump output: [chrnb]_[output_name]_clumped_snplist.csv' )
-@click.option( '--clump_kb', metavar='<int>', required=True, help='distance(kb) parameter for clumping' )
-@click.option( '--clump_p1', metavar='<float/scientific notation>', required=True, help='first set of P-value for clumping' )
+@click.option( '--clump_kb', metavar='<int>', required=True, help='distance(kb) parameter for clumping; a space-separated list (i.e. "250 500") clumps a grid sharing one LD computation' )
+@click.option( '--clump_p1', metavar='<float/scientific notation>', required=True, help='first set of P-value for clumping; may be a space-separated list for grid mode' )
 @click.option( '--clump_p2', metavar='<float/scientific notation>', required=True, help='should equals to p1 reduce the snps' )
-@click.option( '--clump_r2', metavar='<float>', default=0.1, help='r2 value for clumping, default = 0.1' )
+@click.option( '--clump_r2', metavar='<float>', default=0.1, help='r2 value for clumping, default = 0.1; may be a space-separated list for grid mode' )
 @click.option( '--clump_field', metavar='<str>', default='Pvalue', help='P-value column name, default = Pvalue' )
 @click.option( '--sumstat', metavar='<str>', required=True, help='[output_name] from [output_name]_[chrnb].csv in sumstat directory' )
 @click.option( '--clump_snp_field', metavar='<str>', default='SNPID', help='SNP ID column name, default = SNPID' )
-def clump(sumstat, plink_bfile_name, clump_kb, clump_p1, clump_p2, output_name, clump_r2, clump_field, clump_snp_field):
+@click.option( '--jobs', metavar='<int>', default=1, help='number of chromosomes to run in parallel; default = 1' )
+@click.option( '--threads', metavar='<int>', default=None, type=int, help='total number of threads shared by all parallel plink jobs (passed as --threads)' )
+@click.option( '--memory', metavar='<int>', default=None, type=int, help='total memory in MB shared by all parallel plink jobs (passed as --memory)' )
+@click.option( '--force', is_flag=True, default=False, help='rebuild outputs even when the manifest shows their inputs and options are unchanged' )
+@click.option( '--engine', type=click.Choice(['plink', 'native']), default='plink', help='plink --clump (plink --r2 in grid mode), or native clumping (and grid LD) from the bfile genotypes in parallel processes; default = plink' )
+def clump(sumstat, plink_bfile_name, clump_kb, clump_p1, clump_p2, output_name, clump_r2, clump_field, clump_snp_field, jobs, threads, memory, force, engine):
     gprs = GPRS()
     gprs.clump( sumstat=sumstat,
                 plink_bfile_name=plink_bfile_name,
@@ -126,7 +147,8 @@ def clump(sumstat, plink_bfile_name, clump_kb, clump_p1, clump_p2, output_name,
                 output_name=output_name,
                 clump_r2=clump_r2,
                 clump_field=clump_field,
-                clump_snp_field=clump_snp_field )
+                clump_snp_field=clump_snp_field,
+                jobs=jobs, threads=threads, memory=memory, force=force, engine=engine )
 @click.command()
 @click.option( '--sumstat', metavar='<str>', required=True, help='[output_name] from [output_name]_[chrnb].csv in sumstat directory' )
 @click.option( '--clump_file_name', metavar='<str>', required=True, help='clump_file_name is [output_name] from [chrnb]_[output_name].clump' )
@@ -135,10 +157,35 @@ def clump(sumstat, plink_bfile_name, clump_kb, clump_p1, clump_p2, output_name,
 @click.option( '--clump_p1', metavar='<float/scientific notation>', required=True, help='first set of P-value for clumping' )
 @click.option( '--clump_r2', metavar='<float>', required=True, help='r2 value for clumping' )
 @click.option('--clumpfolder_name',metavar='<str>', required=True, help='folder name for .clump files')
-def select_clump_snps(clump_file_name, sumstat,output_name,clump_kb,clump_p1,clump_r2, clumpfolder_name):
+@click.option( '--force', is_flag=True, default=False, help='rebuild outputs even when the manifest shows their inputs and options are unchanged' )
+@click.option( '--batch', is_flag=True, default=False, help='resolve all clump conditions against one sumstat read per chromosome, without snplist files; implied when clump_kb/clump_p1/clump_r2 are space-separated lists' )
+def select_clump_snps(clump_file_name, sumstat,output_name,clump_kb,clump_p1,clump_r2, clumpfolder_name, force, batch):
     gprs = GPRS()
     gprs.select_clump_snps( sumstat=sumstat, clump_file_name=clump_file_name, output_name=output_name,
-                            clump_kb=clump_kb,clump_p1=clump_p1,clump_r2=clump_r2,clumpfolder_name=clumpfolder_name)
+                            clump_kb=clump_kb,clump_p1=clump_p1,clump_r2=clump_r2,clumpfolder_name=clumpfolder_name, force=force, batch=batch)
+
+@click.command()
+@click.option( '--bfile', metavar='<str>', required=True, help='prefix to the LD reference plink file including path')
+@click.option( '--sumstat', metavar='<str>', required=True, help='prefix to by-chromosome summary statistics from prepare-sumstat' )
+@click.option( '--out', metavar='<str>', default='', help='save the estimates as ./result/ld/[out].ldsc' )
+@click.option( '--window', metavar='<float>', default=3000, help='LD window size in --unit; default=3000' )
+@click.option( '--unit', type=click.Choice(['kb', 'cm']), default='kb', help='window unit, kb (bp positions) or cm (genetic positions of the .bim); default=kb' )
+@click.option( '--jobs', metavar='<int>', default=1, help='number of chromosomes computed in parallel; default=1' )
+def ldsc(bfile, sumstat, out, window, unit, jobs):
+    gprs = GPRS()
+    gprs.ldsc( bfile=bfile, sumstat=sumstat, out=out, window=window, unit=unit, jobs=jobs )
+
+@click.command()
+@click.option( '--bfile', metavar='<str>', required=True, help='prefix to the LD reference plink file including path')
+@click.option( '--sumstat', metavar='<str>', default='', help='prefix to by-chromosome summary statistics from prepare-sumstat; LD is computed for its SNPs' )
+@click.option( '--snplist', metavar='<str>', default='', help='file with SNP IDs in the first column; LD is computed for these SNPs. Without --sumstat/--snplist all reference SNPs are used' )
+@click.option( '--window', metavar='<float>', default=3000, help='LD window size in --unit; default=3000' )
+@click.option( '--unit', type=click.Choice(['kb', 'cm']), default='kb', help='window unit, kb (bp positions) or cm (genetic positions of the .bim); default=kb' )
+@click.option( '--jobs', metavar='<int>', default=1, help='number of chromosomes computed in parallel; default=1' )
+@click.option( '--block_size', metavar='<int>', default=1024, help='number of SNPs decoded and correlated at a time; default=1024' )
+def build_ld(bfile, sumstat, snplist, window, unit, jobs, block_size):
+    gprs = GPRS()
+    gprs.build_ld( bfile=bfile, sumstat=sumstat, snplist=snplist, window=window, unit=unit, jobs=jobs, block_size=block_size )
 
 @click.command()
 @click.option( '--bfile', metavar='<str>', required=True, help='prefix to all chromosome-merged plink file for training sample including path')
@@ -146,9 +193,16 @@ def select_clump_snps(clump_file_name, sumstat,output_name,clump_kb,clump_p1,clu
 @click.option( '--LDmatrix', metavar='<str>', default='./tmp-data/LD_matrix', help='Path to save the LD matrix')
 @click.option( '--sumstat', metavar='<str>', required=True, help='prefix to GWAS by-chromosome summary statistics including full path')
 @click.option( '--out', metavar='<str>', required=True, help='directory name to output beta files')
-@click.option( '--r', metavar='<str>', required=True, help='path for R program. Use "which R" in linux to check')
-@click.option( '--h2', metavar='<float>', default='', help='heritability estimate')
-def ldpred2_train(bfile, ldref, ldmatrix, sumstat, out, r, h2):
+@click.option( '--r', metavar='<str>', default='R', help='path for R program. Use "which R" in linux to check; default="R"')
+@click.option( '--h2', metavar='<float>', default='', help='heritability estimate, or "ldsc" to estimate it with gprs LDSC from the LD store (result/ld), in the 3 cM window of ldpred2.R for the R engine when the .bim has genetic positions; the python engine estimates it when not given')
+@click.option( '--engine', type=click.Choice(['R', 'python']), default='R', help='R runs ldpred2.R (inf, grid and auto models); python runs the inf and grid models on the LD store (result/ld), with a Python Gibbs loop of about 2-10 CPU-hours for 1M SNPs and the 102-point grid, slower than bigsnpr; default="R"')
+@click.option( '--window', metavar='<float>', default=3000, help='python engine: LD window size (R engine: of --h2 ldsc when the .bim has no genetic positions, 3 cM otherwise); default=3000' )
+@click.option( '--unit', type=click.Choice(['kb', 'cm']), default='kb', help='python engine, and --h2 ldsc of the R engine without genetic positions: unit of the LD window; default="kb"' )
+@click.option( '--jobs', metavar='<int>', default=1, help='number of worker processes: chromosomes and grid points of the python engine, LD scores of --h2 ldsc; default=1' )
+@click.option( '--burn_in', metavar='<int>', default=50, help='python engine: Gibbs sampler burn-in iterations; default=50' )
+@click.option( '--num_iter', metavar='<int>', default=100, help='python engine: Gibbs sampler iterations averaged; default=100' )
+@click.option( '--seed', metavar='<int>', default=1, help='python engine: random seed; default=1' )
+def ldpred2_train(bfile, ldref, ldmatrix, sumstat, out, r, h2, engine, window, unit, jobs, burn_in, num_iter, seed):
     gprs=GPRS()
     gprs.ldpred2_train(bfile=bfile, 
                         ldref=ldref,
@@ -156,7 +210,14 @@ def ldpred2_train(bfile, ldref, ldmatrix, sumstat, out, r, h2):
                         sumstat=sumstat,
                         out=out,
                         r=r,
-                        h2=h2)
+                        h2=h2,
+                        engine=engine,
+                        window=window,
+                        unit=unit,
+                        jobs=jobs,
+                        burn_in=burn_in,
+                        num_iter=num_iter,
+                        seed=seed)
 
 
 @click.command()
@@ -169,16 +230,19 @@ def beta_list(beta_dirs, out):
 @click.command()
 @click.option( '--vcf_dir', metavar='<str>', required=True, help='path to directories containing vcf files')
 @click.option( '--beta_dir_list', metavar='<str>', required=True, help='dictionary = of beta directories created from beta-list function; in ./result/prs by default')
-@click.option( '--slurm_name', metavar='<str>', required=True, help='slurm job name')
+@click.option( '--executor', type=click.Choice(['slurm', 'local', 'dry-run']), default='slurm', help='run build-prs tasks as a SLURM array job, as local processes, or only print them; default="slurm"')
+@click.option( '--slurm_name', metavar='<str>', default='gprs_prs', help='slurm job name; default="gprs_prs"')
 @click.option( '--slurm_account', metavar='<str>', default='chia657_28', help='slurm job account; default="chia657_28" ')
 @click.option( '--slurm_time', metavar='<str>', default='12:00:00', help='slurm job time; default="12:00:00" ')
-@click.option( '--memory', metavar='<int>',default=10, help='slurm job memory in GB; default="10" ')
+@click.option( '--slurm_setup', metavar='<str>', default='module load usc\nmodule load plink2\nsource ./venv/bin/activate', help='shell lines run before gprs in each slurm task')
+@click.option( '--memory', metavar='<int>',default=10, help='memory budget per task in GB; models are packed into tasks by their estimated memory; default="10" ')
 @click.option( '--symbol', metavar='<str>', default='.', help='symbol or text after chrnb in vcf file, default = "." ; i.e. ALL.chr8.vcf.gz, you can put "." or ".vcf.gz"')
 @click.option( '--columns', metavar='<int>', default='1 4 6', help='a column index indicate the [SNPID] [ALLELE] [BETA] position; column nb starts from 1; default="1 4 6"' )
 @click.option( '--plink_modifier', metavar='<str>', default="'no-mean-imputation' 'cols='nmissallele,dosagesum,scoresums", help='plink2 modifier for score function')
 @click.option( '--combine', metavar='<str>',  default='T', help='whether to combine scores per chromosomes to generate a final genome-wide PRS (T/F); default="T" ')
 @click.option( '--out', metavar='<str>', required=True, default='', help='directory name to output PRS')
-def multiple_prs(vcf_dir, beta_dir_list, slurm_name, slurm_account, slurm_time, memory, symbol, columns, plink_modifier, combine, out):
+@click.option( '--force', is_flag=True, default=False, help='rebuild outputs even when the manifest shows their inputs and options are unchanged' )
+def multiple_prs(vcf_dir, beta_dir_list, executor, slurm_name, slurm_account, slurm_time, slurm_setup, memory, symbol, columns, plink_modifier, combine, out, force):
     gprs=GPRS()
     gprs.multiple_prs( vcf_dir=vcf_dir,
                         beta_dir_list=beta_dir_list,
@@ -190,7 +254,15 @@ def multiple_prs(vcf_dir, beta_dir_list, slurm_name, slurm_account, slurm_time,
                         columns=columns,
                         plink_modifier=plink_modifier,
                         combine=combine,
-                        out=out)
+                        out=out,
+                        executor=executor,
+                        slurm_setup=slurm_setup, force=force)
+
+@click.command()
+@click.option( '--out', metavar='<str>', required=True, help='output directory given to multiple-prs')
+def multiple_prs_status(out):
+    gprs=GPRS()
+    gprs.multiple_prs_status( out=out )
 
 @click.command()
 @click.option( '--vcf_dir', metavar='<str>', required=True, help='path to vcf files' )
@@ -202,7 +274,8 @@ def multiple_prs(vcf_dir, beta_dir_list, slurm_name, slurm_account, slurm_time,
 @click.option( '--columns', metavar='<int>', default='1 2 3', help='a column index indicate the [SNPID] [ALLELE] [BETA] position; column nb starts from 1 ' )
 @click.option( '--plink_modifier', metavar='<str>', default='no-mean-imputation', help='no-mean-imputation as default in here, get more info by searching plink2.0 modifier ' )
 @click.option( '--combine', metavar='<str>', required=True, default='T', help='whether to combine scores per chromosomes to generate a final genome-wide PRS (T/F); default="T" ')
-def build_prs(vcf_dir, model, beta_dir_list, memory, out, symbol, columns, plink_modifier, combine):
+@click.option( '--force', is_flag=True, default=False, help='rebuild outputs even when the manifest shows their inputs and options are unchanged' )
+def build_prs(vcf_dir, model, beta_dir_list, memory, out, symbol, columns, plink_modifier, combine, force):
     gprs = GPRS()
     gprs.build_prs( vcf_dir=vcf_dir,
                     model=model,
@@ -212,7 +285,26 @@ def build_prs(vcf_dir, model, beta_dir_list, memory, out, symbol, columns, plink
                     symbol=symbol,
                     columns=columns,
                     plink_modifier=plink_modifier,
-                    combine=combine)
+                    combine=combine, force=force)
+
+@click.command()
+@click.option( '--vcf_dir', metavar='<str>', required=True, help='path to vcf files' )
+@click.option( '--beta_dir_list', metavar='<str>', required=True, help='dictionary of beta directories created from beta-list function; all models in it are scored together')
+@click.option( '--out', metavar='<str>', default='', help='directory name in ./result/prs to output PRS')
+@click.option( '--symbol', metavar='<str/int>', default='.', help='indicate the symbol or text after chrnb in vcf file, default = "." ; i.e. ALL.chr8.vcf.gz, you can put "." or ".vcf.gz"' )
+@click.option( '--columns', metavar='<int>', default='1 4 6', help='a column index indicate the [SNPID] [ALLELE] [BETA] position; column nb starts from 1; default="1 4 6"' )
+@click.option( '--block_size', metavar='<int>', default=512, help='number of variants decoded at a time; default=512' )
+@click.option( '--threads', metavar='<int>', default=4, help='threads decompressing bgzipped vcf blocks; default=4' )
+@click.option( '--force', is_flag=True, default=False, help='rebuild outputs even when the manifest shows their inputs and options are unchanged' )
+def batch_prs(vcf_dir, beta_dir_list, out, symbol, columns, block_size, threads, force):
+    gprs = GPRS()
+    gprs.batch_prs( vcf_dir=vcf_dir,
+                    beta_dir_list=beta_dir_list,
+                    out=out,
+                    symbol=symbol,
+                    columns=columns,
+                    block_size=block_size,
+                    threads=threads, force=force)
 
 @click.command()
 @click.option( '--filename', metavar='<str>', required=True, help='name of .sscore, i.e.  chr10_geneatlas_500_1e-7_0.05.sscore, The file name here is "geneatlas"')
@@ -224,41 +316,66 @@ def combine_prs(filename,clump_kb,clump_p1,clump_r2):
     gprs.combine_prs( filename=filename,clump_kb=clump_kb,clump_p1=clump_p1,clump_r2=clump_r2)
 
 @click.command()
-@click.option( '--score', metavar='<str>', required=True, help='the absolute path to combined .sscore file')
+@click.option( '--score', metavar='<str>', required=True, help='the absolute path to combined .sscore file, or a directory of .sscore files to evaluate together (python engine; models named after the files)')
 @click.option( '--pheno', metavar='<str>', required=True, help='the absolute path to pheno file')
 @click.option( '--data', metavar='<str>', required=True, help='output directory name to save the statistics. Recommended to keep it the same for one dataset for combine-stat function')
-@click.option( '--model', metavar='<str>', required=True, help=' model name for output. Recommended to include parameters for the model used to build PRS')
-@click.option( '--r', metavar='<str>', required=True, help='use "which R" in linux, and copy the path after --r_command')
+@click.option( '--model', metavar='<str>', default='', help=' model name for output. Recommended to include parameters for the model used to build PRS. Required for a single .sscore file')
+@click.option( '--r', metavar='<str>', default='R', help='use "which R" in linux, and copy the path after --r_command. Only used with --engine R')
 @click.option('--binary/--quantitative', default=False, help='whether phenotype is binary or quantitative; default: --quantitative')
 @click.option( '--pop_prev', metavar='<str>', default='NA', help='population prevalence for binary trait. Required for binary trait but leave it blank or enter NA for quantitative trait')
 @click.option( '--plotroc/--no_plot', metavar='<str>', default=False, help='whether to plot ROC curve for binary trait. Leave it blank or --no_plot for quantitative trait')
-def prs_stat(score, pheno, model, data, r, binary, pop_prev, plotroc):
+@click.option( '--engine', type=click.Choice(['python', 'R']), default='python', help='python: evaluate in-process, all models at once, leaving individuals with missing covariates out of the regressions only, as glm in prs_stat.R; R: run prs_stat.R; default=python' )
+@click.option( '--force', is_flag=True, default=False, help='rebuild outputs even when the manifest shows their inputs and options are unchanged' )
+def prs_stat(score, pheno, model, data, r, binary, pop_prev, plotroc, engine, force):
     gprs = GPRS()
     gprs.prs_stat( score=score,
                          pheno=pheno,
                          model=model,
                          data=data,
                          r=r,
-                         binary=binary,pop_prev=pop_prev,plotroc=plotroc)
+                         binary=binary,pop_prev=pop_prev,plotroc=plotroc, force=force, engine=engine)
 
 
+@click.command()
+@click.option( '--score', metavar='<str>', required=True, help='directory of .sscore files; every model is resampled on the same individuals')
+@click.option( '--pheno', metavar='<str>', required=True, help='the absolute path to pheno file')
+@click.option( '--data', metavar='<str>', required=True, help='output directory name in ./result/stat, saved as bootstrap.ci, bootstrap.paired and bootstrap.npz')
+@click.option('--binary/--quantitative', default=False, help='whether phenotype is binary or quantitative; default: --quantitative')
+@click.option( '--pop_prev', metavar='<str>', default='NA', help='population prevalence for binary trait. Required for binary trait')
+@click.option( '--replicates', metavar='<int>', default=1000, help='number of bootstrap replicates; default=1000' )
+@click.option( '--seed', metavar='<int>', default=1, help='random seed; the replicates do not depend on --jobs; default=1' )
+@click.option( '--level', metavar='<float>', default=0.95, help='confidence level of the intervals; default=0.95' )
+@click.option( '--jobs', metavar='<int>', default=1, help='number of worker processes; default=1' )
+@click.option( '--force', is_flag=True, default=False, help='rebuild outputs even when the manifest shows their inputs and options are unchanged' )
+def bootstrap_stat(score, pheno, data, binary, pop_prev, replicates, seed, level, jobs, force):
+    gprs = GPRS()
+    gprs.bootstrap_stat( score=score, pheno=pheno, data=data, binary=binary, pop_prev=pop_prev,
+                         replicates=replicates, seed=seed, level=level, jobs=jobs, force=force)
+
 @click.command()
 @click.option( '--data', metavar='<str>', required=True, help='directory in ./result/stat to combine the statistics.' )
-def combine_stat(data):
+@click.option( '--metric', metavar='<str>', default=None, help='also list the best models by this metric, e.g. AUC, PseudoR2, R2 or P' )
+@click.option( '--top', metavar='<int>', default=10, help='number of best models to list with --metric; default=10' )
+def combine_stat(data, metric, top):
     gprs = GPRS()
-    gprs.combine_stat( data=data )
+    gprs.combine_stat( data=data, metric=metric, top=top )
 
 ## Optional function here
 @click.command()
-@click.option('--qc_file_name', metavar='<str>', help='qc_file_name is [output_name] from [chrnb]_[output_name].QC.csv')
-def transfer_atcg(qc_file_name):
+@click.option('--sumstat', metavar='<str>', required=True, help='prefix to the by-chromosome summary statistics from prepare-sumstat including path, i.e. result/sumstat/[out]')
+@click.option('--bfile', metavar='<str>', required=True, help='prefix to the all chromosome-merged reference plink file; only its .bim is read')
+@click.option('--out', metavar='<str>', required=True, help='name of the harmonised summary statistics, saved as result/sumstat/[out]_chr[nb]')
+@click.option('--palindromic', type=click.Choice(['drop', 'keep']), default='drop', help='drop A/T and C/G SNPs, or keep them assuming the reference strand; default="drop"')
+@click.option('--jobs', metavar='<int>', default=1, help='number of chromosomes harmonised in parallel; default=1')
+@click.option('--force', is_flag=True, default=False, help='rebuild outputs even when the manifest shows their inputs and options are unchanged' )
+def transfer_atcg(sumstat, bfile, out, palindromic, jobs, force):
     gprs = GPRS()
-    gprs.transfer_atcg(qc_file_name=qc_file_name)
+    gprs.transfer_atcg(sumstat=sumstat, bfile=bfile, out=out, palindromic=palindromic, jobs=jobs, force=force)
 
 @click.command()
 @click.option('--input_data', metavar='<str>', required=True, help='The full path to phenotype file (contains the population information)')
 @click.option('--column_name', metavar='<str>', required=True, help='The header of population column')
-@click.option('--pop_info', metavar='<str>', required=True, help='The target population to extract')
+@click.option('--pop_info', metavar='<str>', required=True, help='The target population to extract (several separated by commas)')
 @click.option('--output_name', metavar='<str>', required=True, help='file name for subset population')
 def subset_pop(input_data, pop_info, output_name, column_name):
     gprs = GPRS()
@@ -270,12 +387,14 @@ def subset_pop(input_data, pop_info, output_name, column_name):
 @click.command()
 @click.option('--popfile', metavar='<str>', required=True, help='pop file with full path and file extension')
 @click.option('--bfile_name', metavar='<str>', required=True, help='the bfile name')
-@click.option('--plink_command', metavar='<str>', required=True, help='--keep or --exclude')
-@click.option('--output_name', metavar='<str>', help='output name for sub-set population bfile')
-def generate_plink_bfiles_w_individual_info(popfile, bfile_name, output_name, plink_command):
+@click.option('--plink_command', metavar='<str>', default='--keep', help='--keep or --exclude')
+@click.option('--output_name', metavar='<str>', required=True, help='output name for sub-set population bfile')
+@click.option('--jobs', metavar='<int>', default=1, help='number of chromosomes subset in parallel')
+@click.option('--force', is_flag=True, default=False, help='rebuild outputs even when the manifest shows their inputs and options are unchanged' )
+def generate_plink_bfiles_w_individual_info(popfile, bfile_name, output_name, plink_command, jobs, force):
     gprs = GPRS()
     gprs.generate_plink_bfiles_w_individual_info(output_name=output_name, bfile_name=bfile_name,
-                                                 popfile=popfile, plink_command=plink_command)
+                                                 popfile=popfile, plink_command=plink_command, jobs=jobs, force=force)
 
 @click.command()
 @click.option('--fam_dir', metavar='<str>', required=True, help='the path to .fam')
@@ -332,19 +451,25 @@ def filtered_sscore_w_indv(data_set_name, clump_kb, clump_p1, clump_r2, indv, ou
                            clump_p1=clump_p1, clump_r2=clump_r2, indv=indv, output_name=output_name)
 
 # main.add_command( test )
+main.add_command( batch_prs )
 main.add_command( beta_list )
 main.add_command( build_prs )
 main.add_command( clump )
 main.add_command( combine_prs )
 main.add_command( combine_stat)
 #main.add_command( geneatlas_filter_data )
+main.add_command( export_sumstat )
 main.add_command( generate_plink_bfiles )
 main.add_command( generate_plink_bfiles_w_individual_info )
 #main.add_command( gwas_filter_data )
+main.add_command( build_ld )
+main.add_command( ldsc )
 main.add_command( ldpred2_train )
 main.add_command( multiple_prs )
+main.add_command( multiple_prs_status )
 main.add_command( prepare_sumstat )
 main.add_command( prs_stat )
+main.add_command( bootstrap_stat )
 main.add_command( combine_stat )
 main.add_command( select_clump_snps )
 main.add_command( transfer_atcg )
@@ -0,0 +1,136 @@
+# Greedy LD clumping in Python, from plink --r2 pairs or directly from bfile genotypes (native engine)
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from gprs.bed import BedReader
+from gprs.ldstore import window_pairs
+from gprs.sumstat import read_sumstat
+
+CLUMPED_COLUMNS = ['CHR', 'F', 'SNP', 'BP', 'P', 'TOTAL', 'NSIG', 'S05', 'S01', 'S001', 'S0001', 'SP2']
+
+
+def parse_grid(values):
+    # '250 500' -> ['250', '500']; the original strings are kept for the output folder names
+    return str(values).split()
+
+
+def read_ld(path):
+    # pairs from plink --r2
+    return pd.read_csv(path, sep=r'\s+', usecols=['SNP_A', 'SNP_B', 'R2'], dtype={'SNP_A': str, 'SNP_B': str})
+
+
+class LdPairs(object):
+    """
+    Candidate SNPs (SNP, BP, P) of one chromosome with their pairwise r2, from which the neighbours
+    of every SNP can be selected for any window (kb) and r2 threshold within the computed ones.
+    """
+    def __init__(self, snps, ld):
+        self.snps = snps.reset_index(drop=True)
+        index = pd.Index(self.snps['SNP'])
+        a = index.get_indexer(ld['SNP_A'])
+        b = index.get_indexer(ld['SNP_B'])
+        found = (a >= 0) & (b >= 0)
+        self.a, self.b = a[found], b[found]
+        self.r2 = ld['R2'].to_numpy(np.float64)[found]
+        bp = self.snps['BP'].to_numpy(np.int64)
+        self.dist = np.abs(bp[self.a] - bp[self.b])
+
+    def neighbours(self, kb, r2):
+        # symmetric SNP x SNP adjacency of pairs within kb and with r2 >= threshold
+        sel = (self.dist <= float(kb) * 1000) & (self.r2 >= float(r2))
+        n = len(self.snps)
+        rows = np.concatenate([self.a[sel], self.b[sel]])
+        cols = np.concatenate([self.b[sel], self.a[sel]])
+        return sparse.csr_matrix((np.ones(len(rows), dtype=np.int8), (rows, cols)), shape=(n, n))
+
+    def clump(self, kb, r2, p1, p2):
+        """
+        plink-style clumping: SNPs with P <= p1 become index SNPs in order of P, each taking its
+        unclumped neighbours with P <= p2; a SNP belongs to one clump only.
+        Returns [(index position, member positions)] in index order. Clumps for any smaller p1
+        are a prefix of this list, since earlier index SNPs never depend on later ones.
+        """
+        adj = self.neighbours(kb, r2)
+        p = self.snps['P'].to_numpy(np.float64)
+        eligible = p <= float(p2)
+        claimed = np.zeros(len(p), dtype=bool)
+        clumps = []
+        for i in np.argsort(p, kind='stable'):
+            if p[i] > float(p1):
+                break
+            if claimed[i]:
+                continue
+            claimed[i] = True
+            nbrs = adj.indices[adj.indptr[i]:adj.indptr[i + 1]]
+            members = nbrs[eligible[nbrs] & ~claimed[nbrs]]
+            claimed[members] = True
+            clumps.append((i, np.sort(members)))
+        return clumps
+
+
+def write_clumped(path, chrnb, snps, clumps):
+    """
+    Write clumps in the plink .clumped layout (read by select-clump-snps).
+    Like plink, no file is written when there is no clump.
+    """
+    if len(clumps) == 0:
+        return False
+    p = snps['P'].to_numpy(np.float64)
+    rows = []
+    for i, members in clumps:
+        mp = p[members]
+        sp2 = ','.join('{}(1)'.format(x) for x in snps['SNP'].to_numpy()[members]) if len(members) > 0 else 'NONE'
+        rows.append([chrnb, 1, snps['SNP'].iat[i], snps['BP'].iat[i], '{:.3g}'.format(p[i]), len(members),
+                     int((mp > 0.05).sum()), int(((mp > 0.01) & (mp <= 0.05)).sum()), int(((mp > 0.001) & (mp <= 0.01)).sum()),
+                     int(((mp > 0.0001) & (mp <= 0.001)).sum()), int((mp <= 0.0001).sum()), sp2])
+    # index SNPs in order of significance, as plink writes them
+    pd.DataFrame(rows, columns=CLUMPED_COLUMNS).to_csv(path, sep=' ', index=False)
+    return True
+
+
+def window_ld(reader, snps, kb, p1, r2, block_size=1024):
+    """
+    Pairs (SNP_A, SNP_B, R2) with r^2 >= r2 between the possible index SNPs (P <= p1) and the SNPs in their
+    kb window, in the plink --r2 layout read by LdPairs. snps: SNP, P, BP and ROW (in reader), sorted by BP.
+    r is computed block by block on a sliding window of decoded genotypes (ldstore.window_pairs).
+    """
+    bp = snps['BP'].to_numpy(np.int64)
+    targets = np.flatnonzero(snps['P'].to_numpy(np.float64) <= float(p1))
+    i, j, r = window_pairs(reader, snps['ROW'].to_numpy(), bp, int(float(kb) * 1000), targets, block_size)
+    linked = r ** 2 >= float(r2)
+    names = snps['SNP'].to_numpy()
+    return pd.DataFrame({'SNP_A': names[i[linked]], 'SNP_B': names[j[linked]], 'R2': r[linked] ** 2})
+
+
+def grid_ld_chromosome(prefix, snps, output, kb, p1, r2, block_size=1024):
+    """
+    Native engine of the clumping grid: write [output].ld from the bfile [prefix].bed for the candidate
+    SNPs (SNP, P, BP), at the loosest window, p1 and r2 of the grid, in place of plink --r2.
+    Returns the number of pairs.
+    """
+    reader = BedReader(prefix)
+    snps = snps.assign(ROW=reader.snp_index(snps['SNP']))
+    snps = snps[snps['ROW'] >= 0].sort_values('BP', kind='stable').reset_index(drop=True)
+    ld = window_ld(reader, snps, kb, p1, r2, block_size)
+    ld.to_csv("{}.ld".format(output), sep=' ', index=False)
+    return len(ld)
+
+
+def clump_chromosome(prefix, sumstat_file, chrnb, output, kb, p1, p2, r2, clump_field='Pvalue', clump_snp_field='SNPID', block_size=1024):
+    """
+    Clump one chromosome natively from the bfile [prefix].bed and write [output].clumped.
+    Only SNPs with P <= max(p1, p2) found in the .bim are read, and the window_ld pairs are clumped like
+    plink --r2 pairs. Returns the number of clumps.
+    """
+    snps = read_sumstat(sumstat_file, columns=[clump_snp_field, clump_field],
+                        filters=[(clump_field, '<=', max(float(p1), float(p2)))])
+    snps = snps.rename(columns={clump_snp_field: 'SNP', clump_field: 'P'}).drop_duplicates('SNP')
+    reader = BedReader(prefix)
+    snps['ROW'] = reader.snp_index(snps['SNP'])
+    snps = snps[snps['ROW'] >= 0]
+    snps['BP'] = reader.bim['POS'].to_numpy()[snps['ROW'].to_numpy()]
+    snps = snps.sort_values('BP', kind='stable').reset_index(drop=True)
+    ld = window_ld(reader, snps, kb, p1, r2, block_size)
+    clumps = LdPairs(snps[['SNP', 'BP', 'P']], ld).clump(kb, r2, p1, p2)
+    write_clumped("{}.clumped".format(output), chrnb, snps, clumps)
+    return len(clumps)
@@ -0,0 +1,165 @@
+# Backends that run one build-prs command per model: local processes, SLURM array jobs, or a dry run
+import os
+import shutil
+import subprocess
+from gprs.bed import count_lines
+from gprs.parallel import run_commands
+
+# rough plink2 --score footprint: fixed overhead plus the loaded score file
+BASE_MEMORY_MB = 1000
+MEMORY_MB_PER_SNP = 0.002
+STATUS_COLUMNS = ['model', 'snps', 'memory_mb', 'task', 'state', 'returncode']
+
+
+def model_snps(beta_dir):
+    # number of SNPs in all .weight files of a model
+    return sum(count_lines("{}/{}".format(beta_dir, x)) for x in os.listdir(beta_dir) if x.endswith('.weight'))
+
+
+def estimate_memory(n_snps):
+    # MB reserved for one build-prs run of a model with n_snps weights
+    return int(BASE_MEMORY_MB + MEMORY_MB_PER_SNP * n_snps)
+
+
+def pack_models(models, budget):
+    """
+    First-fit decreasing packing of (model, snps, memory_mb) into tasks whose models run together
+    within the memory budget (MB). A model larger than the budget gets a task of its own.
+    Returns a list of tasks, each a list of (model, snps, memory_mb).
+    """
+    tasks = []
+    for model in sorted(models, key=lambda x: x[2], reverse=True):
+        for task in tasks:
+            if sum(x[2] for x in task) + model[2] <= budget:
+                task.append(model)
+                break
+        else:
+            tasks.append([model])
+    return tasks
+
+
+def write_status(path, rows):
+    # one line per model: model snps memory_mb task state returncode
+    with open(path, 'w') as o:
+        o.write('\t'.join(STATUS_COLUMNS) + '\n')
+        for row in rows:
+            o.write('\t'.join(str(row[x]) for x in STATUS_COLUMNS) + '\n')
+    states = {}
+    for row in rows:
+        states[row['state']] = states.get(row['state'], 0) + 1
+    print('Status of {} models: {}'.format(len(rows), ', '.join('{} {}'.format(n, state) for (state, n) in sorted(states.items()))))
+    print('Status summary saved in {}'.format(path))
+
+
+class Executor(object):
+    """
+    Runs packed tasks of build-prs commands. command(model, memory_mb) returns the shell command for one model.
+    run() returns one status row per model.
+    """
+    def __init__(self, command, status_dir):
+        self.command = command
+        self.status_dir = status_dir
+        os.makedirs(status_dir, exist_ok=True)
+
+    def rows(self, tasks, state, returncodes=None):
+        rows = []
+        for i, task in enumerate(tasks):
+            for model, snps, memory in task:
+                returncode = 'NA' if returncodes is None else returncodes.get(model, 'NA')
+                rows.append({'model': model, 'snps': snps, 'memory_mb': memory, 'task': i,
+                             'state': state(model, returncode) if callable(state) else state,
+                             'returncode': returncode})
+        return rows
+
+
+class LocalExecutor(Executor):
+    # tasks run one after another on this machine; models of a task run concurrently
+    def run(self, tasks):
+        returncodes = {}
+        for i, task in enumerate(tasks):
+            print('Task {}/{}: {}'.format(i + 1, len(tasks), ' '.join(x[0] for x in task)))
+            returncodes.update(run_commands([(model, self.command(model, memory), snps) for (model, snps, memory) in task], jobs=len(task)))
+        return self.rows(tasks, lambda model, returncode: 'done' if returncode == 0 else 'failed', returncodes)
+
+
+class DryRunExecutor(Executor):
+    # only print what would run
+    def run(self, tasks):
+        for i, task in enumerate(tasks):
+            print('Task {} ({} MB):'.format(i, sum(x[2] for x in task)))
+            for model, snps, memory in task:
+                print('  {}'.format(self.command(model, memory)))
+        return self.rows(tasks, 'planned')
+
+
+class SlurmExecutor(Executor):
+    """
+    One SLURM array task per packed task; its models run concurrently and each writes its exit status
+    to [status_dir]/[model].rc, read back by collect().
+    """
+    def __init__(self, command, status_dir, name, account, time, setup, script='build-prs.sh'):
+        Executor.__init__(self, command, status_dir)
+        self.name = name
+        self.account = account
+        self.time = time
+        self.setup = setup
+        self.script = script
+
+    def run(self, tasks):
+        cases = ''
+        for i, task in enumerate(tasks):
+            cases += '  {})\n'.format(i)
+            for model, snps, memory in task:
+                cases += '    ( {} ; echo $? > {}/{}.rc ) &\n'.format(self.command(model, memory), self.status_dir, model)
+            cases += '    ;;\n'
+        script = """#!/bin/bash
+#SBATCH --ntasks=1
+#SBATCH --nodes=1
+#SBATCH --account={}
+#SBATCH --time={}
+#SBATCH --mem={}M
+#SBATCH --cpus-per-task={}
+#SBATCH --job-name={}
+#SBATCH --output=slurm.%x.%A_%a.out
+#SBATCH --error=slurm.%x.%A_%a.err
+#SBATCH --array=0-{}
+
+{}
+
+case $SLURM_ARRAY_TASK_ID in
+{}esac
+wait
+""".format(self.account, self.time,
+           max(sum(x[2] for x in task) for task in tasks), max(len(task) for task in tasks),
+           self.name, len(tasks) - 1, self.setup, cases)
+        with open(self.script, 'w') as o:
+            o.write(script)
+        for model in [x[0] for task in tasks for x in task]:
+            if os.path.exists('{}/{}.rc'.format(self.status_dir, model)):
+                os.remove('{}/{}.rc'.format(self.status_dir, model))
+        if shutil.which('sbatch') is None:
+            print('Warning: sbatch not found; {} written but not submitted (use --executor local without SLURM)'.format(self.script))
+            return self.rows(tasks, 'submit_failed')
+        proc = subprocess.run(['sbatch', self.script], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        print(proc.stdout.decode(errors='replace'))
+        return self.rows(tasks, 'submitted' if proc.returncode == 0 else 'submit_failed')
+
+
+def collect(status_file, status_dir):
+    """
+    Update a status summary with the [model].rc files written by SLURM tasks;
+    models without one are still pending or running.
+    """
+    rows = []
+    with open(status_file) as f:
+        header = f.readline().rstrip('\n').split('\t')
+        for line in f:
+            rows.append(dict(zip(header, line.rstrip('\n').split('\t'))))
+    for row in rows:
+        rc = '{}/{}.rc'.format(status_dir, row['model'])
+        if os.path.exists(rc):
+            with open(rc) as f:
+                row['returncode'] = f.read().strip()
+            row['state'] = 'done' if row['returncode'] == '0' else 'failed'
+    write_status(status_file, rows)
+    return rows
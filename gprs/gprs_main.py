@@ -5,11 +5,28 @@ import os
 import random
 from collections import defaultdict
 from pathlib import Path
-from subprocess import call
+from time import time
 from collections import defaultdict
+import numpy as np
 import pandas as pd
 from sklearn.utils import column_or_1d
-from gprs.timer import *
+from gprs.bed import count_lines, merge_bfiles, read_individuals, subset_bfile
+from gprs.bootstrap import bootstrap, confidence_intervals, paired_tests
+from gprs.clump import LdPairs, clump_chromosome, grid_ld_chromosome, parse_grid, read_ld, write_clumped
+from gprs.harmonize import CATEGORIES, PositionIndex, harmonise_chromosome
+from gprs.ldpred import BURN_IN, GRID_CHUNK, NUM_ITER, grid_name, h2_grid, ldpred_gibbs, ldpred_inf, match_ref, p_grid, standardized, write_weights
+from gprs.ldsc import ldsc
+from gprs.ldstore import LdStore, content_hash
+from gprs.manifest import Manifest
+from gprs.executor import DryRunExecutor, LocalExecutor, SlurmExecutor, collect, estimate_memory, model_snps, pack_models, write_status
+from gprs.parallel import check_status, file_size, resource_flags, run_commands, run_functions
+from gprs.refcache import RefCache
+from gprs.results import PARAM_COLUMNS, ResultStore
+from gprs.score import read_beta_list, score_models
+from gprs.scorestore import SCORE_DIR, ScoreMatrix, chromosome_sscores, read_sscore, write_sscore
+from gprs.stats import evaluate, plot_roc, read_pheno, read_scores, write_stat, score_files as find_score_files
+from gprs.sumstat import SUMSTAT_COLUMNS, ParquetPartitions, apply_schema, decode_snpid, export_tsv, read_sumstat, sumstat_path
+from gprs.timer import run, span, traced
 
 class GPRS(object):
     def __init__(self,
@@ -30,6 +47,10 @@ class GPRS(object):
         self.prs_dir = '{}/{}'.format(self.result_dir, 'prs')
         self.ct_dir = '{}/{}'.format(self.plink_dir, 'ct')
         self.ldpred2_dir = '{}/{}'.format(self.result_dir, 'ldpred2')
+        self.ref_cache_dir = '{}/{}'.format(self.plink_dir, 'ref_cache')
+        self.ld_dir = '{}/{}'.format(self.result_dir, 'ld')
+        self.ref_index_dir = '{}/{}'.format(self.plink_dir, 'ref_index')
+        self.pop_dir = '{}/{}'.format(self.result_dir, 'pop')
         self.setup_dir()
 
     def setup_dir(self):  # The setup_dir function is automatically create 10 folders
@@ -42,6 +63,8 @@ class GPRS(object):
         self.create_ct_dir()
         self.create_stat_dir()
         self.create_ldpred2_dir()
+        self.create_ld_dir()
+        self.create_pop_dir()
 
 
     def create_result_dir(self):  # A function to create result folder
@@ -84,13 +107,19 @@ class GPRS(object):
         if not os.path.exists(self.ldpred2_dir):
             os.mkdir(self.ldpred2_dir)
 
+    def create_ld_dir(self):  # A function to create LD store folder
+        if not os.path.exists(self.ld_dir):
+            os.mkdir(self.ld_dir)
+
+    def create_pop_dir(self):  # A function to create pop folder
+        if not os.path.exists(self.pop_dir):
+            os.mkdir(self.pop_dir)
+
     # Unify sumstat format
+    @traced('prepare-sumstat')
     def prepare_sumstat(self, file, sumstat, out, symbol='.', comment='',
                         snpid=None, chr=None, pos=None, ea=None, nea=None, beta=None, se=None, pval=None, neff=None,
-                        total=0, case_control=(0,0)):
-        start=time()
-        atexit.register(exitlog, start)
-        log("Starting Analysis: prepare-sumstat")
+                        total=0, case_control=(0,0), chunksize=1000000, out_format='tsv', force=False):
         # dict for column name mapping        
         columns = {
             'SNPID': snpid,
@@ -106,96 +135,204 @@ class GPRS(object):
         col_exist = {value: key for (key, value) in columns.items() if value != None }
         
         # function to unify format
-        def unify(df, columns, neff, total, case_control):
+        def unify(df, columns, neff, total, case_control, verbose=True):
             # fill in N_eff if given as number
             if neff == None:
                 if total != 0:
-                    print('Inserting {} as effective sample size. Make sure it is TOTAL Sample size if you are using quantitative trait, or EFFECTIVE Sample size if binary trait\n'.format(total))
+                    if verbose:
+                        print('Inserting {} as effective sample size. Make sure it is TOTAL Sample size if you are using quantitative trait, or EFFECTIVE Sample size if binary trait\n'.format(total))
                     df['N_eff'] = total
                 elif case_control != (0,0):
                     cs, ct = case_control 
-                    print('\nUsing {} and {} to calculate effective sample size. Make sure you are using BINARY trait'.format(cs,ct))
-                    print('Formula: 4 / (1 / case + 1 / control)\n')
+                    if verbose:
+                        print('\nUsing {} and {} to calculate effective sample size. Make sure you are using BINARY trait'.format(cs,ct))
+                        print('Formula: 4 / (1 / case + 1 / control)\n')
                     df['N_eff'] = int(4/(1/cs + 1/ct))
             # fill in missing column as NA
             for col in columns.keys():
                 if col not in list(df):
-                    print('WARNING: Header for {} not provided (will be recorded as NA)'.format(col))
+                    if verbose:
+                        print('WARNING: Header for {} not provided (will be recorded as NA)'.format(col))
                     df[col]='NA'                
             # filter, re-order, unify dtypes columns
-            df = df[['SNPID','CHR','POS','Effect_Allele','NonEffect_Allele','Beta','SE','Pvalue','N_eff' ]]
+            df = df[SUMSTAT_COLUMNS]
             pd.set_option('mode.chained_assignment', None)
-            df[['Effect_Allele','NonEffect_Allele']] = df[['Effect_Allele','NonEffect_Allele']].astype(str).apply(lambda x: x.str.upper())
-            df = df.astype( dtype= {'CHR': int, 'POS': int, 'N_eff': int}, errors='ignore')  
-            return df
+            return apply_schema(df)
         
+        # split SNPID into chromosome information when CHR header is missing
+        snpid_counts = defaultdict(int)
+        def parse_snpid(df):
+            decoded, counts = decode_snpid(df['SNPID'])
+            df[['CHR','POS','A1','A2']] = decoded
+            for form, count in counts.items():
+                snpid_counts[form] += count
+            return df
+
+        # read sumstat in chunks of `chunksize` rows (gzip/bgzip handled by extension), or at once if chunksize is 0
+        def read_chunks(path):
+            kwargs = {'sep': r'\s+'}
+            if len(comment) != 0:
+                kwargs['comment'] = comment
+            if path.endswith('.gz') or path.endswith('.bgz'):
+                kwargs['compression'] = 'gzip'
+            if chunksize > 0:
+                return pd.read_csv(path, chunksize=chunksize, **kwargs)
+            return [pd.read_csv(path, **kwargs)]
+
+        # append one chunk to every per-chromosome output in a single pass
+        def write_chunk(df, chrnb=None):
+            for key, part in df.groupby('CHR', sort=False):
+                try:
+                    key = int(key)
+                except ValueError:
+                    continue
+                if key in range(1, 23) and (chrnb is None or key == chrnb):
+                    if out_format in ('tsv', 'both'):
+                        part.to_csv(outfiles[key], mode='a', index=False, sep='\t', header=False, na_rep='NA')
+                    if out_format in ('parquet', 'both'):
+                        partitions.write(key, part)
+
+        # start every chromosome file with the header, so all 22 files exist even without SNPs
+        outfiles = { chrnb: "{}/{}_chr{}.csv".format(self.sumstat_dir, out, chrnb) for chrnb in range(1,23) }
+
+        # skip when the input files and options are unchanged since the last run
+        manifest = Manifest(self.result_dir, force)
+        if file:
+            input_files = [sumstat]
+        else:
+            input_files = [ "{}/{}".format(sumstat, i) for i in sorted(os.listdir(sumstat)) ] if os.path.isdir(sumstat) else []
+        key = manifest.key(input_files, {'file': file, 'symbol': symbol, 'comment': comment, 'columns': columns, 'neff': neff,
+                                         'total': total, 'case_control': case_control, 'out_format': out_format})
+        output_files = []
+        if out_format in ('tsv', 'both'):
+            output_files += list(outfiles.values())
+        if out_format in ('parquet', 'both'):
+            output_files += [ "{}/{}_chr{}.parquet".format(self.sumstat_dir, out, chrnb) for chrnb in range(1,23) ]
+        if manifest.current("{}/{}".format(self.sumstat_dir, out), key):
+            print('Summary statistics {} are up to date (use --force to rebuild)'.format(out))
+            return
+        # drop partitions of the other format left by an earlier run, which sumstat_path would otherwise prefer
+        for chrnb in range(1,23):
+            for stale in ({'tsv': ['parquet'], 'parquet': ['csv']}).get(out_format, []):
+                stale = "{}/{}_chr{}.{}".format(self.sumstat_dir, out, chrnb, stale)
+                if os.path.exists(stale):
+                    os.remove(stale)
+        if out_format in ('tsv', 'both'):
+            header = pd.DataFrame(columns=SUMSTAT_COLUMNS)
+            for outfile in outfiles.values():
+                header.to_csv(outfile, index=False, sep='\t', header=True)
+        if out_format in ('parquet', 'both'):
+            partitions = ParquetPartitions("{}/{}".format(self.sumstat_dir, out))
+        nrows = 0
+        stream_start = time()
+
         # if sumstat given as one file
         if file:
             if not os.path.isfile(sumstat):
                 sys.exit('ERROR: {} is not a file. Check help page.\n'.format(sumstat))
             print('Processing one summary statistics file...')
-            if len(comment) == 0:         
-                df=pd.read_csv(sumstat, delim_whitespace=True)
-            else:
-                df=pd.read_csv(sumstat, delim_whitespace=True, comment=comment)
-            df.rename(columns=col_exist, inplace=True)
-            #chr column missing --> look for it in SNP ID
             if chr == None:
                 if snpid == None:
                     sys.exit('ERROR: both chromosome and SNP ID header not provided')
                 else:
-                    print('Looking for chromosome information from SNP ID...Make sure it is in chr:pos:allele1:allele2 format.\n')                    
-                    df[['CHR','POS','A1','A2']] =  df['SNPID'].str.split(pat=':',expand=True)
-                    if sum( df['CHR'].str.contains("chr") ) == len(df):
-                       df['CHR']= df['CHR'].apply(lambda x: x[3:])
-                    elif sum( df['CHR'].str.contains("chr") ) != 0:
-                        print('ERROR: SNP ID format not consistent.\n')
-            df = unify(df, columns, neff, total, case_control)
-            #write into 22 sumstat files
-            for chrnb in range(1,23):
-                outfile="{}/{}_chr{}.csv".format(self.sumstat_dir, out, chrnb)
-                df[df.CHR == chrnb].to_csv(outfile, index=False, sep='\t', header=True)
+                    print('Looking for chromosome information from SNP ID...Make sure it is in chr:pos:allele1:allele2 format.\n')
+            #write each chunk into 22 sumstat files
+            for n, df in enumerate(read_chunks(sumstat)):
+                df.rename(columns=col_exist, inplace=True)
+                #chr column missing --> look for it in SNP ID
+                if chr == None:
+                    df = parse_snpid(df)
+                df = unify(df, columns, neff, total, case_control, verbose=(n == 0))
+                write_chunk(df)
+                nrows += len(df)
 
         #sumstat given as directory  
         else:
             if not os.path.isdir(sumstat):
                 sys.exit('Error: {} is not a directory. Check help page.\n'.format(sumstat))
             print('Directory for summary statistic files provided...')
+            if chr == None:
+                print('WARNING: chromosome header not provided. Looking for it in filename..')
             for chrnb in range(1,23):
-                chr_symbol='chr{}{}'.format(chrnb,symbol)
-                for i in os.listdir(sumstat):
-                    if chr_symbol in i:
-                        sumstat_chr=i
-                        if len(comment) == 0:
-                            df = pd.read_csv( "{}/{}".format(sumstat, sumstat_chr), delim_whitespace=True)
-                        else:
-                            df = pd.read_csv( "{}/{}".format(sumstat, sumstat_chr), delim_whitespace=True, comment=comment)                
-                        df.rename(columns=col_exist, inplace=True)
-
-                        #fill in chromosome from filename
-                        if chr == None:
-                            print('WARNING: chromosome header not provided. Looking for it in filename..')
-                            df['CHR']=chrnb
-                        df = unify(df, columns, neff, total, case_control)
-                        print('Processing chromosome {} done\n'.format(chrnb))
-                        outfile="{}/{}_chr{}.csv".format(self.sumstat_dir, out, chrnb)
-                        df[df.CHR == chrnb].to_csv(outfile, index=False, sep='\t', header=True)
+                with span('chr{}'.format(chrnb), kind='task'):
+                    chr_symbol='chr{}{}'.format(chrnb,symbol)
+                    for i in os.listdir(sumstat):
+                        if chr_symbol in i:
+                            for n, df in enumerate(read_chunks("{}/{}".format(sumstat, i))):
+                                df.rename(columns=col_exist, inplace=True)
+                                #fill in chromosome from filename
+                                if chr == None:
+                                    df['CHR']=chrnb
+                                df = unify(df, columns, neff, total, case_control, verbose=(n == 0))
+                                write_chunk(df, chrnb)
+                                nrows += len(df)
+                            print('Processing chromosome {} done\n'.format(chrnb))
 
+        if out_format in ('parquet', 'both'):
+            partitions.close()
+        manifest.record("{}/{}".format(self.sumstat_dir, out), key, output_files)
+        manifest.save()
+        if len(snpid_counts) > 0:
+            print('SNP ID forms found: {}'.format(', '.join('{} {}'.format(count, form) for (form, count) in snpid_counts.items())))
+            if snpid_counts['rsID'] + snpid_counts['malformed'] > 0:
+                print('WARNING: {} rsID and {} malformed SNP IDs have no chromosome information and are dropped\n'.format(
+                        snpid_counts['rsID'], snpid_counts['malformed']))
+        elapsed = time() - stream_start
+        print('{} SNPs processed in {:.1f} seconds ({:.0f} rows/s)'.format(nrows, elapsed, nrows / max(elapsed, 1e-9)))
         print('\nAnlysis finished. 22 summary statistics saved in result/sumstat folder!\n')
+
+    # Harmonise unified sumstats to a reference .bim: same position and alleles, effects on the reference A1 allele
+    @traced('transfer-atcg')
+    def transfer_atcg(self, sumstat, bfile, out, palindromic='drop', jobs=1, force=False):
+        sources = {chrnb: sumstat_path(sumstat, chrnb) for chrnb in range(1, 23)}
+        # chromosomes without a source partition are skipped rather than written empty
+        sources = {chrnb: path for (chrnb, path) in sources.items() if os.path.exists(path)}
+        if len(sources) == 0:
+            sys.exit('ERROR: no sumstat partitions found for {}\n'.format(sumstat))
+        index = PositionIndex(self.ref_index_dir, bfile)
+        targets = {chrnb: '{}/{}_chr{}.{}'.format(self.sumstat_dir, out, chrnb, 'parquet' if path.endswith('.parquet') else 'csv')
+                   for (chrnb, path) in sources.items()}
+        if any(os.path.abspath(sources[x]) == os.path.abspath(targets[x]) for x in sources):
+            sys.exit('ERROR: --out would overwrite the input sumstat {}\n'.format(sumstat))
+        # skip when the sumstat, reference .bim and option are unchanged
+        manifest = Manifest(self.result_dir, force)
+        step = '{}/{}.harmonise'.format(self.sumstat_dir, out)
+        key = manifest.key(list(sources.values()) + ['{}.bim'.format(bfile)], {'palindromic': palindromic})
+        if manifest.current(step, key):
+            print('{} is up to date (use --force to rebuild)'.format(step))
+            return
+        calls = [(str(chrnb), harmonise_chromosome, (index, chrnb, sources[chrnb], targets[chrnb], palindromic == 'keep'),
+                  file_size(sources[chrnb])) for chrnb in sources]
+        status, results = run_functions(calls, int(jobs))
+        check_status(status, 'harmonisation')
+        report = pd.DataFrame([dict(CHR=chrnb, **results[str(chrnb)]) for chrnb in sources])
+        report.loc[len(report)] = ['total'] + report[CATEGORIES].sum().tolist()
+        report.to_csv('{}.tsv'.format(step), sep='\t', index=False)
+        total = report.iloc[-1]
+        print('\n{} sumstat SNPs against {}:'.format(int(total[CATEGORIES[:-1]].sum()), bfile))
+        for category in CATEGORIES[:-1]:
+            print('  {:<16} {}'.format(category, int(total[category])))
+        print('  {:<16} {} (dropped from the kept ones)'.format('duplicate', int(total['duplicate'])))
+        print('palindromic SNPs were {}'.format('kept on the given strand' if palindromic == 'keep' else 'dropped'))
+        manifest.record(step, key, list(targets.values()) + ['{}.tsv'.format(step)])
+        manifest.save()
+        print('Harmonised sumstat saved as {}/{}_chr*; counts in {}.tsv'.format(self.sumstat_dir, out, step))
+
+    # Write tab-separated sumstat files from the parquet partitions (for plink)
+    @traced('export-sumstat')
+    def export_sumstat(self, sumstat):
+        export_tsv("{}/{}".format(self.sumstat_dir, sumstat))
+        print('Tab-separated summary statistics for {} are up to date in result/sumstat folder'.format(sumstat))
     
     # Using plink to generate bfiles fam/bim/bed.
-    def generate_plink_bfiles(self, merge, sumstat, out, symbol='.', extra_commands=" "):
-        start=time()
-        atexit.register(exitlog, start)
-        log("Starting Analysis: generate-plink-bfiles")
-
-        def run_plink_bfiles():
-            visited = set()
-            if "{}_{}".format(chrnb, out)not in visited:
-                print("Starting to generate {}_{} bfiles".format(chrnb, out))
-                os.system("plink --vcf {} --extract {} {} --make-bed --out {}".format(vcfinput, snp, extra_commands, output))
-                print("{}_{} bfile is ready!".format(chrnb, out))
-            visited.add("{}_{}".format(chrnb, out))
+    @traced('generate-plink-bfiles')
+    def generate_plink_bfiles(self, merge, sumstat, out, symbol='.', extra_commands=" ", jobs=1, threads=None, memory=None, ref_cache=True, merge_method='native', force=False):
+        # plink --extract needs the text format
+        export_tsv("{}/{}".format(self.sumstat_dir, sumstat))
+
+        # one plink job per chromosome, sharing the thread/memory budget
+        inputs = []
+        resources = resource_flags(jobs, threads, memory)
 
         if any("chr" in file and "{}".format(sumstat) in file for file in os.listdir(self.sumstat_dir)):
             # Generate chr number (chr1-chr22)
@@ -209,25 +346,155 @@ class GPRS(object):
                         if i.endswith('.vcf.gz') and chrnb != "chrX" and chrnb != "chrY" and chrnb != "chrMT" and "{}{}".format(chrnb, symbol) in i:
                             vcfinput = "{}/{}".format(self.ref, i)
                             print("summary statistics: {}, output: {}, vcfinput:{}\n".format(snp, output, vcfinput))
-                            run_plink_bfiles()
+                            inputs.append((chrnb, snp, output, vcfinput))
+
+            # only chromosomes whose SNP list, reference or options changed are rebuilt
+            manifest = Manifest(self.result_dir, force)
+            keys = { output: manifest.key([snp, vcfinput], {'extra_commands': extra_commands, 'ref_cache': ref_cache}, ('plink',))
+                     for (chrnb, snp, output, vcfinput) in inputs }
+            up_to_date = [ chrnb for (chrnb, snp, output, vcfinput) in inputs if manifest.current(output, keys[output]) ]
+            if len(up_to_date) > 0:
+                print("{} bfiles are up to date (use --force to rebuild): {}".format(len(up_to_date), ' '.join(up_to_date)))
+            inputs = [ x for x in inputs if x[0] not in up_to_date ]
+
+            if ref_cache:
+                # convert each reference VCF to a bfile once; later sumstats only extract from the binary copy
+                cache = RefCache(self.ref_cache_dir)
+                cached = { vcfinput: cache.lookup(vcfinput, extra_commands) for (chrnb, snp, output, vcfinput) in inputs }
+                cache.report()
+                commands = [ ("{}_reference".format(chrnb),
+                              "plink --vcf {} {} --make-bed{} --out {}".format(vcfinput, extra_commands, resources, cache.prefix(vcfinput, extra_commands)),
+                              file_size(vcfinput))
+                             for (chrnb, snp, output, vcfinput) in inputs if cached[vcfinput] is None ]
+                if len(commands) > 0:
+                    print("Converting {} reference VCFs to bfiles with {} parallel jobs".format(len(commands), jobs))
+                    status = run_commands(commands, jobs)
+                    for (chrnb, snp, output, vcfinput) in inputs:
+                        if status.get("{}_reference".format(chrnb)) == 0:
+                            cache.add(vcfinput, extra_commands)
+                    check_status(status, "reference panel conversion")
+                commands = [ ("{}_{}".format(chrnb, out),
+                              "plink --bfile {} --extract {} --make-bed{} --out {}".format(cache.prefix(vcfinput, extra_commands), snp, resources, output),
+                              file_size(vcfinput))
+                             for (chrnb, snp, output, vcfinput) in inputs ]
+            else:
+                commands = [ ("{}_{}".format(chrnb, out),
+                              "plink --vcf {} --extract {} {} --make-bed{} --out {}".format(vcfinput, snp, extra_commands, resources, output),
+                              file_size(vcfinput))
+                             for (chrnb, snp, output, vcfinput) in inputs ]
+            print("Starting to generate {} bfiles with {} parallel jobs".format(len(commands), jobs))
+            status = run_commands(commands, jobs)
+            for (chrnb, snp, output, vcfinput) in inputs:
+                if status.get("{}_{}".format(chrnb, out)) == 0:
+                    manifest.record(output, keys[output], [ "{}.{}".format(output, ext) for ext in ('bed', 'bim', 'fam') ])
+            manifest.save()
+            check_status(status, "generate-plink-bfiles")
         else:
             print("ERROR: chromosome information are NOT found in summary statistics")
         if merge:
             print("Merging 22 plink files...")
-            with open("{}/merge.list".format(self.plink_bfiles_dir),'w') as o:
-                for chrnb in range(2,23):
-                   o.write("{}/chr{}_{}\n".format(self.plink_bfiles_dir, chrnb, out))
-            os.system("plink --bfile {}/chr1_{} --merge-list {}/merge.list --make-bed --out {}/merged_{}".format(
-                                    self.plink_bfiles_dir, out, self.plink_bfiles_dir, self.plink_bfiles_dir, out ))
-            with open(r"{}/merged_{}.bim".format(self.plink_bfiles_dir, out),'r') as f:
-                print('Total number of SNPs extracted: ', len(f.readlines()))
+            prefixes = [ "{}/chr{}_{}".format(self.plink_bfiles_dir, chrnb, out) for chrnb in range(1,23) ]
+            prefixes = [ prefix for prefix in prefixes if os.path.exists("{}.bed".format(prefix)) ]
+            if len(prefixes) < 22:
+                print("Warning: only {} chromosome bfiles found to merge".format(len(prefixes)))
+            manifest = Manifest(self.result_dir, force)
+            merged = "{}/merged_{}".format(self.plink_bfiles_dir, out)
+            key = manifest.key([ "{}.{}".format(prefix, ext) for prefix in prefixes for ext in ('bed', 'bim', 'fam') ], {'merge_method': merge_method}, ('plink',))
+            if manifest.current(merged, key):
+                print("Merged file is up to date (use --force to rebuild)")
+                return
+            if merge_method == 'native':
+                # all chromosomes share the same samples, so merging is a concatenation of SNP blocks
+                nsnps = merge_bfiles(prefixes, "{}/merged_{}".format(self.plink_bfiles_dir, out))
+            else:
+                with open("{}/merge.list".format(self.plink_bfiles_dir),'w') as o:
+                    for prefix in prefixes[1:]:
+                       o.write("{}\n".format(prefix))
+                run("plink --bfile {} --merge-list {}/merge.list --make-bed --out {}/merged_{}".format(
+                                        prefixes[0], self.plink_bfiles_dir, self.plink_bfiles_dir, out ), 'plink merge')
+                nsnps = count_lines("{}/merged_{}.bim".format(self.plink_bfiles_dir, out))
+            print('Total number of SNPs extracted: ', nsnps)
+            manifest.record(merged, key, [ "{}.{}".format(merged, ext) for ext in ('bed', 'bim', 'fam') ])
+            manifest.save()
             print("Merged file saved!")
 
+    # Individuals of the target population(s) in a phenotype table; pop_info may list several, comma-separated
+    @traced('subset-pop')
+    def subset_pop(self, input_data, column_name, pop_info, output_name):
+        table = pd.read_csv(input_data, sep=r'\s+', dtype=str, keep_default_na=False)
+        if column_name not in table.columns:
+            sys.exit('ERROR: {} is not a column of {}\n'.format(column_name, input_data))
+        pops = [x.strip() for x in pop_info.split(',')]
+        subset = table[table[column_name].isin(pops)]
+        if len(subset) == 0:
+            sys.exit('ERROR: no individuals of {} in column {} of {}\n'.format(pop_info, column_name, input_data))
+        counts = subset[column_name].value_counts()
+        for pop in pops:
+            print('{}: {} individuals'.format(pop, counts.get(pop, 0)))
+        # the table keeps its header, so it can be given as --popfile or as a phenotype file
+        self.create_pop_dir()
+        output = '{}/{}.txt'.format(self.pop_dir, output_name)
+        subset.to_csv(output, sep='\t', index=False)
+        print('{} of {} individuals saved as {}'.format(len(subset), len(table), output))
+
+    # Bfiles of the individuals in popfile (--keep) or of all others (--exclude), subset natively chromosome by chromosome
+    @traced('generate-plink-bfiles-w-individual-info')
+    def generate_plink_bfiles_w_individual_info(self, popfile, bfile_name, output_name, plink_command='--keep', jobs=1, force=False):
+        if plink_command.lstrip('-') not in ('keep', 'exclude'):
+            sys.exit('ERROR: --plink_command should be --keep or --exclude\n')
+        exclude = plink_command.lstrip('-') == 'exclude'
+        individuals = read_individuals(popfile)
+        print('{} individuals in {} to {}'.format(len(individuals), popfile, 'exclude' if exclude else 'keep'))
+        # chr[n]_[bfile_name] of generate-plink-bfiles, or a single bfile prefix
+        inputs = [ ("chr{}".format(nb), "{}/chr{}_{}".format(self.plink_bfiles_dir, nb, bfile_name), "{}/chr{}_{}".format(self.plink_bfiles_dir, nb, output_name))
+                   for nb in range(1, 23) ]
+        inputs = [ x for x in inputs if os.path.exists("{}.bed".format(x[1])) ]
+        merged = "{}/merged_{}".format(self.plink_bfiles_dir, bfile_name)
+        if len(inputs) == 0 and os.path.exists("{}.bed".format(bfile_name)):
+            inputs = [ (os.path.basename(bfile_name), bfile_name, "{}/{}".format(self.plink_bfiles_dir, output_name)) ]
+        if len(inputs) == 0:
+            sys.exit('ERROR: no bfiles chr[1-22]_{} found in {}, and {}.bed does not exist\n'.format(bfile_name, self.plink_bfiles_dir, bfile_name))
+        self.create_plink_bfiles_dir()
+
+        manifest = Manifest(self.result_dir, force)
+        keys = { output: manifest.key([ "{}.{}".format(prefix, ext) for ext in ('bed', 'bim', 'fam') ] + [popfile], {'exclude': exclude})
+                 for (name, prefix, output) in inputs }
+        up_to_date = [ name for (name, prefix, output) in inputs if manifest.current(output, keys[output]) ]
+        if len(up_to_date) > 0:
+            print("{} bfiles are up to date (use --force to rebuild): {}".format(len(up_to_date), ' '.join(up_to_date)))
+        calls = [ (name, subset_bfile, (prefix, output, individuals, exclude), file_size("{}.bed".format(prefix)))
+                  for (name, prefix, output) in inputs if name not in up_to_date ]
+        print("Subsetting {} bfiles with {} parallel jobs".format(len(calls), jobs))
+        status, results = run_functions(calls, int(jobs))
+        for (name, prefix, output) in inputs:
+            if status.get(name) == 0:
+                print("{}: {} SNPs, {} individuals kept".format(name, *results[name]))
+                manifest.record(output, keys[output], [ "{}.{}".format(output, ext) for ext in ('bed', 'bim', 'fam') ])
+        manifest.save()
+        check_status(status, "generate-plink-bfiles-w-individual-info")
+
+        if os.path.exists("{}.bed".format(merged)) and inputs[0][1] != bfile_name:
+            # the merged bfile is the concatenation of the subset chromosomes
+            prefixes = [ output for (name, prefix, output) in inputs ]
+            output = "{}/merged_{}".format(self.plink_bfiles_dir, output_name)
+            key = manifest.key([ "{}.{}".format(prefix, ext) for prefix in prefixes for ext in ('bed', 'bim', 'fam') ], {'merge_method': 'native'})
+            if manifest.current(output, key):
+                print("Merged file is up to date (use --force to rebuild)")
+            else:
+                print("Merging {} subset bfiles, {} SNPs".format(len(prefixes), merge_bfiles(prefixes, output)))
+                manifest.record(output, key, [ "{}.{}".format(output, ext) for ext in ('bed', 'bim', 'fam') ])
+                manifest.save()
+        print("Subset bfiles saved as {}/*{}".format(self.plink_bfiles_dir, output_name))
+
+    @traced('clump')
     def clump(self, sumstat, plink_bfile_name, output_name, clump_kb, clump_p1, clump_p2, clump_r2='0.1',
-              clump_field='Pvalue', clump_snp_field='SNPID'):
-        start=time()
-        atexit.register(exitlog, start)
-        log("Starting Analysis: clump ")
+              clump_field='Pvalue', clump_snp_field='SNPID', jobs=1, threads=None, memory=None, force=False, engine='plink'):
+        # lists of thresholds, i.e. clump_kb='250 500', are clumped as a grid sharing one LD computation
+        if any(len(parse_grid(x)) > 1 for x in (clump_kb, clump_p1, clump_r2)):
+            return self.clump_grid(sumstat, plink_bfile_name, output_name, clump_kb, clump_p1, clump_p2, clump_r2,
+                                   clump_field, clump_snp_field, jobs, threads, memory, force, engine)
+        # plink --clump needs the text format
+        export_tsv("{}/{}".format(self.sumstat_dir, sumstat))
 
         # Create a C+T tag
         output_name_with_conditions = "{}_{}_{}_{}".format(output_name, clump_kb, clump_p1, clump_r2)
@@ -241,17 +508,14 @@ class GPRS(object):
             print("{}/{} not exists, going to create a folder".format(self.plink_clump_dir, output_name_with_conditions))
             os.mkdir("{}/{}".format(self.plink_clump_dir, output_name_with_conditions))
 
-        def run_plink():
-            visited = set()
-            if sumstat_files not in visited:
-                print("start {}/{} clumping".format(self.sumstat_dir, sumstat_files))
-                os.system("plink --bfile {} --clump {}/{} --clump-p1 {} --clump-p2 {} --clump-r2 {} --clump-kb {} --clump-field {} --clump-snp-field {} --out {} ".format(
-                        plinkinput,
-                        self.sumstat_dir, sumstat_files,
-                        clump_p1, clump_p2, clump_r2, clump_kb, 
-                        clump_field, clump_snp_field, output))
-            visited.add("{}".format(sumstat_files))
-            print("finished {}/{} clumping".format(self.sumstat_dir, sumstat_files))
+        # one plink job (or native clumping process) per chromosome, sharing the thread/memory budget
+        commands = []
+        resources = resource_flags(jobs, threads, memory)
+        # chromosomes already clumped from the same bfile, sumstat and thresholds are skipped
+        manifest = Manifest(self.result_dir, force)
+        params = {'clump_p1': clump_p1, 'clump_p2': clump_p2, 'clump_r2': clump_r2, 'clump_kb': clump_kb,
+                  'clump_field': clump_field, 'clump_snp_field': clump_snp_field, 'engine': engine}
+        keys = {}
 
         if any("chr" in file and "{}".format(sumstat) in file for file in os.listdir(self.sumstat_dir)):
             # Generate chr number (chr1-chr22)
@@ -261,18 +525,133 @@ class GPRS(object):
                 output = "{}/{}/{}_{}".format(self.plink_clump_dir, output_name_with_conditions, chrnb, output_name_with_conditions)
                 plinkinput = "{}/{}_{}.bim".format(self.plink_bfiles_dir, chrnb, plink_bfile_name).split(".")[0]
                 if os.path.exists("{}.bim".format(plinkinput)):
+                    keys[chrnb] = manifest.key([ "{}.{}".format(plinkinput, ext) for ext in ('bed', 'bim', 'fam') ] + [ "{}/{}".format(self.sumstat_dir, sumstat_files) ],
+                                               params, ('plink',))
+                    if manifest.current(output, keys[chrnb]):
+                        print("{}.clumped is up to date (use --force to rebuild)".format(output))
+                        continue
                     print("sumstat_files:{} \noutput:{} \nplinkinput:{}".format(sumstat_files, output, plinkinput))
-                    run_plink()
+                    if engine == 'native':
+                        commands.append((chrnb, clump_chromosome,
+                                         (plinkinput, sumstat_path("{}/{}".format(self.sumstat_dir, sumstat), nb), nb, output,
+                                          clump_kb, clump_p1, clump_p2, clump_r2, clump_field, clump_snp_field),
+                                         file_size("{}.bed".format(plinkinput))))
+                        continue
+                    commands.append((chrnb,
+                                     "plink --bfile {} --clump {}/{} --clump-p1 {} --clump-p2 {} --clump-r2 {} --clump-kb {} --clump-field {} --clump-snp-field {}{} --out {} ".format(
+                                        plinkinput,
+                                        self.sumstat_dir, sumstat_files,
+                                        clump_p1, clump_p2, clump_r2, clump_kb,
+                                        clump_field, clump_snp_field, resources, output),
+                                     file_size("{}.bed".format(plinkinput))))
                 else:
                     print("Warning: {}.bim not found. Moving on to next file".format(plinkinput))
+            print("Start clumping {} chromosomes with {} parallel jobs ({})".format(len(commands), jobs, engine))
+            if engine == 'native':
+                status, nclumps = run_functions(commands, jobs)
+                for chrnb in sorted(nclumps, key=lambda x: int(x[3:])):
+                    print("{}: {} clumps".format(chrnb, nclumps[chrnb]))
+            else:
+                status = run_commands(commands, jobs)
+            for chrnb, returncode in status.items():
+                if returncode == 0:
+                    output = "{}/{}/{}_{}".format(self.plink_clump_dir, output_name_with_conditions, chrnb, output_name_with_conditions)
+                    # no .clumped is written when no SNP passes clump-p1; that is recorded as an empty result
+                    manifest.record(output, keys[chrnb], [ "{}.clumped".format(output) ])
+            manifest.save()
+            check_status(status, "clump")
         else:
              print("ERROR: cannot file summary statistic files")
         print("All chromosome clumping finished!")
 
-    def select_clump_snps(self, sumstat, clump_file_name, clumpfolder_name, output_name, clump_kb, clump_p1, clump_r2):
-        start=time()
-        atexit.register(exitlog, start)
-        log("Starting Analysis: select-clump-snps")
+    # Clump every combination of the clump_kb, clump_p1 and clump_r2 lists from one LD computation per chromosome,
+    # by plink --r2 or, with the native engine, from the bfile genotypes in parallel processes
+    @traced('clump (grid)')
+    def clump_grid(self, sumstat, plink_bfile_name, output_name, clump_kb, clump_p1, clump_p2, clump_r2='0.1',
+                   clump_field='Pvalue', clump_snp_field='SNPID', jobs=1, threads=None, memory=None, force=False, engine='plink'):
+        export_tsv("{}/{}".format(self.sumstat_dir, sumstat))
+        kbs, p1s, r2s = parse_grid(clump_kb), parse_grid(clump_p1), parse_grid(clump_r2)
+        print("Clumping grid: kb {} x p1 {} x r2 {} ({} combinations)".format(kbs, p1s, r2s, len(kbs)*len(p1s)*len(r2s)))
+
+        # LD among candidate SNPs at the loosest thresholds
+        max_kb = max(float(x) for x in kbs)
+        max_p = max([float(x) for x in p1s] + [float(clump_p2)])
+        max_p1 = max(float(x) for x in p1s)
+        min_r2 = min(float(x) for x in r2s)
+        ld_dir = "{}/{}_ld".format(self.plink_clump_dir, output_name)
+        os.makedirs(ld_dir, exist_ok=True)
+        manifest = Manifest(self.result_dir, force)
+        resources = resource_flags(jobs, threads, memory)
+        commands = []
+        keys = {}
+        candidates = {}
+        for nb in range(1, 23):
+            with span('chr{}'.format(nb), kind='task'):
+                chrnb = "chr{}".format(nb)
+                plinkinput = "{}/{}_{}".format(self.plink_bfiles_dir, chrnb, plink_bfile_name)
+                if not os.path.exists("{}.bim".format(plinkinput)):
+                    print("Warning: {}.bim not found. Moving on to next file".format(plinkinput))
+                    continue
+                snps = read_sumstat(sumstat_path("{}/{}".format(self.sumstat_dir, sumstat), nb),
+                                    columns=[clump_snp_field, clump_field], filters=[(clump_field, '<=', max_p)])
+                snps = snps.rename(columns={clump_snp_field: 'SNP', clump_field: 'P'}).drop_duplicates('SNP')
+                bim = pd.read_csv("{}.bim".format(plinkinput), sep=r'\s+', header=None, usecols=[1, 3], names=['SNP', 'BP'], dtype={'SNP': str})
+                snps = snps.merge(bim.drop_duplicates('SNP'), on='SNP').sort_values('BP')
+                if len(snps) == 0:
+                    print("{}: no SNPs with {} <= {}".format(chrnb, clump_field, max_p))
+                    continue
+                candidates[chrnb] = snps
+                output = "{}/{}_{}".format(ld_dir, chrnb, output_name)
+                snps[['SNP']].to_csv("{}.candidates".format(output), index=False, header=False)
+                keys[chrnb] = manifest.key([ "{}.{}".format(plinkinput, ext) for ext in ('bed', 'bim', 'fam') ] + [ "{}.candidates".format(output) ],
+                                           {'ld_window_kb': max_kb, 'ld_window_r2': min_r2, 'engine': engine,
+                                            'index_p1': max_p1 if engine == 'native' else None},
+                                           ('plink',) if engine == 'plink' else ())
+                if manifest.current(output, keys[chrnb]):
+                    print("{}.ld is up to date".format(output))
+                    continue
+                if engine == 'native':
+                    # only pairs with a possible index SNP are needed
+                    commands.append((chrnb, grid_ld_chromosome,
+                                     (plinkinput, snps[['SNP', 'P', 'BP']], output, max_kb, max_p1, min_r2),
+                                     len(snps)))
+                    continue
+                commands.append((chrnb,
+                                 "plink --bfile {} --extract {}.candidates --r2 --ld-window-kb {} --ld-window 99999 --ld-window-r2 {}{} --out {}".format(
+                                    plinkinput, output, max_kb, min_r2, resources, output),
+                                 len(snps)))
+        print("Computing LD for {} chromosomes with {} parallel jobs ({})".format(len(commands), jobs, engine))
+        if engine == 'native':
+            status, npairs = run_functions(commands, jobs)
+        else:
+            status = run_commands(commands, jobs)
+        for chrnb, returncode in status.items():
+            if returncode == 0:
+                output = "{}/{}_{}".format(ld_dir, chrnb, output_name)
+                manifest.record(output, keys[chrnb], [ "{}.ld".format(output) ])
+        manifest.save()
+        check_status(status, "clump LD")
+
+        # every grid point is derived from the shared LD; smaller p1 values reuse the clumps of the largest
+        for chrnb, snps in candidates.items():
+            pairs = LdPairs(snps, read_ld("{}/{}_{}.ld".format(ld_dir, chrnb, output_name)))
+            for kb in kbs:
+                for r2 in r2s:
+                    clumps = pairs.clump(kb, r2, max(p1s, key=float), clump_p2)
+                    for p1 in p1s:
+                        conditions = "{}_{}_{}_{}".format(output_name, kb, p1, r2)
+                        os.makedirs("{}/{}".format(self.plink_clump_dir, conditions), exist_ok=True)
+                        selected = [ x for x in clumps if pairs.snps['P'].iat[x[0]] <= float(p1) ]
+                        write_clumped("{}/{}/{}_{}.clumped".format(self.plink_clump_dir, conditions, chrnb, conditions),
+                                      int(chrnb[3:]), pairs.snps, selected)
+            print("{}: {} grid points clumped".format(chrnb, len(kbs)*len(p1s)*len(r2s)))
+        print("All chromosome clumping finished!")
+
+    @traced('select-clump-snps')
+    def select_clump_snps(self, sumstat, clump_file_name, clumpfolder_name, output_name, clump_kb, clump_p1, clump_r2, force=False, batch=False):
+        # lists of thresholds (clump conditions from a grid) are resolved together against one sumstat read per chromosome
+        if batch or any(len(parse_grid(x)) > 1 for x in (clump_kb, clump_p1, clump_r2)):
+            return self.select_clump_snps_batch(sumstat, clump_file_name, clumpfolder_name, output_name, clump_kb, clump_p1, clump_r2, force)
 
         # Create a C+T tag
         clump_conditions = "{}_{}_{}".format(clump_kb, clump_p1, clump_r2)
@@ -288,42 +667,51 @@ class GPRS(object):
         else:
             os.mkdir("{}/{}_{}".format(self.ct_dir, clumpfolder_name, clump_conditions))
 
+        # snplists and .weight files are only rebuilt when their .clumped or sumstat file changed
+        manifest = Manifest(self.result_dir, force)
+
         # STEP1: generate [filename]_clumped_snplist.csv
         def generate_clumped_snplist():
-            visited = set()
-            if "{}_{}_{}".format(chrnb, clump_file_name, clump_conditions) not in visited:
-                print("starting to generate {}_{}_{}_clumped_snplist.csv".format(chrnb, clump_file_name, clump_conditions))
-                new_df = df.loc[(df['CHR'] == nb)]
-                new_df_2 = new_df[['CHR', 'SNP']]
-                new_df_2.to_csv("{}/{}_{}/{}_{}_{}_clumped_snplist.csv".format(self.plink_clump_dir, clumpfolder_name,
-                                                                               clump_conditions, chrnb, clump_file_name,
-                                                                               clump_conditions), sep=' ', index=False, header=True)
-                visited.add("{}_{}_{}".format(chrnb, clump_file_name, clump_conditions))
-                print("{}_{}_{} clumped snplist created".format(chrnb, clump_file_name, clump_conditions))
+            snplist = "{}/{}_{}/{}_{}_{}_clumped_snplist.csv".format(self.plink_clump_dir, clumpfolder_name,
+                                                                     clump_conditions, chrnb, clump_file_name, clump_conditions)
+            key = manifest.key([clumped], {})
+            if manifest.current(snplist, key):
+                print("{} is up to date".format(snplist))
+                return
+            print("starting to generate {}_{}_{}_clumped_snplist.csv".format(chrnb, clump_file_name, clump_conditions))
+            df = pd.read_csv(clumped, delim_whitespace=True)
+            new_df = df.loc[(df['CHR'] == nb)]
+            new_df_2 = new_df[['CHR', 'SNP']]
+            new_df_2.to_csv(snplist, sep=' ', index=False, header=True)
+            manifest.record(snplist, key, [snplist])
+            print("{}_{}_{} clumped snplist created".format(chrnb, clump_file_name, clump_conditions))
 
         for nb in range(1, 23):
             chrnb = "chr{}".format(nb)
-            if os.path.exists("{}/{}_{}/{}_{}_{}.clumped".format(self.plink_clump_dir, clumpfolder_name, clump_conditions, chrnb, clump_file_name, clump_conditions)):
-                df = pd.read_csv("{}/{}_{}/{}_{}_{}.clumped".format(self.plink_clump_dir, clumpfolder_name, clump_conditions, chrnb, clump_file_name, clump_conditions), delim_whitespace=True)
-                generate_clumped_snplist()
+            clumped = "{}/{}_{}/{}_{}_{}.clumped".format(self.plink_clump_dir, clumpfolder_name, clump_conditions, chrnb, clump_file_name, clump_conditions)
+            if os.path.exists(clumped):
+                with span('chr{}'.format(nb), kind='task'):
+                    generate_clumped_snplist()
             else:
                 print("{}/{}_{}/{}_{}_{}.clumped not found. Move to next .clumped file".format(self.plink_clump_dir, clumpfolder_name, clump_conditions, chrnb, clump_file_name, clump_conditions))
         print("STEP 1 finished. Move to STEP2")
 
         # STEP2: generate snplist with qc information (Allele Beta SE Pvalue)
         def generate_qc_snplist():
-            visited = set()
-            if clump_snp_file not in visited:
-                    print("start extracting {} and {}".format(sumstat_files, clump_snp_file))
-                    clump_snp = pd.read_csv(clump_snp_file, delim_whitespace=True)
-                    clump_snp.rename(columns={'SNP': 'SNPID'}, inplace=True)
-                    qc_snp = pd.read_csv("{}".format(sumstat_files), delim_whitespace=True)
-                    newsnplist = qc_snp[qc_snp["SNPID"].isin(clump_snp["SNPID"])]
-                    newsnplist.to_csv("{}/{}_{}/{}.weight".format(self.ct_dir, clumpfolder_name, clump_conditions, output), sep=' ', index=False, header=True)
-                    print("{}.weight created".format(output))
-            else:
-                pass
-            visited.add("{}".format(clump_snp_file))
+            weight = "{}/{}_{}/{}.weight".format(self.ct_dir, clumpfolder_name, clump_conditions, output)
+            key = manifest.key([clump_snp_file, sumstat_files], {'clump_p1': clump_p1})
+            if manifest.current(weight, key):
+                print("{}.weight is up to date".format(output))
+                return
+            print("start extracting {} and {}".format(sumstat_files, clump_snp_file))
+            clump_snp = pd.read_csv(clump_snp_file, delim_whitespace=True)
+            clump_snp.rename(columns={'SNP': 'SNPID'}, inplace=True)
+            # index SNPs all pass p1, so only those rows are read from the sumstat
+            qc_snp = read_sumstat(sumstat_files, filters=[('Pvalue', '<=', float(clump_p1))])
+            newsnplist = qc_snp[qc_snp["SNPID"].isin(clump_snp["SNPID"])]
+            newsnplist.to_csv(weight, sep=' ', index=False, header=True, na_rep='NA')
+            manifest.record(weight, key, [weight])
+            print("{}.weight created".format(output))
 
         if any("chr" in file and "{}".format(sumstat) in file for file in os.listdir(self.sumstat_dir)):
             for nb in range(1, 23):
@@ -333,37 +721,210 @@ class GPRS(object):
                                                                                  clump_conditions,
                                                                                  chrnb, clump_file_name,
                                                                                  clump_conditions))
-                sumstat_files = "{}/{}_{}.csv".format(self.sumstat_dir, sumstat, chrnb)
+                sumstat_files = sumstat_path("{}/{}".format(self.sumstat_dir, sumstat), nb)
                 output = "{}_{}_{}".format(chrnb, output_name, clump_conditions)
                 if os.path.exists("{}".format(clump_snp_file)):
                     print("clump_snp_file:{} \noutput:{} \nsumstat_files:{}".format(clump_snp_file, output, sumstat_files))
-                    generate_qc_snplist()
+                    with span('chr{}'.format(nb), kind='task'):
+                        generate_qc_snplist()
                 else:
                     print("{} not found skip".format(clump_snp_file))
         else:
             print("ERROR: chr information are not found")
+        manifest.save()
         print("All jobs are completed")
 
-    def ldpred2_train(self, bfile, sumstat, out, r, h2='', ldref='', ldmatrix='./tmp-data/LD_matrix'):
-        start=time()
-        atexit.register(exitlog, start)
-#        log("Starting Analysis: ldpred2-train")
+    # Write the .weight files of every clump condition, reading each chromosome's sumstat once
+    @traced('select-clump-snps (batch)')
+    def select_clump_snps_batch(self, sumstat, clump_file_name, clumpfolder_name, output_name, clump_kb, clump_p1, clump_r2, force=False):
+        conditions = [ "{}_{}_{}".format(kb, p1, r2) for kb in parse_grid(clump_kb) for p1 in parse_grid(clump_p1) for r2 in parse_grid(clump_r2) ]
+        p1s = { "{}_{}_{}".format(kb, p1, r2): float(p1) for kb in parse_grid(clump_kb) for p1 in parse_grid(clump_p1) for r2 in parse_grid(clump_r2) }
+        print("{} clump conditions".format(len(conditions)))
+        for conditions_tag in conditions:
+            os.makedirs("{}/{}_{}".format(self.ct_dir, clumpfolder_name, conditions_tag), exist_ok=True)
+        manifest = Manifest(self.result_dir, force)
+        nweights = 0
+
+        for nb in range(1, 23):
+            with span('chr{}'.format(nb), kind='task'):
+                chrnb = "chr{}".format(nb)
+                sumstat_files = sumstat_path("{}/{}".format(self.sumstat_dir, sumstat), nb)
+                # conditions of this chromosome whose .weight is missing or out of date
+                todo = {}
+                for conditions_tag in conditions:
+                    clumped = "{}/{}_{}/{}_{}_{}.clumped".format(self.plink_clump_dir, clumpfolder_name, conditions_tag, chrnb, clump_file_name, conditions_tag)
+                    weight = "{}/{}_{}/{}_{}_{}.weight".format(self.ct_dir, clumpfolder_name, conditions_tag, chrnb, output_name, conditions_tag)
+                    if not os.path.exists(clumped):
+                        continue
+                    key = manifest.key([clumped, sumstat_files], {'clump_p1': p1s[conditions_tag]})
+                    if manifest.current(weight, key):
+                        continue
+                    todo[conditions_tag] = (clumped, weight, key)
+                if len(todo) == 0:
+                    continue
+
+                # one read of the sumstat, SNPID-indexed, at the loosest p1 of the conditions
+                table = read_sumstat(sumstat_files, filters=[('Pvalue', '<=', max(p1s[x] for x in todo))])
+                index = pd.Index(table['SNPID'])
+                for conditions_tag, (clumped, weight, key) in todo.items():
+                    clump_snp = pd.read_csv(clumped, sep=r'\s+', usecols=['CHR', 'SNP'], dtype={'SNP': str})
+                    rows = index.get_indexer_for(clump_snp.loc[clump_snp['CHR'] == nb, 'SNP'])
+                    # keep the sumstat order, as the single-condition mode does
+                    newsnplist = table.iloc[sorted(set(rows[rows >= 0]))]
+                    newsnplist = newsnplist[newsnplist['Pvalue'] <= p1s[conditions_tag]]
+                    newsnplist.to_csv(weight, sep=' ', index=False, header=True, na_rep='NA')
+                    manifest.record(weight, key, [weight])
+                    nweights += 1
+                print("{}: {} .weight files written from one sumstat read".format(chrnb, len(todo)))
+        manifest.save()
+        print("{} .weight files created. All jobs are completed".format(nweights))
+
+    @traced('ldpred2-train')
+    def ldpred2_train(self, bfile, sumstat, out, r='R', h2='', ldref='', ldmatrix='./tmp-data/LD_matrix', engine='R',
+                      window=3000, unit='kb', jobs=1, burn_in=BURN_IN, num_iter=NUM_ITER, seed=1, grid_chunk=GRID_CHUNK):
+        if engine == 'python':
+            return self.ldpred2_python(bfile, sumstat, out, h2, ldref, window, unit, jobs, burn_in, num_iter, seed, grid_chunk)
+        # ldpred2.R reads the text format
+        export_tsv(sumstat)
 
         command="{}script --vanilla ./gprs/ldpred2.R --train {} --sumstat {} --output_dir {}/{}".format(r, bfile, sumstat,self.ldpred2_dir, out)                                                                                        
         if len(ldref) > 0 :
             command += " --LDref {}".format(ldref)
         if ldmatrix != './tmp-data/LD_matrix':
             command += " --LDmatrix {}".format(ldmatrix)
+        if h2 == 'ldsc':
+            # estimated natively from the LD store, so ldpred2.R does not reload every LD matrix for snp_ldsc;
+            # on the 3 cM window ldpred2.R computes its LD in (snp_cor size = 3 / 1000 on genetic positions)
+            ref = ldref if len(ldref) > 0 else bfile
+            cm = pd.read_csv('{}.bim'.format(ref), sep=r'\s+', header=None, usecols=[2])[2]
+            if (cm != 0).any():
+                window, unit = 3, 'cm'
+            else:
+                print('Warning: {}.bim has no genetic positions, LD scores use a {} {} window instead of the 3 cM of ldpred2.R'.format(ref, window, unit))
+            h2 = str(self.ldsc_h2(ref, sumstat, window, unit, jobs)['h2'])
+            print('Estimated SNP heritability by LDSC = {}'.format(h2))
         if len(h2) > 0 :
             command += " --h2 {}".format(h2)
+        # ldpred2.R keeps one LD_chr*.rds per SNP set under this reference hash and reuses them across traits
+        command += " --LDkey {}".format(content_hash(ldref if len(ldref) > 0 else bfile, '{}/fingerprints.json'.format(self.ld_dir)))
+
+        run(command, 'ldpred2.R')
 
-        call(command, shell=True)
+    # LDpred2-inf and grid models in Python on the LD store; Gibbs samplers of (chromosome, grid points) run in parallel
+    @traced('ldpred2-train (python)')
+    def ldpred2_python(self, bfile, sumstat, out, h2='', ldref='', window=3000, unit='kb', jobs=1,
+                       burn_in=BURN_IN, num_iter=NUM_ITER, seed=1, grid_chunk=GRID_CHUNK):
+        jobs = int(jobs)
+        ref = ldref if len(ldref) > 0 else bfile
+        stats = pd.concat([read_sumstat(sumstat_path(sumstat, chrnb), columns=['SNPID', 'Effect_Allele', 'NonEffect_Allele', 'Beta', 'SE', 'N_eff'])
+                           for chrnb in range(1, 23) if os.path.exists(sumstat_path(sumstat, chrnb))])
+        store = LdStore(self.ld_dir, ref, window, unit)
+        snps = match_ref(stats, store.bim())
+        print('{} of {} sumstat SNPs matched to {}'.format(len(snps), len(stats), ref))
+        if ref != bfile:
+            # SNPs of the LD reference that are also in the training dataset, by position as ldpred2.R
+            train = pd.read_csv('{}.bim'.format(bfile), sep=r'\s+', header=None, usecols=[0, 3], names=['CHR', 'POS'], dtype=str)
+            snps = snps[pd.MultiIndex.from_frame(snps[['CHR', 'POS']].astype(str)).isin(pd.MultiIndex.from_frame(train))].reset_index(drop=True)
+            print('{} SNPs also in training dataset {}'.format(len(snps), bfile))
+        if len(snps) == 0:
+            sys.exit('ERROR: no sumstat SNP found in {}\n'.format(ref))
+        store.update(snps['SNPID'], jobs)
+        if len(h2) == 0 or h2 == 'ldsc':
+            h2 = self.ldsc_h2(ref, sumstat, window, unit, jobs)['h2']
+            print('Estimated SNP heritability by LDSC = {}'.format(h2))
+        h2 = float(h2)
+        if not h2 > 0:
+            sys.exit('ERROR: SNP heritability must be positive to train LDpred2, got {}\n'.format(h2))
+
+        # SNPs in genome order, effects on standardized genotypes
+        snps = snps.sort_values('ROW').reset_index(drop=True)
+        beta_hat, scale = standardized(snps['BETA'].to_numpy(), snps['SE'].to_numpy(), snps['N'].to_numpy())
+        chromosomes = {str(x): np.flatnonzero(snps['CHR'].astype(str).to_numpy() == str(x)) for x in pd.unique(snps['CHR'])}
+        m = len(snps)
+        print('Infinitesimal model..')
+        calls = [(chrnb, ldpred_inf, (store.path, chrnb, snps['ROW'].to_numpy()[i], beta_hat[i], snps['N'].to_numpy()[i], h2, m), len(i))
+                 for (chrnb, i) in chromosomes.items()]
+        status, results = run_functions(calls, jobs)
+        check_status(status, 'LDpred2-inf')
+        beta_inf = np.zeros(m)
+        for chrnb, i in chromosomes.items():
+            beta_inf[i] = results[chrnb]
+
+        grid = [(p, x, sparse) for sparse in (False, True) for x in h2_grid(h2) for p in p_grid()]
+        chunks = [grid[x:x + int(grid_chunk)] for x in range(0, len(grid), int(grid_chunk))]
+        print('Grid model: {} grid points in {} tasks..'.format(len(grid), len(chunks) * len(chromosomes)))
+        # one seed per task, so results do not depend on jobs
+        tasks = [(chrnb, k) for chrnb in chromosomes for k in range(len(chunks))]
+        seeds = np.random.SeedSequence(int(seed)).spawn(len(tasks))
+        calls = [('chr{}_grid{}'.format(chrnb, k), ldpred_gibbs,
+                  (store.path, chrnb, snps['ROW'].to_numpy()[chromosomes[chrnb]], beta_hat[chromosomes[chrnb]], snps['N'].to_numpy()[chromosomes[chrnb]],
+                   chunks[k], m, int(burn_in), int(num_iter), seeds[t]), len(chromosomes[chrnb]) * len(chunks[k]))
+                 for t, (chrnb, k) in enumerate(tasks)]
+        status, results = run_functions(calls, jobs)
+        check_status(status, 'LDpred2-grid')
+        beta_grid = np.zeros((m, len(grid)))
+        for chrnb, k in tasks:
+            beta_grid[chromosomes[chrnb], k * int(grid_chunk):k * int(grid_chunk) + len(chunks[k])] = results['chr{}_grid{}'.format(chrnb, k)]
+
+        # per-model directories laid out like ldpred2.R, for beta-list and build-prs
+        out_dir = '{}/{}'.format(self.ldpred2_dir, out)
+        print('Outputting Betas..')
+        write_weights(out_dir, 'beta_inf', snps, beta_inf * scale)
+        for j, (p, x, sparse) in enumerate(grid):
+            name = grid_name(p, x, sparse)
+            if not np.isfinite(beta_grid[:, j]).all():
+                print('Skipping LDPred2_{} due to presence of infinite/null values.'.format(name))
+                continue
+            write_weights(out_dir, name, snps, beta_grid[:, j] * scale)
+        print('Betas Saved in {}'.format(out_dir))
+
+    # LD scores from the LD store (built or extended for the sumstat SNPs) and two-step LDSC
+    def ldsc_h2(self, bfile, sumstat, window=3000, unit='kb', jobs=1):
+        stats = pd.concat([read_sumstat(sumstat_path(sumstat, chrnb), columns=['SNPID', 'Beta', 'SE', 'N_eff']) for chrnb in range(1, 23)
+                           if os.path.exists(sumstat_path(sumstat, chrnb))]).dropna().drop_duplicates('SNPID')
+        store = LdStore(self.ld_dir, bfile, window, unit)
+        if unit == 'cm' and (store.bim()['CM'] == 0).all():
+            sys.exit('ERROR: {}.bim has no genetic positions (cM) for a cM window; add them with plink --cm-map\n'.format(bfile))
+        wanted = store.update(stats['SNPID'], int(jobs))
+        scores = store.ld_scores(wanted, int(jobs))
+        # SNPs in genome order for the block jackknife
+        chrnbs = sorted(scores, key=lambda x: (len(x), x))
+        rows = np.concatenate([scores[x][0] for x in chrnbs])
+        ld = pd.Series(np.concatenate([scores[x][1] for x in chrnbs]), index=store.bim()['SNP'].to_numpy()[rows])
+        stats = stats.set_index('SNPID').loc[ld.index]
+        print('{} SNPs with LD scores in {}'.format(len(ld), store.path))
+        result = ldsc(ld.to_numpy(), (stats['Beta'].astype(np.float64) / stats['SE'].astype(np.float64)).to_numpy() ** 2,
+                      stats['N_eff'].astype(np.float64).to_numpy())
+        result['snps'] = len(ld)
+        return result
+
+    @traced('ldsc')
+    def ldsc(self, bfile, sumstat, out='', window=3000, unit='kb', jobs=1):
+        result = self.ldsc_h2(bfile, sumstat, window, unit, jobs)
+        print('Intercept = {:.4f} ({:.4f})'.format(result['int'], result['int_se']))
+        print('SNP heritability = {:.4f} ({:.4f})'.format(result['h2'], result['h2_se']))
+        if len(out) > 0:
+            pd.DataFrame([result]).to_csv('{}/{}.ldsc'.format(self.ld_dir, out), sep='\t', index=False)
+            print('Result saved as {}/{}.ldsc'.format(self.ld_dir, out))
+
+    # Sparse LD matrices of a reference bfile in result/ld, reused across runs; only missing SNPs are computed
+    @traced('build-ld')
+    def build_ld(self, bfile, sumstat='', snplist='', window=3000, unit='kb', jobs=1, block_size=1024):
+        snps = None
+        if len(sumstat) > 0:
+            snps = pd.concat([read_sumstat(sumstat_path(sumstat, chrnb), columns=['SNPID'])['SNPID'] for chrnb in range(1, 23)
+                              if os.path.exists(sumstat_path(sumstat, chrnb))])
+            print('{} SNPs in {}'.format(len(snps), sumstat))
+        elif len(snplist) > 0:
+            snps = pd.read_csv(snplist, sep=r'\s+', header=None, usecols=[0], dtype=str)[0]
+            print('{} SNPs in {}'.format(len(snps), snplist))
+        store = LdStore(self.ld_dir, bfile, window, unit)
+        wanted = store.update(snps, int(jobs), int(block_size))
+        print('LD of {} SNPs on {} chromosomes is in {}'.format(sum(len(x) for x in wanted.values()), len(wanted), store.path))
 
     #make beta list for multiple_prs function.
+    @traced('beta-list')
     def beta_list(self, beta_dirs, out):
-        start=time()
-        atexit.register(exitlog, start)
-        log("Starting Analysis: beta-list")
         beta_dirs = beta_dirs.split()
         print('Iterating {} beta directoreis..'.format( len(beta_dirs)))
         allmodels={}
@@ -379,18 +940,16 @@ class GPRS(object):
                 o.write('{}\t{}\n'.format(x, allmodels[x]))
         print('File {}.list saved in ./result/prs!\n'.format(out))
 
+    @traced('multiple-prs')
     def multiple_prs(self, vcf_dir, beta_dir_list,
-                slurm_name, slurm_account='chia657_28', slurm_time='12:00:00', memory=10,
+                slurm_name='gprs_prs', slurm_account='chia657_28', slurm_time='12:00:00', memory=10,
                 symbol='.',
                 columns='1 4 6', plink_modifier='no-mean-imputation cols=nmissallele,dosagesum,scoresums',
-                combine='T', out=''):
-        start=time()
-        atexit.register(exitlog, start)
-        log("Starting Analysis: multiple-prs")
+                combine='T', out='', executor='slurm',
+                slurm_setup='module load usc\nmodule load plink2\nsource ./venv/bin/activate', force=False):
     # read in list of beta directories and path dictionary
         print('Reading list of beta directories..{}'.format(beta_dir_list))
-        beta_list_file = pd.read_csv(beta_dir_list, header=None, sep='\t', index_col=0, squeeze=True)
-        beta_list = beta_list_file.T.to_dict()
+        beta_list = read_beta_list(beta_dir_list)
         print('{} models found'.format( len(beta_list)))
 
         # create output folder
@@ -402,45 +961,52 @@ class GPRS(object):
             os.makedirs(out, exist_ok=True)
             print('Output will be saved in {}'.format(out))
 
+        # memory per model from its number of SNPs; models are packed into tasks within the memory budget (GB)
+        budget = int(memory*1000)
+        models = []
+        for model, beta_dir in beta_list.items():
+            snps = model_snps(beta_dir)
+            models.append((model, snps, estimate_memory(snps)))
+            if models[-1][2] > budget:
+                print('Warning: {} ({} SNPs) needs ~{} MB, more than --memory; it gets a task of its own'.format(model, snps, models[-1][2]))
+        tasks = pack_models(models, budget)
+        print('{} models packed into {} tasks of at most {} MB'.format(len(models), len(tasks), budget))
+
         # compile args for build_prs
-        args = "--beta_dir_list {} --memory {} --symbol {} --columns '{}' --plink_modifier '{}' --combine {} --out {}".format(
-                beta_dir_list, memory*1000, symbol, columns, plink_modifier, combine, out)
-
-        # write slurm script
-        command = """#!/bin/sh
-#SBATCH --ntasks=1
-#SBATCH --nodes=1
-#SBATCH --account={}
-#SBATCH --time={}
-#SBATCH --mem-per-cpu={}gb
-#SBATCH --job-name={}
-#SBATCH --output=slurm.%x.%j.out
-#SBATCH --error=slurm.%x.%j.err
-#SBATCH --array=0-{}\n
-module load usc
-module load plink2
-arr=( {} )\n
-
-source ./venv/bin/activate\n
-
-gprs build-prs --vcf_dir {} --model""".format(
-                    slurm_account, slurm_time, memory, slurm_name, len(beta_list)-1, 
-                    ' '.join(beta_list.keys()), 
-                    vcf_dir)
-        command+= ' ${arr[$SLURM_ARRAY_TASK_ID]} '
-        command+= args+'\n'
-
-        with open('build-prs.sh','w') as o:
-            o.writelines(command)
-        os.system('sbatch build-prs.sh')
+        args = "--beta_dir_list {} --symbol {} --columns '{}' --plink_modifier '{}' --combine {} --out {}".format(
+                beta_dir_list, symbol, columns, plink_modifier, combine, out)
+        if force:
+            args += " --force"
+        def command(model, memory_mb):
+            return "gprs build-prs --vcf_dir {} --model {} --memory {} {}".format(vcf_dir, model, memory_mb, args)
 
+        status_dir = '{}/status'.format(out)
+        if executor == 'local':
+            rows = LocalExecutor(command, status_dir).run(tasks)
+            # build-prs does not fail on plink2 errors, so also require the combined score
+            for row in rows:
+                if combine == 'T' and row['state'] == 'done' and not os.path.exists('{}/{}.sscore'.format(out, row['model'])):
+                    row['state'] = 'failed'
+        elif executor == 'dry-run':
+            rows = DryRunExecutor(command, status_dir).run(tasks)
+        else:
+            rows = SlurmExecutor(command, status_dir, slurm_name, slurm_account, slurm_time, slurm_setup).run(tasks)
+            print('Run "gprs multiple-prs-status --out {}" to gather the task status'.format(out))
+        write_status('{}/multiple_prs.status'.format(out), rows)
+
+    # Gather the exit status of SLURM tasks submitted by multiple-prs
+    def multiple_prs_status(self, out):
+        if not out.startswith(self.prs_dir):
+            out = "{}/{}".format( self.prs_dir, out )
+        if not os.path.exists('{}/multiple_prs.status'.format(out)):
+            sys.exit('ERROR: {}/multiple_prs.status not found. Run multiple-prs first\n'.format(out))
+        collect('{}/multiple_prs.status'.format(out), '{}/status'.format(out))
+
+    @traced('build-prs')
     def build_prs(self, vcf_dir, model, beta_dir_list, memory, out,
                     symbol='.',
                     columns='1 4 6', plink_modifier="no-mean-imputation cols=nmissallele,dosagesum,scoresums",
-                    combine='T'):            
-        start=time()
-        atexit.register(exitlog, start)
-        log("Starting Analysis: build-prs")
+                    combine='T', force=False):
 
         # create output folder per model with same name
         os.makedirs("{}/{}".format(out, model), exist_ok=True)
@@ -448,52 +1014,142 @@ gprs build-prs --vcf_dir {} --model""".format(
         beta_list_file = pd.read_csv(beta_dir_list, header=None, sep='\t', index_col=0, squeeze=True)
         beta_list = beta_list_file.T.to_dict()
         print('Building PRS for "{}" model in {}...'.format(model, beta_list[model]))
-        # master score dataframe
-        all=pd.DataFrame(columns=['#IID'])
+        # chromosomes scored before with the same vcf, beta file and options are not recomputed
+        manifest = Manifest(self.result_dir, force)
 
         for nb in range(1, 23):
-            chrnb = "chr{}".format(nb)
-            # Define and check number of beta file
-            beta_file = list( filter( lambda x: x.startswith("{}{}".format(chrnb, "_")) and x.endswith(".weight"), os.listdir(beta_list[model])))
-            if len(beta_file) < 1 :
-                print("{} beta file in {} not found. skip".format(chrnb, model))
-            elif len(beta_file) > 1 :
-                raise Exception("Multiple {} beta files in {}. Skip".format(chrnb, model))
-            else:
-                # only if there's one beta file
-                beta_file=beta_file[0]
-                # Define vcf file
-                for vcf_file in os.listdir(vcf_dir):
-                    if vcf_file.endswith('.vcf.gz') and "{}{}".format(chrnb, symbol) in vcf_file:
-                        os.system("plink2 --vcf {}/{} dosage=DS --score {}/{} {} {} --memory {} --out {}/{}/{}_{}".format(
-                                                                             vcf_dir, vcf_file,
-                                                                             beta_list[model], beta_file, columns, plink_modifier,
-                                                                             memory,
-                                                                             out,model, chrnb, model))
-                        if os.path.exists('{}/{}/{}_{}.sscore'.format(out, model, chrnb, model)):
-                            print("{}_{}.sscore saved in {}/{}".format(chrnb, model, out, model))
-                            file = pd.read_csv('{}/{}/{}_{}.sscore'.format(out, model, chrnb, model), sep='\t')
-                            file.rename(columns={'SCORE1_SUM':'SCORE_{}'.format(chrnb), 'NMISS_ALLELE_CT':'ALLELE_CT_{}'.format(chrnb)}, inplace=True)
-                            if len(all) == 0:
-                                all=all.merge(file[['#IID','SCORE_{}'.format(chrnb), 'ALLELE_CT_{}'.format(chrnb)]], how='right')
+            with span('chr{}'.format(nb), kind='task'):
+                chrnb = "chr{}".format(nb)
+                # Define and check number of beta file
+                beta_file = list( filter( lambda x: x.startswith("{}{}".format(chrnb, "_")) and x.endswith(".weight"), os.listdir(beta_list[model])))
+                if len(beta_file) < 1 :
+                    print("{} beta file in {} not found. skip".format(chrnb, model))
+                elif len(beta_file) > 1 :
+                    raise Exception("Multiple {} beta files in {}. Skip".format(chrnb, model))
+                else:
+                    # only if there's one beta file
+                    beta_file=beta_file[0]
+                    # Define vcf file
+                    for vcf_file in os.listdir(vcf_dir):
+                        if vcf_file.endswith('.vcf.gz') and "{}{}".format(chrnb, symbol) in vcf_file:
+                            sscore = '{}/{}/{}_{}'.format(out, model, chrnb, model)
+                            key = manifest.key(["{}/{}".format(vcf_dir, vcf_file), "{}/{}".format(beta_list[model], beta_file)],
+                                               {'columns': columns, 'plink_modifier': plink_modifier}, ('plink2',))
+                            if manifest.current(sscore, key):
+                                print("{}_{}.sscore is up to date (use --force to rebuild)".format(chrnb, model))
                             else:
-                                all=all.merge(file[['#IID','SCORE_{}'.format(chrnb), 'ALLELE_CT_{}'.format(chrnb)]], on='#IID')
-                
+                                run("plink2 --vcf {}/{} dosage=DS --score {}/{} {} {} --memory {} --out {}/{}/{}_{}".format(
+                                                                                 vcf_dir, vcf_file,
+                                                                                 beta_list[model], beta_file, columns, plink_modifier,
+                                                                                 memory,
+                                                                                 out,model, chrnb, model), '{}_{}'.format(chrnb, model))
+                                if os.path.exists('{}.sscore'.format(sscore)):
+                                    manifest.record(sscore, key, ['{}.sscore'.format(sscore)])
+                                    manifest.save()
+                            if os.path.exists('{}/{}/{}_{}.sscore'.format(out, model, chrnb, model)):
+                                print("{}_{}.sscore saved in {}/{}".format(chrnb, model, out, model))
+
+        # per-chromosome scores into the score matrix store of [out], on its fixed sample index
+        sscores = chromosome_sscores('{}/{}'.format(out, model), model)
+        store = ScoreMatrix(out)
+        store.write(model, ((nb,) + read_sscore(sscores[nb]) for nb in sorted(sscores)))
         if combine == 'T':
             print('\nOption to combine scores per chromsome is ON')
-            all['SCORE_SUM']=all.filter(like='SCORE').sum(axis=1)
-            all['TOTAL_ALLELE_CT']=all.filter(like='ALLELE_CT').sum(axis=1)
-            print('Summary for scores...')
-            print(all[['SCORE_SUM']].describe())
-            all = all.assign( SCORE_STD = (all.SCORE_SUM-all.SCORE_SUM.mean())/all.SCORE_SUM.std() )
-            all[['#IID', 'SCORE_SUM', 'SCORE_STD','TOTAL_ALLELE_CT']].to_csv('{}/{}.sscore'.format(out, model), index=False, sep='\t')
-            print('Done! Combined score for "{}" model saved'.format(model))
+            self.write_combined_prs(store, model, '{}/{}.sscore'.format(out, model))
+
+    def write_combined_prs(self, store, model, path, samples=None):
+        combined = store.genome_wide(model, samples)
+        print('Summary for scores...')
+        print(combined[['SCORE_SUM']].describe())
+        write_sscore(combined, path)
+        print('Done! Combined score for "{}" model saved'.format(model))
+
+    def score_store(self, model):
+        """
+        Score matrix store holding a model: [out]/scores of build-prs or batch-prs under result/prs, or a store
+        filled from the chr[n]_[model].sscore files of a model directory (or of result/prs itself).
+        """
+        for path in sorted(glob.glob('{0}/**/{1}/*/{2}.score.npy'.format(self.prs_dir, SCORE_DIR, glob.escape(model)), recursive=True)):
+            return ScoreMatrix(os.path.dirname(os.path.dirname(os.path.dirname(path))))
+        model_dirs = [x for x in glob.glob('{}/**/{}'.format(self.prs_dir, glob.escape(model)), recursive=True) if os.path.isdir(x)]
+        for model_dir in [self.prs_dir] + sorted(model_dirs):
+            sscores = chromosome_sscores(model_dir, model)
+            if len(sscores) > 0:
+                root = os.path.dirname(model_dir) if model_dir != self.prs_dir else model_dir
+                print('Storing {} chromosome scores of {} from {}'.format(len(sscores), model, model_dir))
+                store = ScoreMatrix(root)
+                store.write(model, ((nb,) + read_sscore(sscores[nb]) for nb in sorted(sscores)))
+                return store
+        sys.exit('ERROR: no scores of {} found in {}\n'.format(model, self.prs_dir))
+
+    # Genome-wide .sscore of a clumping model from its per-chromosome scores
+    @traced('combine-prs')
+    def combine_prs(self, filename, clump_kb, clump_p1, clump_r2):
+        model = '{}_{}_{}_{}'.format(filename, clump_kb, clump_p1, clump_r2)
+        store = self.score_store(model)
+        self.write_combined_prs(store, model, '{}/{}.sscore'.format(os.path.dirname(store.path), model))
+
+    # Genome-wide .sscore of a clumping model for the individuals listed in indv (first column), standardised within them
+    @traced('filtered-sscore-w-indv')
+    def filtered_sscore_w_indv(self, data_set_name, clump_kb, clump_p1, clump_r2, indv, output_name):
+        model = '{}_{}_{}_{}'.format(data_set_name, clump_kb, clump_p1, clump_r2)
+        individuals = pd.read_csv(indv, sep=r'\s+', header=None, usecols=[0], dtype=str, keep_default_na=False)[0]
+        print('{} individuals in {}'.format(len(individuals), indv))
+        store = self.score_store(model)
+        self.write_combined_prs(store, model, '{}/{}.sscore'.format(os.path.dirname(store.path), output_name), individuals)
+
+    # Score every model in beta_dir_list with one pass over the vcf files (instead of one plink2 run per model and chromosome)
+    @traced('batch-prs')
+    def batch_prs(self, vcf_dir, beta_dir_list, out='', symbol='.', columns='1 4 6', block_size=512, threads=4, force=False):
+        beta_list = read_beta_list(beta_dir_list)
+        print('{} models found'.format( len(beta_list)))
+
+        # create output folder
+        if out == '':
+            out = self.prs_dir
+            print('Warning: output directory not defined. Will be saved in {}'.format(self.prs_dir))
+        else:
+            out = "{}/{}".format( self.prs_dir, out )
+            os.makedirs(out, exist_ok=True)
+            print('Output will be saved in {}'.format(out))
+
+        vcf_files = {}
+        for nb in range(1, 23):
+            for vcf_file in os.listdir(vcf_dir):
+                if vcf_file.endswith('.vcf.gz') and "chr{}{}".format(nb, symbol) in vcf_file:
+                    vcf_files[nb] = "{}/{}".format(vcf_dir, vcf_file)
+
+        # skip when no vcf, .weight file or option changed since the last run
+        manifest = Manifest(self.result_dir, force)
+        weight_files = [ "{}/{}".format(beta_dir, x) for beta_dir in beta_list.values() for x in sorted(os.listdir(beta_dir)) if x.endswith('.weight') ]
+        key = manifest.key([ vcf_files[nb] for nb in sorted(vcf_files) ] + weight_files,
+                           {'models': sorted(beta_list.items()), 'columns': columns})
+        step = "{}/{}".format(out, os.path.basename(beta_dir_list))
+        if manifest.current(step, key):
+            print('Scores for {} models are up to date in {} (use --force to rebuild)'.format(len(beta_list), out))
+            return
+
+        # partial scores go to the score matrix store chromosome by chromosome, for combine-prs and filtered-sscore-w-indv
+        store = ScoreMatrix(out)
+        samples, models, score_sum, total_allele_ct = score_models(vcf_files, beta_list, columns, block_size, threads, store)
+        if samples is None:
+            sys.exit('ERROR: no chromosome could be scored. Check --vcf_dir, --symbol and the beta directories\n')
+        score_std = (score_sum - score_sum.mean(axis=0)) / score_sum.std(axis=0, ddof=1)
+        for i, model in enumerate(models):
+            pd.DataFrame({'#IID': samples,
+                          'SCORE_SUM': score_sum[:, i],
+                          'SCORE_STD': score_std[:, i],
+                          'TOTAL_ALLELE_CT': total_allele_ct[:, i].astype(int)}).to_csv('{}/{}.sscore'.format(out, model), index=False, sep='\t')
+        manifest.record(step, key, [ '{}/{}.sscore'.format(out, model) for model in models ])
+        manifest.save()
+        print('Done! Combined scores for {} models saved in {}'.format(len(models), out))
 
     # Calculate the PRS statistical results and output the statistics summary
-    def prs_stat(self, score, pheno, data, model, binary, pop_prev, plotroc, r):
-        start=time()
-        atexit.register(exitlog, start)
-        log("Starting Analysis: prs-stat")
+    @traced('prs-stat')
+    def prs_stat(self, score, pheno, data, model='', binary=False, pop_prev='NA', plotroc=False, r='R', force=False, engine='python'):
+        # in-process statistics for one .sscore or every .sscore in a directory; engine='R' runs prs_stat.R
+        if engine == 'python':
+            return self.prs_stat_python(score, pheno, data, model, binary, pop_prev, plotroc, force)
 
         if os.path.exists(score):
             if binary:
@@ -510,24 +1166,112 @@ gprs build-prs --vcf_dir {} --model""".format(
                 os.makedirs("{}/{}".format(self.stat_dir, data),exist_ok=True)
             else:
                 print("Warning: statistics directory for {} already exists. Result will be overwritten with same model name. \n".format(data))
+            # skip when the score, phenotype, options and script are unchanged
+            manifest = Manifest(self.result_dir, force)
+            stat = "{}/{}/{}".format(self.stat_dir, data, model)
+            key = manifest.key([score, pheno, './gprs/prs_stat.R'], {'family': family, 'pop_prev': pop_prev, 'plotroc': plotroc}, ('{}script'.format(r),))
+            if manifest.current(stat, key):
+                print("{}.stat is up to date (use --force to rebuild)".format(stat))
+                return
             # The R script is written by Soyoung Jeon
-            call("{0}script --vanilla ./gprs/prs_stat.R {1} {2} {3} {4} {5} {6} {7}/{8}/{1}".format(r, model, score, pheno,
+            run("{0}script --vanilla ./gprs/prs_stat.R {1} {2} {3} {4} {5} {6} {7}/{8}/{1}".format(r, model, score, pheno,
                                                                             family, pop_prev, plotroc, 
-                                                                            self.stat_dir, data), shell=True)
+                                                                            self.stat_dir, data), 'prs_stat.R {}'.format(model))
+            if os.path.exists("{}.stat".format(stat)):
+                manifest.record(stat, key, ["{}.stat".format(stat)])
+                manifest.save()
         else:
             print("{} not found. Please check the sscore again".format(score))
 
 
+    # Same statistics as prs_stat.R, for every model in one process with the phenotype file read once
+    @traced('prs-stat (python)')
+    def prs_stat_python(self, score, pheno, data, model='', binary=False, pop_prev='NA', plotroc=False, force=False):
+        score_files = find_score_files(score, model)
+        family = 'binary' if binary else 'quantitative'
+        if binary and pop_prev == 'NA':
+            sys.exit('ERROR: Population disease prevalence for calculating liability r2 is not specified\n')
+        os.makedirs("{}/{}".format(self.stat_dir, data), exist_ok=True)
+
+        # models whose score, phenotype and options are unchanged are skipped
+        manifest = Manifest(self.result_dir, force)
+        params = {'family': family, 'pop_prev': pop_prev, 'plotroc': plotroc, 'engine': 'python'}
+        keys = { x: manifest.key([score_files[x], pheno], params) for x in score_files }
+        todo = { x: score_files[x] for x in score_files if not manifest.current("{}/{}/{}".format(self.stat_dir, data, x), keys[x]) }
+        if len(todo) < len(score_files):
+            print('{} .stat files are up to date (use --force to rebuild)'.format(len(score_files) - len(todo)))
+        if len(todo) == 0:
+            return
+
+        pheno = read_pheno(pheno, family)
+        scores = { x: read_scores(todo[x]) for x in todo }
+        results = evaluate(scores, pheno, family, float(pop_prev) if binary else None)
+        store = ResultStore(self.stat_dir)
+        for x, row in results.items():
+            output = "{}/{}/{}".format(self.stat_dir, data, x)
+            write_stat("{}.stat".format(output), row)
+            if binary and plotroc:
+                joined = scores[x].merge(pheno[['ID', 'PHENO']], on='ID')
+                plot_roc("{}.pdf".format(output), (joined['PHENO'] == joined['PHENO'].max()).to_numpy(np.float64),
+                         joined['SCORE_STD'].to_numpy(), row['AUC'])
+            manifest.record(output, keys[x], ["{}.stat".format(output)])
+            store.upsert(data, row, family, "{}.stat".format(output))
+        store.commit()
+        store.close()
+        manifest.save()
+        print(pd.DataFrame(list(results.values())).to_string(index=False))
+        print("\nStatistics calculation is done. {} results saved in {}/{}".format(len(results), self.stat_dir, data))
+
+    # Bootstrap confidence intervals of the prs-stat metrics, and each model compared with the best one on the same resamples
+    @traced('bootstrap-stat')
+    def bootstrap_stat(self, score, pheno, data, binary=False, pop_prev='NA', replicates=1000, seed=1, level=0.95, jobs=1, force=False):
+        score_files = find_score_files(score)
+        family = 'binary' if binary else 'quantitative'
+        if binary and pop_prev == 'NA':
+            sys.exit('ERROR: Population disease prevalence for calculating liability r2 is not specified\n')
+        os.makedirs("{}/{}".format(self.stat_dir, data), exist_ok=True)
+        output = "{}/{}/bootstrap".format(self.stat_dir, data)
+        outputs = ["{}.ci".format(output), "{}.paired".format(output), "{}.npz".format(output)]
+
+        # the replicates depend only on the seed, not on jobs
+        manifest = Manifest(self.result_dir, force)
+        key = manifest.key(list(score_files.values()) + [pheno], {'family': family, 'pop_prev': pop_prev, 'replicates': replicates,
+                                                                  'seed': seed, 'level': level})
+        if manifest.current(output, key):
+            print("{}.ci is up to date (use --force to rebuild)".format(output))
+            return
+
+        pheno = read_pheno(pheno, family)
+        scores = { x: read_scores(score_files[x]) for x in score_files }
+        models, estimates, samples = bootstrap(scores, pheno, family, float(pop_prev) if binary else None,
+                                               int(replicates), int(seed), int(jobs))
+        intervals = confidence_intervals(models, estimates, samples, float(level))
+        paired = paired_tests(models, estimates, samples, float(level))
+        intervals.to_csv(outputs[0], sep=' ', index=False, float_format='%.4g')
+        paired.to_csv(outputs[1], sep=' ', index=False, float_format='%.4g')
+        # replicate metrics (replicates x models) for further comparisons
+        np.savez(outputs[2], models=np.array(models), **samples)
+        manifest.record(output, key, outputs)
+        manifest.save()
+        print(paired.to_string(index=False))
+        print("\nBootstrap of {} replicates is done. Results saved as {}.ci and {}.paired".format(replicates, output, output))
+
     # In combine_prs_stat function is to combine PRS statistical results as one file
-    def combine_stat(self, data):
-        start=time()
-        atexit.register(exitlog, start)
-        log("Starting Analysis: combine-sumstat")
+    # Results are kept in result/stat/results.sqlite; only .stat files new or changed since the last run are read
+    @traced('combine-sumstat')
+    def combine_stat(self, data, metric=None, top=10):
 
         target_files = [i for i in glob.glob("{}/{}/*.stat".format(self.stat_dir, data))]
-        print("Combining : \n\t{}".format("\n\t".join(target_files)))
-        # Combine all the csv files
-        combined_csv = pd.concat([pd.read_csv(f) for f in target_files])
-        # Export to csv
-        combined_csv.to_csv("{}/{}_combined.stat".format(self.stat_dir, data), index=False, header=True, sep='\t', quoting=None)
-        print("Combining Done. Result saved in {}/{}_combined.stat.".format(self.stat_dir,data))
+        store = ResultStore(self.stat_dir)
+        print("{} of {} .stat files are new or changed".format(store.sync(data, target_files), len(target_files)))
+        # Export to the combined layout
+        n = store.export(data, "{}/{}_combined.stat".format(self.stat_dir, data))
+        print("Combining Done. {} models saved in {}/{}_combined.stat.".format(n, self.stat_dir,data))
+        if metric is not None:
+            try:
+                best = store.query(data, metric, top)
+            except ValueError as e:
+                sys.exit('ERROR: {}\n'.format(e))
+            print("\nTop {} models by {}:".format(top, metric))
+            print(best[['model', 'method'] + [x for x in PARAM_COLUMNS if x != 'method' and best[x].notna().any()] + [metric]].to_string(index=False))
+        store.close()
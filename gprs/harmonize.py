@@ -0,0 +1,117 @@
+# Allele harmonisation of unified sumstats against a reference .bim: hash join on (chromosome, position), then
+# allele swaps, strand flips and palindromic (A/T, C/G) SNPs resolved on whole chromosomes at once
+import os
+import json
+import numpy as np
+import pandas as pd
+from gprs.ldstore import content_hash
+from gprs.sumstat import SUMSTAT_COLUMNS, ParquetPartitions, normalize_chr, read_sumstat
+
+COMPLEMENT = str.maketrans('ACGT', 'TGCA')
+# categories in order of preference when several reference SNPs share a position (multi-allelic sites)
+CATEGORIES = ['match', 'swap', 'flip', 'flip_swap', 'palindromic', 'allele_mismatch', 'not_in_ref', 'duplicate']
+
+
+def complement(alleles):
+    return pd.Series(alleles, dtype=str).str.translate(COMPLEMENT).to_numpy()
+
+
+class PositionIndex(object):
+    """
+    Position index of a reference .bim, built once in [root]/[name]_[sha1 of the .bim]: chr[n].npz with
+    POS (sorted), ROW (.bim row), SNP, A1 and A2 (upper case) per chromosome, and index.json of SNP counts.
+    """
+    def __init__(self, root, prefix):
+        os.makedirs(root, exist_ok=True)
+        self.prefix = prefix
+        digest = content_hash(prefix, '{}/fingerprints.json'.format(root), ('bim',))
+        self.path = '{}/{}_{}'.format(root, os.path.basename(prefix), digest[:16])
+        self.meta_path = '{}/index.json'.format(self.path)
+        if not os.path.exists(self.meta_path):
+            self.build()
+        with open(self.meta_path) as f:
+            self.meta = json.load(f)
+
+    def build(self):
+        bim = pd.read_csv('{}.bim'.format(self.prefix), sep=r'\s+', header=None, usecols=[0, 1, 3, 4, 5],
+                          names=['CHR', 'SNP', 'POS', 'A1', 'A2'], dtype={'CHR': str, 'SNP': str, 'A1': str, 'A2': str})
+        bim['ROW'] = np.arange(len(bim))
+        bim['CHR'] = normalize_chr(bim['CHR'])
+        os.makedirs(self.path, exist_ok=True)
+        counts = {}
+        for chrnb, df in bim.dropna(subset=['CHR']).groupby('CHR'):
+            df = df.sort_values('POS', kind='stable')
+            chrnb = str(int(chrnb))
+            tmp = '{}/chr{}.{}.tmp.npz'.format(self.path, chrnb, os.getpid())
+            np.savez(tmp, POS=df['POS'].to_numpy(np.int64), ROW=df['ROW'].to_numpy(np.int64), SNP=df['SNP'].to_numpy(str),
+                     A1=df['A1'].str.upper().to_numpy(str), A2=df['A2'].str.upper().to_numpy(str))
+            os.replace(tmp, '{}/chr{}.npz'.format(self.path, chrnb))
+            counts[chrnb] = len(df)
+        with open(self.meta_path + '.tmp', 'w') as o:
+            json.dump({'ref': os.path.abspath(self.prefix), 'chromosomes': counts}, o, indent=1, sort_keys=True)
+        os.replace(self.meta_path + '.tmp', self.meta_path)
+        print('Position index of {} SNPs saved in {}'.format(len(bim), self.path))
+
+    def load(self, chrnb):
+        # reference SNPs of a chromosome as a frame, empty if the reference has none
+        path = '{}/chr{}.npz'.format(self.path, chrnb)
+        if not os.path.exists(path):
+            return pd.DataFrame(columns=['POS', 'ROW', 'SNP', 'A1', 'A2'])
+        with np.load(path) as data:
+            return pd.DataFrame({x: data[x] for x in ('POS', 'ROW', 'SNP', 'A1', 'A2')})
+
+
+def classify(ea, nea, a1, a2):
+    """
+    Category of each sumstat allele pair (effect, other) against a reference pair (A1, A2), and the sign that
+    turns Beta into the effect of A1. A/T and C/G SNPs cannot be told from a strand flip, so they are only
+    compared on the given strand and reported as palindromic.
+    """
+    ea, nea = pd.Series(ea, dtype=str).str.upper().to_numpy(), pd.Series(nea, dtype=str).str.upper().to_numpy()
+    cea, cnea = complement(ea), complement(nea)
+    match = (ea == a1) & (nea == a2)
+    swap = (ea == a2) & (nea == a1)
+    flip = (cea == a1) & (cnea == a2)
+    flip_swap = (cea == a2) & (cnea == a1)
+    palindromic = (pd.Series(ea).str.len().to_numpy() == 1) & (ea == cnea) & (match | swap)
+    category = np.select([palindromic, match, swap, flip, flip_swap],
+                         ['palindromic', 'match', 'swap', 'flip', 'flip_swap'], 'allele_mismatch')
+    sign = np.select([match | (flip & ~palindromic), swap | (flip_swap & ~palindromic)], [1, -1], 0)
+    return category, sign
+
+
+def harmonise_chromosome(index, chrnb, source, target, keep_palindromic=False):
+    """
+    Harmonised partition of one chromosome: SNPs found at the same position in the reference with matching
+    alleles, renamed to the reference SNP ID and turned to its A1 allele as Effect_Allele (Beta sign flipped
+    on swaps). Written as .parquet or .csv like the source. Returns {category: SNP count}.
+    """
+    stats = read_sumstat(source) if os.path.exists(source) else pd.DataFrame(columns=SUMSTAT_COLUMNS)
+    stats = stats.reset_index(drop=True)
+    ref = index.load(chrnb)
+    # hash join on position; several reference SNPs at a position give several candidate pairs
+    pairs = pd.DataFrame({'I': np.arange(len(stats)), 'POS': stats['POS'].to_numpy(np.int64)}).merge(ref, on='POS')
+    category, sign = classify(stats['Effect_Allele'].to_numpy()[pairs['I']], stats['NonEffect_Allele'].to_numpy()[pairs['I']],
+                              pairs['A1'].to_numpy(), pairs['A2'].to_numpy())
+    pairs = pairs.assign(CATEGORY=category, SIGN=sign, RANK=pd.Categorical(category, CATEGORIES).codes)
+    pairs = pairs.sort_values(['I', 'RANK'], kind='stable').drop_duplicates('I')
+    counts = pairs['CATEGORY'].value_counts().to_dict()
+    counts['not_in_ref'] = len(stats) - len(pairs)
+
+    kept = pairs[pairs['CATEGORY'].isin(['match', 'swap', 'flip', 'flip_swap'] + (['palindromic'] if keep_palindromic else []))]
+    # two sumstat rows on one reference SNP: the first one is kept
+    duplicated = kept['ROW'].duplicated()
+    counts['duplicate'] = int(duplicated.sum())
+    kept = kept[~duplicated.to_numpy()].sort_values('POS', kind='stable')
+    rows = stats.iloc[kept['I'].to_numpy()]
+    out = pd.DataFrame({'SNPID': kept['SNP'].to_numpy(), 'CHR': rows['CHR'].to_numpy(), 'POS': kept['POS'].to_numpy(),
+                        'Effect_Allele': kept['A1'].to_numpy(), 'NonEffect_Allele': kept['A2'].to_numpy(),
+                        'Beta': rows['Beta'].to_numpy() * kept['SIGN'].to_numpy(np.int8), 'SE': rows['SE'].to_numpy(),
+                        'Pvalue': rows['Pvalue'].to_numpy(), 'N_eff': rows['N_eff'].to_numpy()})
+    if target.endswith('.parquet'):
+        partitions = ParquetPartitions(target[:-len('_chr{}.parquet'.format(chrnb))])
+        partitions.write(chrnb, out)
+        partitions.close([chrnb])
+    else:
+        out.to_csv(target, index=False, sep='\t', header=True, na_rep='NA')
+    return {x: int(counts.get(x, 0)) for x in CATEGORIES}
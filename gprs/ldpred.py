@@ -0,0 +1,139 @@
+# Native LDpred2 (Prive et al. 2020, Bioinformatics 36:5424-31): infinitesimal model and grid of Gibbs samplers
+# on the LD store; each worker memory-maps the chromosome matrix, so grid points share one copy in the page cache
+import os
+import numpy as np
+import pandas as pd
+from scipy.sparse.linalg import LinearOperator, cg
+from gprs.ldstore import load_csr
+from gprs.stats import r_format
+
+BURN_IN = 50
+NUM_ITER = 100
+# grid points sampled together in one worker task: the whole default grid (17 p x 3 h2 x 2), as each SNP
+# update costs about the same for 6 or 102 grid points
+GRID_CHUNK = 102
+# random draws generated at a time by the sampler (SNPs x grid points)
+DRAW_BLOCK = 4096
+# a standardized effect beyond this means the chain diverged (it would explain all the variance)
+MAX_BETA = 1.0
+
+
+def p_grid():
+    # signif(seq_log(1e-4, 1, length.out = 17), 2) of ldpred2.R
+    return [float('{:.2g}'.format(x)) for x in np.exp(np.linspace(np.log(1e-4), 0, 17))]
+
+
+def h2_grid(h2):
+    # round(h2_est * c(0.7, 1, 1.4), 4) of ldpred2.R
+    return [round(h2 * x, 4) for x in (0.7, 1, 1.4)]
+
+
+def grid_name(p, h2, sparse):
+    # paste0(p, '_', h2, '_nosparse') with '-' replaced by '.', as ldpred2.R names its models
+    return '{}_{}_{}'.format(r_format(p, 15), r_format(h2, 15), 'sparse' if sparse else 'nosparse').replace('-', '.')
+
+
+def match_ref(stats, bim):
+    """
+    Sumstat SNPs (SNPID, Effect_Allele, NonEffect_Allele, Beta, SE, N_eff) found in the reference .bim, with the
+    effect turned to the .bim A1 allele that the LD was computed on; SNPs with other alleles are dropped.
+    Returns a frame with ROW (.bim row), CHR, SNPID, POS, A1, A2, BETA, SE, N.
+    """
+    rows = pd.Index(bim['SNP']).get_indexer(stats['SNPID'])
+    stats = stats[rows >= 0].assign(ROW=rows[rows >= 0])
+    ref = bim.iloc[stats['ROW'].to_numpy()]
+    a1, a2 = ref['A1'].str.upper().to_numpy(), ref['A2'].str.upper().to_numpy()
+    ea, nea = stats['Effect_Allele'].astype(str).str.upper().to_numpy(), stats['NonEffect_Allele'].astype(str).str.upper().to_numpy()
+    sign = np.where((ea == a1) & (nea == a2), 1, np.where((ea == a2) & (nea == a1), -1, 0))
+    matched = pd.DataFrame({'ROW': stats['ROW'].to_numpy(), 'CHR': ref['CHR'].to_numpy(), 'SNPID': ref['SNP'].to_numpy(),
+                            'POS': ref['POS'].to_numpy(), 'A1': ref['A1'].to_numpy(), 'A2': ref['A2'].to_numpy(),
+                            'BETA': sign * stats['Beta'].to_numpy(np.float64), 'SE': stats['SE'].to_numpy(np.float64),
+                            'N': stats['N_eff'].astype(np.float64).to_numpy()})
+    return matched[sign != 0].dropna().drop_duplicates('ROW').reset_index(drop=True)
+
+
+def standardized(beta, se, n):
+    # effects on standardized genotypes, beta / sqrt(n se^2 + beta^2); the scale converts them back
+    scale = np.sqrt(n * se ** 2 + beta ** 2)
+    return beta / scale, scale
+
+
+def chromosome_set(path, chrnb, rows):
+    # positions of the SNP set (.bim rows) in the stored matrix, and the matrix itself (memory-mapped)
+    stored, corr = load_csr(path, chrnb)
+    where = pd.Index(stored).get_indexer(rows)
+    if (where < 0).any():
+        raise Exception('{} SNPs of chr{} are not in the LD store'.format((where < 0).sum(), chrnb))
+    return where, corr
+
+
+def ldpred_inf(path, chrnb, rows, beta_hat, n, h2, m):
+    """
+    LDpred-inf: solves (R + m / (h2 n) I) beta = beta_hat (standardized) with conjugate gradients.
+    The stored matrix may hold more SNPs than the set; those are kept at zero, so no submatrix is copied.
+    """
+    where, corr = chromosome_set(path, chrnb, rows)
+    diagonal = m / (h2 * n)
+
+    def matvec(x):
+        full = np.zeros(corr.shape[0])
+        full[where] = np.ravel(x)
+        return (corr @ full)[where] + diagonal * np.ravel(x)
+    operator = LinearOperator((len(where), len(where)), matvec=matvec, dtype=np.float64)
+    beta, info = cg(operator, beta_hat, maxiter=10 * len(where))
+    if info != 0:
+        print('Warning: LDpred-inf did not converge on chr{}'.format(chrnb))
+    return beta
+
+
+def ldpred_gibbs(path, chrnb, rows, beta_hat, n, grid, m, burn_in=BURN_IN, num_iter=NUM_ITER, seed=None):
+    """
+    LDpred2-grid Gibbs sampler (ldpred2_gibbs_one of bigsnpr) for several (p, h2, sparse) grid points at once:
+    SNPs are visited in turn and each update is vectorized over the grid points. The SNP loop runs in Python,
+    measured at 45 us (200 LD neighbours) to 240 us (2000) per SNP update for 102 grid points.
+    Returns the posterior mean effects (SNPs x grid points, standardized); NaN columns for diverged chains.
+    """
+    where, corr = chromosome_set(path, chrnb, rows)
+    indptr, indices, data = corr.indptr, corr.indices, corr.data
+    rng = np.random.default_rng(seed)
+    p = np.array([x[0] for x in grid])
+    h2 = np.array([x[1] for x in grid])
+    sparse = np.array([x[2] for x in grid], dtype=bool)
+    # per SNP and grid point constants of the conditional posterior
+    c1 = h2[None, :] / (m * p[None, :]) * n[:, None]
+    c2 = 1 / (1 + 1 / c1)
+    c4 = np.sqrt(c2 / n[:, None])
+    odds = (1 - p) / p * np.sqrt(1 + c1)
+    half_c2n = c2 * n[:, None] / 2
+    # sparse grid points set posterior probabilities below p to 0
+    threshold = np.where(sparse, p, -1)
+    curr = np.zeros((corr.shape[0], len(grid)))
+    avg = np.zeros((len(where), len(grid)))
+    for k in range(-burn_in, num_iter):
+        for i, j in enumerate(where):
+            if i % DRAW_BLOCK == 0:
+                uniform = rng.random((DRAW_BLOCK, len(grid)))
+                normal = rng.standard_normal((DRAW_BLOCK, len(grid)))
+            lo, hi = indptr[j], indptr[j + 1]
+            # R[j] . curr, gathered when SNP j is visited instead of scattering every update to its neighbours
+            resid = beta_hat[i] - data[lo:hi] @ curr[indices[lo:hi]] + curr[j]
+            c3 = c2[i] * resid
+            postp = 1 / (1 + odds[i] * np.exp(-half_c2n[i] * resid * resid))
+            postp[postp < threshold] = 0
+            if k >= 0:
+                avg[i] += c3 * postp
+            sample = np.where(postp > uniform[i % DRAW_BLOCK], c3 + c4[i] * normal[i % DRAW_BLOCK], 0)
+            curr[j] = sample
+    avg /= num_iter
+    diverged = ~np.isfinite(avg).all(axis=0) | (np.abs(avg).max(axis=0) > MAX_BETA)
+    avg[:, diverged] = np.nan
+    return avg
+
+
+def write_weights(out_dir, name, snps, beta):
+    # [out_dir]/LDPred2_[name]/chr[n]_[name].weight like ldpred2.R: SNPID CHR POS A1 A2 beta, tab-separated, no header
+    model_dir = '{}/LDPred2_{}'.format(out_dir, name)
+    os.makedirs(model_dir, exist_ok=True)
+    table = snps[['SNPID', 'CHR', 'POS', 'A1', 'A2']].assign(BETA=beta)
+    for chrnb, df in table.groupby('CHR', sort=False):
+        df.to_csv('{}/chr{}_{}.weight'.format(model_dir, chrnb, name), sep='\t', header=False, index=False, na_rep='NA')
@@ -0,0 +1,68 @@
+# LD score regression (Bulik-Sullivan et al. 2015, Nat Genet 47:291-5) for SNP heritability
+import numpy as np
+
+JACKKNIFE_BLOCKS = 200
+# step 1 estimates the intercept from SNPs with chi2 below this, as snp_ldsc's chi2_thr1
+CHI2_MAX = 30
+REWEIGHT = 2
+
+
+def regression_weights(ld, n, m, h2, intercept):
+    # inverse of the chi2 variance 2 (intercept + n h2 l / m)^2, times 1/l for the overcounting of SNPs in LD
+    ld = np.maximum(ld, 1)
+    h2 = min(max(h2, 0), 1)
+    return 1 / (ld * 2 * (intercept + n * h2 * ld / m) ** 2)
+
+
+def jackknife(design, y, w, blocks):
+    """
+    Weighted least squares with delete-one-block jackknife over contiguous blocks of SNPs (in genome order).
+    Returns estimates and standard errors.
+    """
+    edges = np.linspace(0, len(y), min(blocks, len(y)) + 1).astype(int)
+    wx = design * w[:, None]
+    xtwx = np.add.reduceat(wx[:, :, None] * design[:, None, :], edges[:-1], axis=0)
+    xtwy = np.add.reduceat(wx * y[:, None], edges[:-1], axis=0)
+    estimate = np.linalg.solve(xtwx.sum(axis=0), xtwy.sum(axis=0))
+    deleted = np.linalg.solve(xtwx.sum(axis=0) - xtwx, (xtwy.sum(axis=0) - xtwy)[:, :, None])[:, :, 0]
+    b = len(deleted)
+    pseudo = b * estimate - (b - 1) * deleted
+    return estimate, np.sqrt(pseudo.var(axis=0, ddof=1) / b)
+
+
+def irwls(ld, chi2, n, m, intercept=None, blocks=JACKKNIFE_BLOCKS):
+    """
+    chi2 = intercept + n h2 l / m, reweighted with the fitted h2 and intercept, then jackknifed.
+    With intercept given it is fixed. Returns (h2, h2 se, intercept, intercept se).
+    """
+    x = n * ld / m
+    design = np.column_stack([x, np.ones(len(x))]) if intercept is None else x[:, None]
+    y = chi2 if intercept is None else chi2 - intercept
+    h2 = m * (chi2.mean() - 1) / (n * ld).mean()
+    fitted_intercept = 1.0 if intercept is None else intercept
+    for _ in range(REWEIGHT):
+        w = regression_weights(ld, n, m, h2, fitted_intercept)
+        estimate, se = jackknife(design, y, w, blocks)
+        h2 = estimate[0]
+        if intercept is None:
+            fitted_intercept = estimate[1]
+    w = regression_weights(ld, n, m, h2, fitted_intercept)
+    estimate, se = jackknife(design, y, w, blocks)
+    if intercept is None:
+        return estimate[0], se[0], estimate[1], se[1]
+    return estimate[0], se[0], intercept, 0.0
+
+
+def ldsc(ld, chi2, n, m=None, blocks=JACKKNIFE_BLOCKS, chi2_max=CHI2_MAX):
+    """
+    Two-step LDSC like bigsnpr::snp_ldsc: the intercept from SNPs with chi2 < chi2_max,
+    then h2 from all SNPs with the intercept fixed.
+    ld, chi2, n: per SNP in genome order; m: number of SNPs the LD scores were computed over (default len(ld)).
+    Returns {'int', 'int_se', 'h2', 'h2_se'}.
+    """
+    ld, chi2, n = np.asarray(ld, np.float64), np.asarray(chi2, np.float64), np.asarray(n, np.float64)
+    m = len(ld) if m is None else m
+    step1 = chi2 < chi2_max
+    h2, h2_se, intercept, intercept_se = irwls(ld[step1], chi2[step1], n[step1], m, None, blocks)
+    h2, h2_se, _, _ = irwls(ld, chi2, n, m, intercept, blocks)
+    return {'int': intercept, 'int_se': intercept_se, 'h2': h2, 'h2_se': h2_se}
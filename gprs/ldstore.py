@@ -0,0 +1,277 @@
+# Persistent per-chromosome sparse LD (SNP correlation) matrices computed from a reference bfile
+import os
+import sys
+import json
+import fcntl
+import hashlib
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from gprs.bed import BedReader, standardize
+from gprs.parallel import check_status, run_functions
+
+BUFFER_SIZE = 16 * 1024 * 1024
+# SNPs decoded and correlated at a time
+BLOCK_SIZE = 1024
+
+
+def content_hash(prefix, memo_path=None, extensions=('bed', 'bim', 'fam')):
+    """
+    sha1 of the .bed, .bim and .fam (or the given extensions) of a bfile. Hashing a large reference takes a while,
+    so the digest is memoised in memo_path (json) by path, size and mtime of the files.
+    """
+    files = [os.path.abspath('{}.{}'.format(prefix, x)) for x in extensions]
+    stamp = [[os.stat(x).st_size, os.stat(x).st_mtime_ns] for x in files]
+    memo = {}
+    if memo_path is not None and os.path.exists(memo_path):
+        with open(memo_path) as f:
+            memo = json.load(f)
+    entry = memo.get(files[0])
+    if entry is not None and entry['stamp'] == stamp:
+        return entry['sha1']
+    sha1 = hashlib.sha1()
+    for path in files:
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(BUFFER_SIZE), b''):
+                sha1.update(block)
+    digest = sha1.hexdigest()
+    if memo_path is not None:
+        memo[files[0]] = {'stamp': stamp, 'sha1': digest}
+        with open(memo_path, 'w') as o:
+            json.dump(memo, o, indent=1)
+    return digest
+
+
+def snp_positions(bim, rows, unit):
+    # positions used for the LD window: bp for unit kb, the genetic position (cM) column for unit cm
+    if unit == 'cm':
+        return bim['CM'].to_numpy(np.float64)[rows]
+    return bim['POS'].to_numpy(np.float64)[rows] / 1000
+
+
+def window_pairs(reader, rows, pos, window, targets, block_size=BLOCK_SIZE):
+    """
+    Correlations r between the target SNPs and every SNP of rows within the window (rows sorted by pos).
+    Pairs (i, j) are kept when j is not a target or j >= i, so each pair is computed once; with all SNPs
+    as targets this is the upper triangle. Returns COO arrays (i, j, r) as positions in rows.
+    """
+    all_targets = len(targets) == len(rows)
+    is_target = np.zeros(len(rows), dtype=bool)
+    is_target[targets] = True
+    cache = {}
+
+    def z(lo, hi):
+        # standardized genotypes of rows[lo:hi], decoded in blocks that stay cached while in reach
+        blocks = range(lo // block_size, (hi - 1) // block_size + 1)
+        for b in [x for x in cache if x < blocks[0]]:
+            del cache[b]
+        for b in blocks:
+            if b not in cache:
+                cache[b] = standardize(reader.read(rows[b * block_size:(b + 1) * block_size], dtype='float32'))
+        return np.concatenate([cache[b] for b in blocks])[lo - blocks[0] * block_size:hi - blocks[0] * block_size]
+
+    ii, jj, rr = [], [], []
+    for start in range(0, len(targets), block_size):
+        block = targets[start:start + block_size]
+        lo = block[0] if all_targets else np.searchsorted(pos, pos[block[0]] - window, side='left')
+        hi = np.searchsorted(pos, pos[block[-1]] + window, side='right')
+        zw = z(lo, hi)
+        r = zw[block - lo] @ zw.T / reader.n_samples
+        j = np.arange(lo, hi)
+        keep = (np.abs(pos[j][None, :] - pos[block][:, None]) <= window) & (~is_target[j][None, :] | (j[None, :] >= block[:, None]))
+        bi, bj = np.nonzero(keep)
+        ii.append(block[bi])
+        jj.append(j[bj])
+        rr.append(r[bi, bj])
+    if len(ii) == 0:
+        return np.zeros(0, np.int64), np.zeros(0, np.int64), np.zeros(0, np.float32)
+    return np.concatenate(ii), np.concatenate(jj), np.concatenate(rr).astype(np.float32)
+
+
+def chromosome_files(path, chrnb):
+    return {x: '{}/chr{}.{}.npy'.format(path, chrnb, x) for x in ('rows', 'indptr', 'indices', 'data')}
+
+
+def save_csr(path, chrnb, rows, matrix):
+    # each array to a temporary file first, so readers never see a half-written matrix
+    files = chromosome_files(path, chrnb)
+    arrays = {'rows': rows.astype(np.int64), 'indptr': matrix.indptr.astype(np.int64),
+              'indices': matrix.indices.astype(np.int32), 'data': matrix.data.astype(np.float32)}
+    for x in ('indptr', 'indices', 'data', 'rows'):
+        np.save(files[x] + '.tmp.npy', arrays[x])
+        os.replace(files[x] + '.tmp.npy', files[x])
+
+
+def load_csr(path, chrnb, mmap=True):
+    # (ref .bim rows, symmetric csr matrix) with the arrays memory-mapped from the store
+    files = chromosome_files(path, chrnb)
+    mode = 'r' if mmap else None
+    rows = np.load(files['rows'])
+    arrays = [np.load(files[x], mmap_mode=mode) for x in ('data', 'indices', 'indptr')]
+    return rows, sparse.csr_matrix(tuple(arrays), shape=(len(rows), len(rows)), copy=False)
+
+
+def update_chromosome(prefix, path, chrnb, rows, window, unit, block_size=BLOCK_SIZE):
+    """
+    Extend the stored matrix of one chromosome with the SNPs (ref .bim rows) it does not hold yet:
+    only pairs involving a new SNP are computed, stored pairs are kept.
+    Returns (number of SNPs, number of non-zero entries).
+    """
+    reader = BedReader(prefix)
+    old_rows = np.zeros(0, np.int64)
+    if os.path.exists(chromosome_files(path, chrnb)['rows']):
+        old_rows, old = load_csr(path, chrnb, mmap=False)
+    union = np.union1d(old_rows, rows)
+    pos = snp_positions(reader.bim, union, unit)
+    order = np.argsort(pos, kind='stable')
+    union, pos = union[order], pos[order]
+    targets = np.flatnonzero(~np.isin(union, old_rows))
+    i, j, r = window_pairs(reader, union, pos, float(window), targets, block_size)
+    # symmetric: mirror the off-diagonal pairs
+    off = i != j
+    i, j, r = np.concatenate([i, j[off]]), np.concatenate([j, i[off]]), np.concatenate([r, r[off]])
+    if len(old_rows) > 0:
+        where = pd.Index(union).get_indexer(old_rows)
+        old = old.tocoo()
+        i, j, r = np.concatenate([i, where[old.row]]), np.concatenate([j, where[old.col]]), np.concatenate([r, old.data])
+    matrix = sparse.csr_matrix((r, (i, j)), shape=(len(union), len(union)))
+    matrix.sort_indices()
+    save_csr(path, chrnb, union, matrix)
+    # cached LD scores were summed over the previous matrix
+    for x in os.listdir(path):
+        if x.startswith('chr{}.ldscore.'.format(chrnb)):
+            os.remove('{}/{}'.format(path, x))
+    return len(union), matrix.nnz
+
+
+def ld_scores_file(path, chrnb, rows):
+    # LD scores depend on the SNP set they are summed over, so the cache is named by its hash
+    return '{}/chr{}.ldscore.{}.npy'.format(path, chrnb, hashlib.sha1(np.sort(rows).astype(np.int64).tobytes()).hexdigest()[:16])
+
+
+def ld_scores_chromosome(path, chrnb, rows=None, block_rows=65536):
+    """
+    LD scores (sum of r2 with the SNPs of the set, itself included) of one chromosome, as colSums(corr^2)
+    in ldpred2.R. rows: .bim rows of the SNP set, all stored SNPs when None. The memory-mapped matrix is
+    read in blocks of rows, and the result is cached in the store. Returns (rows in store order, scores).
+    """
+    stored, matrix = load_csr(path, chrnb)
+    in_set = np.ones(len(stored), dtype=bool) if rows is None else np.isin(stored, rows)
+    cache = ld_scores_file(path, chrnb, stored[in_set])
+    if os.path.exists(cache):
+        return stored[in_set], np.load(cache)
+    scores = np.empty(len(stored))
+    for start in range(0, len(stored), block_rows):
+        stop = min(start + block_rows, len(stored))
+        lo, hi = matrix.indptr[start], matrix.indptr[stop]
+        data = np.asarray(matrix.data[lo:hi], dtype=np.float64) ** 2 * in_set[matrix.indices[lo:hi]]
+        scores[start:stop] = np.bincount(np.repeat(np.arange(stop - start), np.diff(matrix.indptr[start:stop + 1])),
+                                         weights=data, minlength=stop - start)
+    np.save(cache + '.tmp.npy', scores[in_set])
+    os.replace(cache + '.tmp.npy', cache)
+    return stored[in_set], scores[in_set]
+
+
+class LdStore(object):
+    """
+    [root]/[ref sha1]_[window][unit]: LD matrices of one reference bfile and window, one per chromosome,
+    saved as CSR arrays (.npy) that are memory-mapped on load. A chromosome holds the union of the SNP
+    sets it was asked for; further runs compute only the SNPs that are missing.
+    store.json records the reference, its hash and window, and the SNP count and a hash of the SNP set per chromosome.
+    """
+    def __init__(self, root, prefix, window=3000, unit='kb'):
+        if unit not in ('kb', 'cm'):
+            sys.exit('ERROR: LD window unit must be kb or cm\n')
+        os.makedirs(root, exist_ok=True)
+        self.prefix = prefix
+        self.window = float(window)
+        self.unit = unit
+        self.ref_hash = content_hash(prefix, '{}/fingerprints.json'.format(root))
+        self.path = '{}/{}_{:g}{}'.format(root, self.ref_hash[:16], self.window, unit)
+        os.makedirs(self.path, exist_ok=True)
+        self.meta_path = '{}/store.json'.format(self.path)
+        self.meta = self.load_meta()
+        self.reader = None
+
+    def load_meta(self):
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path) as f:
+                return json.load(f)
+        return {'ref': os.path.abspath(self.prefix), 'ref_sha1': self.ref_hash, 'window': self.window, 'unit': self.unit,
+                'chromosomes': {}}
+
+    def save_meta(self):
+        # merged under a lock with what other runs recorded meanwhile
+        with open(self.meta_path + '.lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            chromosomes = self.meta['chromosomes']
+            self.meta = self.load_meta()
+            self.meta['chromosomes'].update(chromosomes)
+            with open(self.meta_path + '.tmp', 'w') as o:
+                json.dump(self.meta, o, indent=1, sort_keys=True)
+            os.replace(self.meta_path + '.tmp', self.meta_path)
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def bim(self):
+        if self.reader is None:
+            self.reader = BedReader(self.prefix)
+        return self.reader.bim
+
+    def snp_rows(self, snps=None):
+        # {chromosome: .bim rows} of the SNP IDs found in the reference (all SNPs when snps is None)
+        bim = self.bim()
+        if snps is None:
+            rows = np.arange(len(bim))
+        else:
+            rows = pd.Index(bim['SNP']).get_indexer(pd.unique(pd.Series(snps)))
+            rows = np.sort(rows[rows >= 0])
+        chrs = bim['CHR'].to_numpy()[rows]
+        return {str(x): rows[chrs == x] for x in pd.unique(chrs)}
+
+    def stored_rows(self, chrnb):
+        path = chromosome_files(self.path, chrnb)['rows']
+        return np.load(path) if os.path.exists(path) else np.zeros(0, np.int64)
+
+    def update(self, snps=None, jobs=1, block_size=BLOCK_SIZE):
+        """
+        Make sure every SNP (IDs; all reference SNPs when None) is in the store, computing only missing ones,
+        chromosomes in parallel. Returns {chromosome: .bim rows} of the requested SNPs.
+        """
+        wanted = self.snp_rows(snps)
+        calls = []
+        for chrnb, rows in wanted.items():
+            missing = np.setdiff1d(rows, self.stored_rows(chrnb))
+            if len(missing) > 0:
+                print('chr{}: {} of {} SNPs to add'.format(chrnb, len(missing), len(rows)))
+                calls.append((chrnb, update_chromosome, (self.prefix, self.path, chrnb, rows, self.window, self.unit, block_size), len(missing)))
+        print('LD store {}: {} of {} chromosomes up to date'.format(self.path, len(wanted) - len(calls), len(wanted)))
+        if len(calls) > 0:
+            status, results = run_functions(calls, jobs)
+            for chrnb, (n, nnz) in results.items():
+                self.meta['chromosomes'][chrnb] = {'snps': n, 'nnz': nnz,
+                                                   'snps_sha1': hashlib.sha1(self.stored_rows(chrnb).tobytes()).hexdigest()}
+            self.save_meta()
+            check_status(status, 'LD store')
+        return wanted
+
+    def ld_scores(self, wanted, jobs=1):
+        """
+        {chromosome: (.bim rows, LD scores)} over the SNP sets of wanted ({chromosome: .bim rows}, from update),
+        chromosomes in parallel, cached in the store.
+        """
+        calls = [(chrnb, ld_scores_chromosome, (self.path, chrnb, rows), len(rows)) for (chrnb, rows) in wanted.items()]
+        status, results = run_functions(calls, jobs)
+        check_status(status, 'LD scores')
+        return results
+
+    def load(self, chrnb, rows=None):
+        """
+        (ref .bim rows, csr matrix) of a chromosome, memory-mapped; with rows, the submatrix of those SNPs in that order.
+        """
+        stored, matrix = load_csr(self.path, chrnb)
+        if rows is None:
+            return stored, matrix
+        where = pd.Index(stored).get_indexer(rows)
+        if (where < 0).any():
+            sys.exit('ERROR: {} SNPs of chr{} are not in the LD store; update it first\n'.format((where < 0).sum(), chrnb))
+        return np.asarray(rows), matrix[where][:, where]
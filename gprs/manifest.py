@@ -0,0 +1,109 @@
+# Manifest of stage outputs with the inputs, parameters and tool versions they were built from
+import os
+import json
+import fcntl
+import hashlib
+import subprocess
+
+# files up to this size are fingerprinted by content, larger ones (reference VCFs, .bed) by size and mtime
+HASH_LIMIT = 256 * 1024 * 1024
+BUFFER_SIZE = 16 * 1024 * 1024
+
+_tool_versions = {}
+
+
+def tool_version(tool):
+    # first line of `tool --version`, or NA when the tool is not installed
+    if tool not in _tool_versions:
+        if tool == 'gprs':
+            try:
+                import pkg_resources
+                _tool_versions[tool] = pkg_resources.get_distribution('gprs').version
+            except Exception:
+                _tool_versions[tool] = 'NA'
+        else:
+            try:
+                proc = subprocess.run([tool, '--version'], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+                _tool_versions[tool] = proc.stdout.decode(errors='replace').strip().split('\n')[0]
+            except OSError:
+                _tool_versions[tool] = 'NA'
+    return _tool_versions[tool]
+
+
+class Manifest(object):
+    """
+    [result_dir]/manifest.json: for every step (usually named by its output prefix), the key of its inputs,
+    parameters and tool versions, and the fingerprints of the outputs it wrote.
+    A step is up to date while its key is unchanged and its outputs are untouched; force=True rebuilds everything.
+    Content fingerprints are memoised by size and mtime, so an upstream file rebuilt with the same content
+    does not invalidate the steps below it.
+    """
+    def __init__(self, result_dir, force=False):
+        self.path = '{}/manifest.json'.format(result_dir)
+        self.force = force
+        self.steps, self.files = self.load()
+        self.updated_steps = {}
+        self.updated_files = {}
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return {}, {}
+        with open(self.path) as f:
+            manifest = json.load(f)
+        return manifest.get('steps', {}), manifest.get('files', {})
+
+    def fingerprint(self, path):
+        path = os.path.abspath(path)
+        if not os.path.exists(path):
+            return None
+        stat = os.stat(path)
+        memo = self.updated_files.get(path, self.files.get(path))
+        if memo is not None and memo[0] == stat.st_size and memo[1] == stat.st_mtime_ns:
+            return memo[2]
+        if stat.st_size > HASH_LIMIT:
+            digest = 'stat:{}:{}'.format(stat.st_size, stat.st_mtime_ns)
+        else:
+            sha1 = hashlib.sha1()
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(BUFFER_SIZE), b''):
+                    sha1.update(block)
+            digest = 'sha1:{}'.format(sha1.hexdigest())
+        self.updated_files[path] = [stat.st_size, stat.st_mtime_ns, digest]
+        return digest
+
+    def key(self, inputs, params, tools=()):
+        # hash of input fingerprints, parameters and tool versions
+        key = {'inputs': {os.path.abspath(x): self.fingerprint(x) for x in inputs},
+               'params': {k: str(v) for (k, v) in params.items()},
+               'tools': {x: tool_version(x) for x in ('gprs',) + tuple(tools)}}
+        return hashlib.sha1(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+    def current(self, step, key):
+        # True when the step was built with this key and its outputs are unchanged
+        if self.force:
+            return False
+        entry = self.updated_steps.get(step, self.steps.get(step))
+        if entry is None or entry['key'] != key:
+            return False
+        return all(self.fingerprint(x) == digest for (x, digest) in entry['outputs'].items())
+
+    def record(self, step, key, outputs):
+        # outputs that do not exist (e.g. no .clumped without significant SNPs) are not recorded
+        self.updated_steps[step] = {'key': key,
+                                    'outputs': {os.path.abspath(x): self.fingerprint(x) for x in outputs if os.path.exists(x)}}
+
+    def save(self):
+        # merge into the file on disk under a lock, as stages of one result dir may run concurrently
+        if len(self.updated_steps) == 0 and len(self.updated_files) == 0:
+            return
+        with open(self.path + '.lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            steps, files = self.load()
+            steps.update(self.updated_steps)
+            files.update(self.updated_files)
+            with open(self.path + '.tmp', 'w') as o:
+                json.dump({'steps': steps, 'files': files}, o, indent=1, sort_keys=True)
+            os.replace(self.path + '.tmp', self.path)
+            fcntl.flock(lock, fcntl.LOCK_UN)
+        self.steps, self.files = steps, files
+        self.updated_steps, self.updated_files = {}, {}
@@ -0,0 +1,92 @@
+# Run per-chromosome commands (plink, plink2, Rscript) or Python functions concurrently
+import os
+import sys
+import traceback
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from gprs import timer
+
+
+def resource_flags(jobs, threads=None, memory=None):
+    """
+    Split a global thread/memory(MB) budget across concurrent jobs, as plink --threads/--memory flags.
+    Returns '' when no budget is given, so plink keeps its own defaults.
+    """
+    flags = ''
+    jobs = max(1, int(jobs))
+    if threads:
+        flags += ' --threads {}'.format(max(1, int(threads) // jobs))
+    if memory:
+        flags += ' --memory {}'.format(max(1, int(memory) // jobs))
+    return flags
+
+
+def run_command(name, command, parent=None):
+    # run one shell command as a span, keeping its output together so concurrent jobs do not interleave
+    returncode, output = timer.run(command, name, capture=True, parent=parent)
+    return name, returncode, output
+
+
+def run_commands(commands, jobs=1):
+    """
+    Run (name, command, size) jobs with up to `jobs` at a time, largest size first so the
+    biggest chromosomes do not end up running alone at the end.
+    Returns {name: exit status}.
+    """
+    commands = sorted(commands, key=lambda x: x[2], reverse=True)
+    status = {}
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        futures = [pool.submit(run_command, name, command, timer.TRACER.current()) for (name, command, size) in commands]
+        for future in as_completed(futures):
+            name, returncode, output = future.result()
+            print(output)
+            print('{} finished with exit status {}'.format(name, returncode))
+            status[name] = returncode
+    return status
+
+
+def run_function(name, function, args, parent=None):
+    """
+    Call function(*args) in a worker process as a 'task' span; errors are returned as text so one failure
+    does not stop the others. Returns name, exit status, return value or error, and the spans of the worker.
+    """
+    tracer = timer.start_worker()
+    try:
+        with timer.span(name, kind='task', parent=parent):
+            result = function(*args)
+        return name, 0, result, tracer.spans
+    except Exception:
+        return name, 1, traceback.format_exc(), tracer.spans
+
+
+def run_functions(calls, jobs=1):
+    """
+    Run (name, function, args, size) calls in up to `jobs` worker processes, largest size first.
+    function must be importable (module level). Returns {name: exit status}, {name: return value}.
+    """
+    calls = sorted(calls, key=lambda x: x[3], reverse=True)
+    status = {}
+    results = {}
+    with ProcessPoolExecutor(max_workers=max(1, jobs)) as pool:
+        futures = [pool.submit(run_function, name, function, args, timer.TRACER.current()) for (name, function, args, size) in calls]
+        for future in as_completed(futures):
+            name, returncode, result, spans = future.result()
+            timer.TRACER.extend(spans)
+            if returncode != 0:
+                print(result)
+            else:
+                results[name] = result
+            print('{} finished with exit status {}'.format(name, returncode))
+            status[name] = returncode
+    return status, results
+
+
+def check_status(status, stage):
+    # report every failed job, and stop with an error instead of moving on silently
+    failed = sorted(name for (name, returncode) in status.items() if returncode != 0)
+    print('{}: {} of {} jobs succeeded'.format(stage, len(status) - len(failed), len(status)))
+    if len(failed) > 0:
+        sys.exit('ERROR: {} failed for {}. Check the plink .log files.\n'.format(stage, ', '.join(failed)))
+
+
+def file_size(path):
+    return os.path.getsize(path) if os.path.exists(path) else 0
@@ -0,0 +1,55 @@
+# One-time conversion cache of reference panel VCFs to plink binary files
+import os
+import json
+import hashlib
+
+
+class RefCache(object):
+    """
+    Keeps plink bfiles converted from reference VCFs in cache_dir.
+    An entry is valid while the VCF path, size, mtime and conversion options are unchanged.
+    """
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.manifest = '{}/cache.json'.format(cache_dir)
+        os.makedirs(cache_dir, exist_ok=True)
+        if os.path.exists(self.manifest):
+            with open(self.manifest) as f:
+                self.entries = json.load(f)
+        else:
+            self.entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, vcf, options):
+        vcf = os.path.abspath(vcf)
+        stat = os.stat(vcf)
+        return {'vcf': vcf, 'size': stat.st_size, 'mtime': stat.st_mtime, 'options': options.strip()}
+
+    def prefix(self, vcf, options):
+        # bfile prefix in the cache for this VCF and conversion options
+        key = self.key(vcf, options)
+        digest = hashlib.sha1(json.dumps(key, sort_keys=True).encode()).hexdigest()[:12]
+        name = os.path.basename(vcf)
+        for ext in ('.gz', '.bgz', '.vcf'):
+            if name.endswith(ext):
+                name = name[:-len(ext)]
+        return '{}/{}_{}'.format(self.cache_dir, name, digest)
+
+    def lookup(self, vcf, options):
+        # cached bfile prefix, or None on a miss
+        prefix = self.prefix(vcf, options)
+        entry = self.entries.get(os.path.abspath(vcf))
+        if entry is not None and entry == self.key(vcf, options) and os.path.exists('{}.bed'.format(prefix)):
+            self.hits += 1
+            return prefix
+        self.misses += 1
+        return None
+
+    def add(self, vcf, options):
+        self.entries[os.path.abspath(vcf)] = self.key(vcf, options)
+        with open(self.manifest, 'w') as o:
+            json.dump(self.entries, o, indent=1)
+
+    def report(self):
+        print('Reference panel cache: {} hits, {} misses ({})'.format(self.hits, self.misses, self.cache_dir))
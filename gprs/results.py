@@ -0,0 +1,148 @@
+# SQLite store of prs-stat results (result/stat/results.sqlite), one row per dataset and model
+import os
+import re
+import sqlite3
+from datetime import datetime
+import pandas as pd
+from gprs.stats import BINARY_COLUMNS, QUANTITATIVE_COLUMNS
+
+# model parameters parsed from the model name; the clumping r2 and LDpred2 p are renamed to stay
+# distinct from the R2 and P metric columns (SQLite column names are case-insensitive)
+PARAM_COLUMNS = ['method', 'kb', 'p1', 'clump_r2', 'h2', 'p_causal']
+METRIC_COLUMNS = [x for x in BINARY_COLUMNS if x != 'Model'] + [x for x in QUANTITATIVE_COLUMNS if x not in BINARY_COLUMNS]
+INTEGER_COLUMNS = ['MAX_SNP_CT', 'N', 'N_cas', 'N_ctrl']
+# metrics ranked by best-model queries, each indexed with the dataset; P is ranked ascending
+RANKED_METRICS = ['P', 'AUC', 'PseudoR2', 'LiabilityR2', 'R2', 'OR_top10_to_middle20']
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS stat (
+    dataset TEXT NOT NULL,
+    model TEXT NOT NULL,
+    family TEXT,
+    {params},
+    {metrics},
+    source TEXT,
+    source_mtime INTEGER,
+    created TEXT,
+    updated TEXT,
+    PRIMARY KEY (dataset, model)
+)
+""".format(params=',\n    '.join('"{}" {}'.format(x, 'TEXT' if x == 'method' else 'REAL') for x in PARAM_COLUMNS),
+           metrics=',\n    '.join('"{}" {}'.format(x, 'INTEGER' if x in INTEGER_COLUMNS else 'REAL') for x in METRIC_COLUMNS))
+
+
+def to_number(text):
+    # '1e.04' (R names with '-' replaced by '.') -> 1e-04; None when not a number
+    try:
+        return float(re.sub(r'e\.(\d)', r'e-\1', text))
+    except ValueError:
+        return None
+
+
+def parse_model(model):
+    """
+    Parameters encoded in a model name:
+    [name]_[kb]_[p1]_[r2] from clumping, LDPred2_inf, LDPred2_[p]_[h2]_(no)sparse and LDPred2_beta_auto from ldpred2.R.
+    """
+    params = dict.fromkeys(PARAM_COLUMNS)
+    fields = model.split('_')
+    if 'LDPred2' in fields:
+        fields = fields[fields.index('LDPred2') + 1:]
+        if fields[-1] in ('sparse', 'nosparse') and len(fields) >= 3:
+            params.update(method='LDpred2-grid' if fields[-1] == 'nosparse' else 'LDpred2-grid-sparse',
+                          p_causal=to_number(fields[-3]), h2=to_number(fields[-2]))
+        elif fields[-1] == 'auto':
+            params['method'] = 'LDpred2-auto'
+        elif fields[-1] == 'inf':
+            params['method'] = 'LDpred2-inf'
+    elif len(fields) >= 4 and all(to_number(x) is not None for x in fields[-3:]):
+        params.update(method='clump', kb=to_number(fields[-3]), p1=to_number(fields[-2]), clump_r2=to_number(fields[-1]))
+    return params
+
+
+def read_stat(path):
+    # one .stat file (space-separated, written by prs_stat.R or stats.write_stat)
+    return pd.read_csv(path, sep=' ', dtype={'Model': str})
+
+
+class ResultStore(object):
+    """
+    Indexed table of prs-stat results. Rows are upserted by (dataset, model) with the parameters
+    parsed from the model name, so combining and ranking models are queries instead of file rescans.
+    """
+    def __init__(self, stat_dir):
+        self.path = '{}/results.sqlite'.format(stat_dir)
+        self.db = sqlite3.connect(self.path, timeout=60)
+        self.db.execute(SCHEMA)
+        for metric in RANKED_METRICS:
+            self.db.execute('CREATE INDEX IF NOT EXISTS stat_{0} ON stat (dataset, "{0}")'.format(metric))
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    def upsert(self, dataset, row, family, source=None):
+        # row: {column: value} of one .stat line; created is kept when the model is evaluated again
+        now = datetime.now().isoformat(timespec='seconds')
+        values = {'dataset': dataset, 'model': str(row['Model']), 'family': family}
+        values.update(parse_model(values['model']))
+        values.update({x: (None if pd.isna(row[x]) else int(row[x]) if x in INTEGER_COLUMNS else float(row[x]))
+                       for x in METRIC_COLUMNS if x in row})
+        values.update(source=None if source is None else os.path.abspath(source),
+                      source_mtime=None if source is None else os.stat(source).st_mtime_ns, created=now, updated=now)
+        columns = ', '.join('"{}"'.format(x) for x in values)
+        updates = ', '.join('"{0}"=excluded."{0}"'.format(x) for x in values if x not in ('dataset', 'model', 'created'))
+        self.db.execute('INSERT INTO stat ({}) VALUES ({}) ON CONFLICT (dataset, model) DO UPDATE SET {}'.format(
+                        columns, ', '.join('?' * len(values)), updates), list(values.values()))
+
+    def upsert_file(self, dataset, path):
+        # every row of a .stat file, dropping models the file no longer holds; the family follows from its columns
+        stat = read_stat(path)
+        family = 'binary' if 'AUC' in stat.columns else 'quantitative'
+        for row in stat.to_dict('records'):
+            self.upsert(dataset, row, family, path)
+        models = [str(x) for x in stat['Model']]
+        self.db.execute('DELETE FROM stat WHERE dataset=? AND source=? AND model NOT IN ({})'.format(', '.join('?' * len(models))),
+                        [dataset, os.path.abspath(path)] + models)
+        return len(stat)
+
+    def sync(self, dataset, stat_files):
+        """
+        Make the dataset's rows match stat_files: rows of files no longer listed (deleted or renamed) are removed,
+        and the files that are new or changed since they were stored, judged by mtime only, are upserted.
+        """
+        sources = [os.path.abspath(x) for x in stat_files]
+        self.db.execute('DELETE FROM stat WHERE dataset=? AND (source IS NULL OR source NOT IN ({}))'.format(', '.join('?' * len(sources))),
+                        [dataset] + sources)
+        stored = dict(self.db.execute('SELECT source, MAX(source_mtime) FROM stat WHERE dataset=? GROUP BY source', (dataset,)))
+        changed = [x for x in stat_files if stored.get(os.path.abspath(x)) != os.stat(x).st_mtime_ns]
+        for path in changed:
+            self.upsert_file(dataset, path)
+        self.db.commit()
+        return len(changed)
+
+    def commit(self):
+        self.db.commit()
+
+    def query(self, dataset, metric=None, top=None, method=None):
+        # models of a dataset, best first by metric (P ascending, other metrics descending)
+        if metric is not None and metric not in METRIC_COLUMNS:
+            raise ValueError('unknown metric {}; choose from {}'.format(metric, ', '.join(METRIC_COLUMNS)))
+        sql = 'SELECT * FROM stat WHERE dataset=?'
+        args = [dataset]
+        if method is not None:
+            sql += ' AND method=?'
+            args.append(method)
+        if metric is not None:
+            sql += ' AND "{0}" IS NOT NULL ORDER BY "{0}" {1}'.format(metric, 'ASC' if metric == 'P' else 'DESC')
+        if top is not None:
+            sql += ' LIMIT ?'
+            args.append(int(top))
+        return pd.read_sql_query(sql, self.db, params=args)
+
+    def export(self, dataset, path):
+        # the _combined.stat layout: the .stat columns of the dataset's family, tab-separated with 3 significant digits
+        stat = self.query(dataset)
+        columns = BINARY_COLUMNS if (stat['family'] == 'binary').any() else QUANTITATIVE_COLUMNS
+        stat = stat.rename(columns={'model': 'Model'})[columns]
+        stat.to_csv(path, index=False, header=True, sep='\t', float_format='%.3g')
+        return len(stat)
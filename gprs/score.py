@@ -0,0 +1,175 @@
+# Score every PRS model at once, reading the genotype dosages only once per chromosome
+import os
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from gprs.timer import span
+from gprs.vcf import VcfReader, iter_dosages, read_samples
+
+
+def read_beta_list(beta_dir_list):
+    # [model]\t[beta directory] file written by beta-list
+    df = pd.read_csv(beta_dir_list, header=None, sep='\t', dtype=str)
+    return dict(zip(df[0], df[1]))
+
+
+def find_weight_file(beta_dir, chrnb):
+    # same rule as build-prs: exactly one [chrnb]_*.weight per chromosome
+    beta_file = [x for x in os.listdir(beta_dir) if x.startswith("{}_".format(chrnb)) and x.endswith(".weight")]
+    if len(beta_file) > 1:
+        raise Exception("Multiple {} beta files in {}".format(chrnb, beta_dir))
+    if len(beta_file) == 0:
+        return None
+    return "{}/{}".format(beta_dir, beta_file[0])
+
+
+def read_weights(path, columns='1 4 6'):
+    """
+    SNPID, ALLELE, BETA (and POS) from a .weight file; columns are the 1-based [SNPID] [ALLELE] [BETA] positions as in plink2 --score.
+    Lines whose beta is not a number (headers) are skipped.
+    POS is taken from the third column (SNPID CHR POS ... layout of .weight files), NaN when it is not a position.
+    """
+    id_col, allele_col, beta_col = [int(x) - 1 for x in columns.split()]
+    df = pd.read_csv(path, sep=r'\s+', header=None, dtype=str)
+    weights = pd.DataFrame({'SNPID': df[id_col],
+                            'ALLELE': df[allele_col].str.upper(),
+                            'BETA': pd.to_numeric(df[beta_col], errors='coerce'),
+                            'POS': pd.to_numeric(df[2], errors='coerce') if df.shape[1] > 2 else np.nan})
+    return weights[weights['BETA'].notna()]
+
+
+class WeightMatrix(object):
+    """
+    Sparse SNP x model weights for one chromosome, built from every model's .weight file.
+    Effect alleles may differ between models, so the matrix is resolved per genotype block against REF/ALT.
+    """
+    def __init__(self, weights):
+        self.n_models = len(weights)
+        entries = pd.concat([w.assign(MODEL=i) for (i, w) in enumerate(weights) if w is not None])
+        self.snps = pd.Index(entries['SNPID'].unique())
+        self.row = self.snps.get_indexer(entries['SNPID'])
+        self.col = entries['MODEL'].to_numpy()
+        self.allele = entries['ALLELE'].to_numpy()
+        self.beta = entries['BETA'].to_numpy(np.float64)
+        self.positions = entries['POS'].to_numpy(np.float64)
+
+    def snp_ids(self):
+        return set(self.snps)
+
+    def snp_positions(self):
+        # positions of all weighted SNPs, or None if some .weight file has no POS column
+        if np.isnan(self.positions).any():
+            return None
+        return set(self.positions.astype(np.int64).tolist())
+
+    def for_variants(self, variants):
+        """
+        Weights for a block of VCF variants (rows in block order):
+        W (ALT dosage weights), C (constant per non-missing genotype, for REF effect alleles: 2*beta),
+        I (indicator of variants used by each model).
+        """
+        k = len(variants)
+        block_pos = np.full(len(self.snps), -1)
+        found = self.snps.get_indexer(variants['ID'])
+        block_pos[found[found >= 0]] = np.flatnonzero(found >= 0)
+        sel = block_pos[self.row] >= 0
+        r = block_pos[self.row[sel]]
+        c = self.col[sel]
+        allele = self.allele[sel]
+        beta = self.beta[sel]
+        is_alt = allele == variants['ALT'].to_numpy()[r]
+        is_ref = (allele == variants['REF'].to_numpy()[r]) & ~is_alt
+        keep = is_alt | is_ref
+        shape = (k, self.n_models)
+        W = sparse.csr_matrix((np.where(is_alt, beta, -beta)[keep], (r[keep], c[keep])), shape=shape)
+        C = sparse.csr_matrix((2 * beta[is_ref], (r[is_ref], c[is_ref])), shape=shape)
+        I = sparse.csr_matrix((np.ones(keep.sum()), (r[keep], c[keep])), shape=shape)
+        return W, C, I
+
+
+def dosage_blocks(vcf, chrnb, weight_matrix, block_size=512, threads=4):
+    """
+    (variants, dosages) blocks of the weighted SNPs. Bgzipped VCFs are read by position through
+    their .tbi/.csi (or a built position index); other files, or weights without POS, are streamed.
+    """
+    snp_ids = weight_matrix.snp_ids()
+    positions = weight_matrix.snp_positions()
+    if positions is not None and (vcf.endswith('.gz') or vcf.endswith('.bgz')):
+        try:
+            reader = VcfReader(vcf, threads)
+        except Exception as e:
+            print("{}: {}; streaming the whole file".format(vcf, e))
+        else:
+            return reader.fetch(chrnb, positions, snp_ids, block_size)
+    return iter_dosages(vcf, snp_ids, block_size)
+
+
+def score_chromosome(vcf, chrnb, weight_matrix, block_size=512, threads=4):
+    """
+    Scores (samples x models) and non-missing allele counts for one chromosome, as plink2
+    --score no-mean-imputation: SCORE_SUM = sum(beta * dosage of effect allele), ALLELE_CT = 2 * non-missing variants.
+    """
+    n_samples = len(read_samples(vcf))
+    scores = np.zeros((n_samples, weight_matrix.n_models))
+    allele_ct = np.zeros((n_samples, weight_matrix.n_models))
+    for variants, dosages in dosage_blocks(vcf, chrnb, weight_matrix, block_size, threads):
+        W, C, I = weight_matrix.for_variants(variants)
+        nonmissing = ~np.isnan(dosages)
+        dosages = np.where(nonmissing, dosages, 0)
+        nonmissing = nonmissing.astype(np.float32)
+        # one sparse-dense product per block for all models
+        scores += (W.T @ dosages).T + (C.T @ nonmissing).T
+        allele_ct += 2 * (I.T @ nonmissing).T
+    return scores, allele_ct
+
+
+def chromosome_scores(vcf_files, beta_dirs, columns='1 4 6', block_size=512, threads=4):
+    # (chromosome number, samples, scores, allele_ct) of every chromosome with weights, samples x models arrays
+    models = list(beta_dirs.keys())
+    samples = None
+    for nb in sorted(vcf_files):
+        chrnb = "chr{}".format(nb)
+        weights = []
+        for model in models:
+            beta_file = find_weight_file(beta_dirs[model], chrnb)
+            weights.append(None if beta_file is None else read_weights(beta_file, columns))
+        if all(w is None for w in weights):
+            print("{} beta files not found in any model. skip".format(chrnb))
+            continue
+        chr_samples = read_samples(vcf_files[nb])
+        if samples is None:
+            samples = chr_samples
+        elif chr_samples != samples:
+            raise Exception("Samples in {} differ from the other chromosomes".format(vcf_files[nb]))
+        print("Scoring {} models on {}...".format(sum(w is not None for w in weights), chrnb))
+        with span(chrnb, kind='task'):
+            scores, allele_ct = score_chromosome(vcf_files[nb], nb, WeightMatrix(weights), block_size, threads)
+        yield nb, samples, scores, allele_ct
+
+
+def score_models(vcf_files, beta_dirs, columns='1 4 6', block_size=512, threads=4, store=None):
+    """
+    vcf_files: {chromosome number: vcf path}; beta_dirs: {model: beta directory}
+    threads: BGZF decompression threads per chromosome
+    store: optional ScoreMatrix; each chromosome's partial scores are written to it as soon as they are computed
+    Only the running genome-wide sums are kept. Returns samples, models, scores and allele_ct (samples x models),
+    samples None when no chromosome was scored.
+    """
+    models = list(beta_dirs.keys())
+    totals = [None, None, None]
+
+    def scored():
+        for nb, samples, scores, allele_ct in chromosome_scores(vcf_files, beta_dirs, columns, block_size, threads):
+            if totals[0] is None:
+                totals[:] = [samples, scores.copy(), allele_ct.copy()]
+            else:
+                totals[1] += scores
+                totals[2] += allele_ct
+            yield nb, np.asarray(samples), scores, allele_ct
+
+    if store is None:
+        for _ in scored():
+            pass
+    else:
+        store.write_models(models, scored())
+    return totals[0], models, totals[1], totals[2]
@@ -0,0 +1,164 @@
+# Score matrix store: per-chromosome partial PRS of every model on the sample index it was scored on, memory-mapped, so
+# genome-wide sums, standardisation and sample subsets are vectorized reads instead of merges on #IID
+import glob
+import hashlib
+import os
+import re
+import sys
+import numpy as np
+import pandas as pd
+
+CHROMOSOMES = 22
+SCORE_DIR = 'scores'
+
+
+def read_sscore(path):
+    # sample IDs, SCORE1_SUM and NMISS_ALLELE_CT of a per-chromosome plink2 .sscore
+    df = pd.read_csv(path, sep='\t', usecols=['#IID', 'NMISS_ALLELE_CT', 'SCORE1_SUM'], dtype={'#IID': str},
+                     keep_default_na=False)
+    return df['#IID'].to_numpy(), df['SCORE1_SUM'].to_numpy(np.float64), df['NMISS_ALLELE_CT'].to_numpy(np.float64)
+
+
+def chromosome_sscores(model_dir, model):
+    # {chromosome number: path} of the chr[n]_[model].sscore files written by build-prs
+    pattern = re.compile(r'^chr(\d+)_{}\.sscore$'.format(re.escape(model)))
+    matches = [pattern.match(x) for x in os.listdir(model_dir)] if os.path.isdir(model_dir) else []
+    return {int(x.group(1)): '{}/{}'.format(model_dir, x.group(0)) for x in matches if x is not None}
+
+
+def standardize(x):
+    return (x - x.mean()) / x.std(ddof=1)
+
+
+def write_sscore(frame, path):
+    # combined .sscore layout of build-prs, read by prs-stat
+    frame[['#IID', 'SCORE_SUM', 'SCORE_STD', 'TOTAL_ALLELE_CT']].to_csv(path, index=False, sep='\t')
+
+
+class ScoreMatrix(object):
+    """
+    [root]/scores/[sha1 of the sample IDs]: one directory per sample index, taken from the first chromosome
+    scored, with samples.txt and per model [model].score.npy and [model].allele_ct.npy, float64 arrays of
+    22 chromosomes x samples. A model is kept in the set it was last scored on, so cohorts sharing [root] do not
+    truncate each other. NaN marks a chromosome not scored, or a sample missing from that chromosome's scores.
+    """
+    def __init__(self, root):
+        self.path = '{}/{}'.format(root, SCORE_DIR)
+        os.makedirs(self.path, exist_ok=True)
+        self.indexes = {}
+
+    def sample_set(self, samples):
+        # directory of a sample index, created once; tasks scoring other models may race to create it, the first link wins
+        samples = pd.Series(samples, dtype=str)
+        path = '{}/{}'.format(self.path, hashlib.sha1('\n'.join(samples).encode()).hexdigest()[:16])
+        samples_path = '{}/samples.txt'.format(path)
+        if not os.path.exists(samples_path):
+            os.makedirs(path, exist_ok=True)
+            tmp = '{}.{}.tmp'.format(samples_path, os.getpid())
+            samples.to_csv(tmp, header=False, index=False)
+            try:
+                os.link(tmp, samples_path)
+            except FileExistsError:
+                pass
+            os.remove(tmp)
+        return path
+
+    def samples(self, path):
+        # sample index of a sample set directory
+        if path not in self.indexes:
+            self.indexes[path] = pd.Index(pd.read_csv('{}/samples.txt'.format(path), header=None, dtype=str, keep_default_na=False)[0])
+        return self.indexes[path]
+
+    def locate(self, model):
+        # sample set directory holding a model, or None
+        for path in glob.glob('{}/*/{}.score.npy'.format(self.path, glob.escape(model))):
+            return os.path.dirname(path)
+        return None
+
+    def files(self, path, model):
+        return '{}/{}.score.npy'.format(path, model), '{}/{}.allele_ct.npy'.format(path, model)
+
+    def models(self):
+        return sorted(os.path.basename(x)[:-len('.score.npy')] for x in glob.glob('{}/*/*.score.npy'.format(self.path)))
+
+    def write(self, model, chromosomes):
+        # store one model from (chromosome number, sample IDs, scores, allele counts) items
+        return self.write_models([model], ((nb, ids, score[:, None], allele_ct[:, None]) for (nb, ids, score, allele_ct) in chromosomes))
+
+    def write_models(self, models, chromosomes):
+        """
+        Store models from (chromosome number, sample IDs, scores, allele counts) items with samples x models arrays,
+        filled chromosome by chromosome into memory-mapped files that replace the previous ones when complete,
+        so each chromosome can be dropped by the caller once it is written. The sample index is the first
+        chromosome's; samples only in later chromosomes lack that chromosome's score, and are left out of the
+        genome-wide sums anyway.
+        """
+        path, arrays = None, None
+        for nb, ids, score, allele_ct in chromosomes:
+            if arrays is None:
+                first, path = nb, self.sample_set(ids)
+                index = self.samples(path)
+                tmp = [['{}.{}.tmp.npy'.format(x[:-len('.npy')], os.getpid()) for x in self.files(path, model)] for model in models]
+                arrays = [[np.lib.format.open_memmap(x, mode='w+', dtype=np.float64, shape=(CHROMOSOMES, len(index))) for x in files]
+                          for files in tmp]
+                for pair in arrays:
+                    for x in pair:
+                        x[:] = np.nan
+            where = index.get_indexer(ids)
+            found = where >= 0
+            if not found.all():
+                print('Warning: {} samples of chr{} are not scored on chr{}; left out of the genome-wide scores'.format(
+                        (~found).sum(), nb, first))
+            for i, pair in enumerate(arrays):
+                pair[0][nb - 1, where[found]] = score[found, i]
+                pair[1][nb - 1, where[found]] = allele_ct[found, i]
+        if arrays is None:
+            return False
+        for pair in arrays:
+            for x in pair:
+                x.flush()
+        del arrays
+        for model, files in zip(models, tmp):
+            for x, target in zip(files, self.files(path, model)):
+                os.replace(x, target)
+            # a model rescored on another sample set moves there
+            for other in glob.glob('{}/*/{}.score.npy'.format(self.path, glob.escape(model))):
+                if os.path.dirname(other) != path:
+                    for x in self.files(os.path.dirname(other), model):
+                        if os.path.exists(x):
+                            os.remove(x)
+        return True
+
+    def load(self, model):
+        # (scores, allele counts) of a model, chromosomes x samples, memory-mapped
+        path = self.locate(model)
+        if path is None:
+            sys.exit('ERROR: {} is not in the score store {}\n'.format(model, self.path))
+        score_path, allele_ct_path = self.files(path, model)
+        return np.load(score_path, mmap_mode='r'), np.load(allele_ct_path, mmap_mode='r')
+
+    def genome_wide(self, model, samples=None):
+        """
+        #IID, SCORE_SUM, SCORE_STD and TOTAL_ALLELE_CT over the scored chromosomes, as build-prs combines them.
+        Samples missing from a scored chromosome are left out, as the merge on #IID did.
+        With samples (IDs), only those columns are read and SCORE_STD is standardised within them.
+        """
+        score, allele_ct = self.load(model)
+        index = self.samples(self.locate(model))
+        if samples is None:
+            columns = np.arange(len(index))
+        else:
+            columns = index.get_indexer(pd.unique(pd.Series(samples, dtype=str)))
+            if (columns < 0).any():
+                print('Warning: {} of {} individuals were not scored for {}'.format((columns < 0).sum(), len(columns), model))
+            columns = np.sort(columns[columns >= 0])
+        score, allele_ct = score[:, columns], allele_ct[:, columns]
+        scored = ~np.isnan(score).all(axis=1)
+        score, allele_ct = score[scored], allele_ct[scored]
+        complete = ~np.isnan(score).any(axis=0)
+        score_sum = score[:, complete].sum(axis=0)
+        total_allele_ct = allele_ct[:, complete].sum(axis=0)
+        return pd.DataFrame({'#IID': index[columns[complete]],
+                             'SCORE_SUM': score_sum,
+                             'SCORE_STD': standardize(score_sum),
+                             'TOTAL_ALLELE_CT': total_allele_ct.astype(np.int64) if (total_allele_ct % 1 == 0).all() else total_allele_ct})
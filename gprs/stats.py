@@ -0,0 +1,273 @@
+# PRS association statistics for many models at once (same output as prs_stat.R)
+import os
+import sys
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+BINARY_COLUMNS = ['Model', 'MAX_SNP_CT', 'P', 'Beta', 'SE', 'OR', 'AUC', 'PseudoR2', 'LiabilityR2', 'N', 'N_cas', 'N_ctrl',
+                  'OR_top1_to_middle20', 'OR_top2_to_middle20', 'OR_top5_to_middle20', 'OR_top10_to_middle20']
+QUANTITATIVE_COLUMNS = ['Model', 'MAX_SNP_CT', 'P', 'Beta', 'SE', 'R2', 'N']
+# percentiles compared with the middle (40-60th) group; as in prs_stat.R, where the relabelling turns the
+# percentile column into text, top_2 ends up as only the 99th, top_5 the 96-98th and top_10 the 91-95th
+TOP_GROUPS = [('OR_top1_to_middle20', [100]), ('OR_top2_to_middle20', [99]),
+              ('OR_top5_to_middle20', [96, 97, 98]), ('OR_top10_to_middle20', [91, 92, 93, 94, 95])]
+MIDDLE_GROUP = list(range(40, 61))
+MAX_ITER = 25
+
+
+def h2l_r2(k, r2, p):
+    """
+    R2 on the liability scale (Lee et al. 2012, Genet Epidemiol 36:214-24)
+    k: population prevalence, r2: observed R2, p: proportion of cases in the sample
+    """
+    x = stats.norm.ppf(1 - k)
+    z = stats.norm.pdf(x)
+    i = z / k
+    c = k * (1 - k) * k * (1 - k) / (z ** 2 * p * (1 - p))
+    theta = i * ((p - k) / (1 - k)) * (i * ((p - k) / (1 - k)) - x)
+    return c * r2 / (1 + c * theta * r2)
+
+
+def r_format(x, digits=3):
+    # a number as R's format(x, digits=3): at least `digits` significant digits, fixed unless scientific is narrower
+    if isinstance(x, str):
+        return x
+    if x is None or (isinstance(x, float) and np.isnan(x)):
+        return 'NA' if x is None else 'NaN'
+    if np.isinf(x):
+        return 'Inf' if x > 0 else '-Inf'
+    if float(x) == int(x) and abs(x) < 1e15:
+        return str(int(x))
+    mantissa, exponent = '{:.{}e}'.format(x, digits - 1).split('e')
+    mantissa = mantissa.rstrip('0').rstrip('.')
+    exponent = int(exponent)
+    nsig = len(mantissa.replace('-', '').replace('.', ''))
+    fixed = '{:.{}f}'.format(x, max(0, nsig - 1 - exponent))
+    sci = '{}e{}{:02d}'.format(mantissa, '-' if exponent < 0 else '+', abs(exponent))
+    return fixed if len(fixed) <= len(sci) else sci
+
+
+def score_files(score, model=''):
+    # {model: .sscore path}: every .sscore in a directory named after its file, or one file named `model`
+    if os.path.isdir(score):
+        files = { x[:-len('.sscore')]: "{}/{}".format(score, x) for x in sorted(os.listdir(score)) if x.endswith('.sscore') }
+        print('{} .sscore files found in {}'.format(len(files), score))
+        return files
+    if not os.path.exists(score):
+        sys.exit("ERROR: {} not found. Please check the sscore again\n".format(score))
+    if model == '':
+        sys.exit('ERROR: --model is required for a single .sscore file\n')
+    return { model: score }
+
+
+def read_scores(path):
+    # ID (1st column), SCORE_STD (3rd) and TOTAL_ALLELE_CT (4th) of a .sscore; the '#IID' header is skipped like a comment
+    df = pd.read_csv(path, sep=r'\s+', header=None, comment='#', dtype={0: str})
+    return pd.DataFrame({'ID': df[0], 'SCORE_STD': df[2].astype(float), 'TOTAL_ALLELE_CT': df[3].astype(float)})
+
+
+def read_pheno(path, family):
+    """
+    Phenotype file with header: ID, PHENO, then covariates.
+    Rows without a phenotype are dropped; rows with missing covariates are kept, and evaluate
+    leaves them out of the regressions only, as glm does in prs_stat.R.
+    """
+    pheno = pd.read_csv(path, sep=r'\s+', dtype={'ID': str})
+    if list(pheno.columns[:2]) != ['ID', 'PHENO']:
+        sys.exit('ERROR: Header names for Phenotype file are wrong. Please read manual and format accordingly.\n')
+    print('Phenotype file contains {} individuals and {} covariates.\n'.format(len(pheno), pheno.shape[1] - 2))
+    if family == 'binary' and pheno['PHENO'].nunique() > 2:
+        sys.exit('ERROR: Phenotype has more than two values.\n')
+    if family == 'quantitative' and pheno['PHENO'].nunique() == 2:
+        print('Warning: Phenotype has only two values.\n')
+    return pheno.dropna(subset=['PHENO']).reset_index(drop=True)
+
+
+def covariate_design(pheno):
+    # intercept + covariates; text covariates become indicator columns with the first level as reference (R treatment contrasts)
+    covariates = pheno.iloc[:, 2:]
+    if covariates.shape[1] > 0:
+        covariates = pd.get_dummies(covariates, drop_first=True)
+    return np.column_stack([np.ones(len(pheno))] + [covariates[x].to_numpy(np.float64) for x in covariates.columns])
+
+
+def ntile(scores, n=100):
+    # dplyr::ntile for each column: ranks with ties in order of appearance, larger groups first
+    length = scores.shape[0]
+    ranks = np.empty(scores.shape, dtype=np.int64)
+    order = np.argsort(scores, axis=0, kind='stable')
+    np.put_along_axis(ranks, order, np.arange(1, length + 1)[:, None], axis=0)
+    n_larger = length % n
+    larger_size, smaller_size = -(-length // n), length // n
+    larger_threshold = larger_size * n_larger
+    if smaller_size == 0:
+        return (ranks + larger_size - 1) // larger_size
+    return np.where(ranks <= larger_threshold, (ranks + larger_size - 1) // larger_size,
+                    (ranks - larger_threshold + smaller_size - 1) // smaller_size + n_larger)
+
+
+def quantitative_fit(y, covariates, scores):
+    """
+    Linear regression of y on covariates + each score column, all models at once.
+    The covariate design is factored once (QR); each score enters through its residual (Frisch-Waugh-Lovell).
+    Returns beta, se, p (t test) of the score and the R2 of each full model.
+    """
+    q, _ = np.linalg.qr(covariates)
+    y_res = y - q @ (q.T @ y)
+    s_res = scores - q @ (q.T @ scores)
+    ss = (s_res ** 2).sum(axis=0)
+    beta = s_res.T @ y_res / ss
+    rss = (y_res ** 2).sum() - beta ** 2 * ss
+    df = len(y) - covariates.shape[1] - 1
+    se = np.sqrt(rss / df / ss)
+    p = 2 * stats.t.sf(np.abs(beta / se), df)
+    r2 = 1 - rss / ((y - y.mean()) ** 2).sum()
+    return beta, se, p, r2
+
+
+def logistic_fit(y, covariates, scores, tol=1e-8):
+    """
+    Logistic regression of y (0/1) on covariates + each score column, as batched IRLS over all models.
+    The normal equations are assembled from covariate and score blocks, so only (samples x models) arrays are held.
+    Returns beta, se, p (Wald z test) of the score, the linear predictors (samples x models) and log-likelihoods.
+    """
+    n, k = covariates.shape
+    m = scores.shape[1]
+
+    def information(w):
+        # X'WX of every model, (models x k+1 x k+1)
+        xtwx = np.empty((m, k + 1, k + 1))
+        xtwx[:, :k, :k] = np.einsum('ni,nm,nj->mij', covariates, w, covariates, optimize=True)
+        xtwx[:, :k, k] = xtwx[:, k, :k] = (covariates.T @ (w * scores)).T
+        xtwx[:, k, k] = (w * scores ** 2).sum(axis=0)
+        return xtwx
+
+    coef = np.zeros((m, k + 1))
+    eta = np.zeros((n, m))
+    deviance = np.full(m, np.inf)
+    for _ in range(MAX_ITER):
+        mu = 1 / (1 + np.exp(-eta))
+        w = np.clip(mu * (1 - mu), 1e-12, None)
+        wz = w * eta + (y[:, None] - mu)
+        xtwz = np.concatenate([(covariates.T @ wz).T, (scores * wz).sum(axis=0)[:, None]], axis=1)
+        coef = np.linalg.solve(information(w), xtwz[:, :, None])[:, :, 0]
+        eta = covariates @ coef[:, :k].T + scores * coef[:, k]
+        mu = np.clip(1 / (1 + np.exp(-eta)), 1e-15, 1 - 1e-15)
+        new_deviance = -2 * (y[:, None] * np.log(mu) + (1 - y[:, None]) * np.log(1 - mu)).sum(axis=0)
+        # glm.fit convergence rule: relative change in deviance
+        converged = np.abs(new_deviance - deviance) / (np.abs(new_deviance) + 0.1) < tol
+        deviance = new_deviance
+        if converged.all():
+            break
+    cov = np.linalg.inv(information(mu * (1 - mu)))
+    beta = coef[:, k]
+    se = np.sqrt(cov[:, k, k])
+    p = 2 * stats.norm.sf(np.abs(beta / se))
+    return beta, se, p, eta, -deviance / 2
+
+
+def auc(y, scores):
+    """
+    AUC of each score column from the rank-sum statistic, with pROC's automatic direction:
+    cases are expected higher unless the median of controls is above the median of cases.
+    """
+    ranks = stats.rankdata(scores, axis=0)
+    cases = y == 1
+    n1, n0 = cases.sum(), (~cases).sum()
+    a = (ranks[cases].sum(axis=0) - n1 * (n1 + 1) / 2) / (n1 * n0)
+    flip = np.median(scores[~cases], axis=0) > np.median(scores[cases], axis=0)
+    return np.where(flip, 1 - a, a)
+
+
+def odds_ratio(top, middle, y):
+    # (controls_middle * cases_top) / (cases_middle * controls_top), the 2x2 odds ratio of DescTools::OddsRatio
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return ((middle & (y == 0)[:, None]).sum(axis=0) * (top & (y == 1)[:, None]).sum(axis=0) /
+                ((middle & (y == 1)[:, None]).sum(axis=0) * (top & (y == 0)[:, None]).sum(axis=0)))
+
+
+def evaluate(scores, pheno, family, pop_prev=None):
+    """
+    Statistics of every model on the same samples.
+    scores: {model: DataFrame from read_scores}; pheno: DataFrame from read_pheno
+    Returns {model: row dict in the prs_stat.R column order}.
+    """
+    index = pd.Index(pheno['ID'])
+    # models scored on the same individuals are evaluated together
+    groups = {}
+    for model, score in scores.items():
+        rows = index.get_indexer(score['ID'])
+        keep = rows >= 0
+        groups.setdefault(rows[keep].tobytes(), []).append((model, score[keep]))
+    results = {}
+    for members in groups.values():
+        models = [x[0] for x in members]
+        rows = index.get_indexer(members[0][1]['ID'])
+        subset = pheno.iloc[rows].reset_index(drop=True)
+        # N, percentiles and AUC use every joined row; the regressions only those with all covariates (glm's na.omit)
+        complete = subset.iloc[:, 2:].notna().all(axis=1).to_numpy()
+        covariates = covariate_design(subset[complete])
+        s = np.column_stack([x[1]['SCORE_STD'].to_numpy() for x in members])
+        max_snp = [np.ceil(x[1]['TOTAL_ALLELE_CT'].max() / 2) for x in members]
+        if family == 'binary':
+            levels = sorted(subset['PHENO'].unique())
+            y = (subset['PHENO'] == levels[-1]).to_numpy(np.float64)
+            y_fit = y[complete]
+            beta, se, p, eta, loglik = logistic_fit(y_fit, covariates, s[complete])
+            n = len(y)
+            n_fit = len(y_fit)
+            mu0 = y_fit.mean()
+            loglik0 = n_fit * (mu0 * np.log(mu0) + (1 - mu0) * np.log(1 - mu0))
+            # Nagelkerke: Cox-Snell R2 scaled by its maximum
+            nagelkerke = (1 - np.exp(2 / n_fit * (loglik0 - loglik))) / (1 - np.exp(2 / n_fit * loglik0))
+            obs_r2 = np.array([np.corrcoef(eta[:, i], y_fit)[0, 1] ** 2 for i in range(len(models))])
+            liability_r2 = h2l_r2(pop_prev, obs_r2, y.mean())
+            areas = auc(y, s)
+            percentile = ntile(s, 100)
+            middle = np.isin(percentile, MIDDLE_GROUP)
+            odds = {name: odds_ratio(np.isin(percentile, group), middle, y) for (name, group) in TOP_GROUPS}
+            for i, model in enumerate(models):
+                row = [model, max_snp[i], p[i], beta[i], se[i], np.exp(beta[i]), areas[i], nagelkerke[i], liability_r2[i],
+                       n, int(y.sum()), int(n - y.sum())] + [odds[name][i] for (name, group) in TOP_GROUPS]
+                results[model] = dict(zip(BINARY_COLUMNS, row))
+        else:
+            y = subset['PHENO'].to_numpy(np.float64)
+            beta, se, p, r2 = quantitative_fit(y[complete], covariates, s[complete])
+            for i, model in enumerate(models):
+                results[model] = dict(zip(QUANTITATIVE_COLUMNS, [model, max_snp[i], p[i], beta[i], se[i], r2[i], len(y)]))
+    return results
+
+
+def write_stat(path, row):
+    # one-row .stat, space-separated with 3 significant digits like write.table(format(stat, digits=3))
+    with open(path, 'w') as o:
+        o.write(' '.join(row.keys()) + '\n')
+        o.write(' '.join(r_format(x) for x in row.values()) + '\n')
+
+
+def plot_roc(path, y, score, area):
+    # ROC curve as pdf; matplotlib is optional
+    try:
+        import matplotlib
+        matplotlib.use('Agg')
+        import matplotlib.pyplot as plt
+    except ImportError:
+        print('Warning: matplotlib is not installed; ROC plot skipped')
+        return
+    # same direction as the AUC
+    if np.median(score[y == 0]) > np.median(score[y == 1]):
+        score = -score
+    order = np.argsort(-score, kind='stable')
+    tpr = np.concatenate([[0], np.cumsum(y[order] == 1) / (y == 1).sum()])
+    fpr = np.concatenate([[0], np.cumsum(y[order] == 0) / (y == 0).sum()])
+    fig, ax = plt.subplots()
+    ax.fill_between(1 - fpr, tpr, alpha=0.2)
+    ax.plot(1 - fpr, tpr)
+    ax.plot([1, 0], [0, 1], color='grey', linewidth=0.5)
+    ax.set_xlim(1, 0)
+    ax.set_xlabel('Specificity')
+    ax.set_ylabel('Sensitivity')
+    ax.text(0.5, 0.4, 'AUC: {:.3f}'.format(area))
+    fig.savefig(path)
+    plt.close(fig)
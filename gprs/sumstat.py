@@ -0,0 +1,185 @@
+# Typed schema for unified summary statistics (output of prepare-sumstat)
+import os
+import re
+import sys
+import operator
+import pandas as pd
+
+SUMSTAT_COLUMNS = ['SNPID', 'CHR', 'POS', 'Effect_Allele', 'NonEffect_Allele', 'Beta', 'SE', 'Pvalue', 'N_eff']
+
+# compact in-memory dtypes; alleles are a handful of distinct strings, so categorical is ~1 byte per SNP
+SUMSTAT_DTYPES = {
+    'SNPID': 'object',
+    'CHR': 'int8',
+    'POS': 'int32',
+    'Effect_Allele': 'category',
+    'NonEffect_Allele': 'category',
+    'Beta': 'float32',
+    'SE': 'float32',
+    'Pvalue': 'float64',
+    'N_eff': 'Int32'
+}
+
+# nullable counterparts, used when an integer column contains missing values
+NULLABLE_DTYPES = {'int8': 'Int8', 'int32': 'Int32'}
+
+# non-autosomal chromosomes use plink's numeric codes
+CHROMOSOME_CODES = {'X': '23', 'Y': '24', 'XY': '25', 'MT': '26', 'M': '26'}
+
+# [chr]CHR:POS[:A1:A2] (':' or '_' separated) or rsID, decoded in one regex pass
+SNPID_PATTERN = re.compile(r'^(?:CHR)?(?P<CHR>[0-9]{1,2}|XY|X|Y|MT|M)[:_](?P<POS>[0-9]+)(?:[:_](?P<A1>[ACGTN]+)[:_](?P<A2>[ACGTN]+))?$|^(?P<RSID>RS[0-9]+)$',
+                           re.IGNORECASE)
+
+
+def normalize_chr(chrom):
+    # '1', 'chr1', 1 -> 1; X/Y/XY/MT (with or without 'chr') -> 23/24/25/26; anything else -> NA
+    chrom = chrom.astype(str).str.upper().str.replace('^CHR', '', regex=True).replace(CHROMOSOME_CODES)
+    return pd.to_numeric(chrom, errors='coerce')
+
+
+def decode_snpid(snpid):
+    """
+    Decode SNP IDs in chr:pos:a1:a2 (or chr:pos) form into typed CHR/POS/A1/A2 columns.
+    rsIDs carry no position and are returned with missing CHR/POS.
+    Returns the decoded DataFrame and a count of IDs per form (including 'malformed').
+    """
+    parts = snpid.astype(str).str.extract(SNPID_PATTERN)
+    is_pos = parts['CHR'].notna()
+    is_rsid = parts['RSID'].notna()
+    has_alleles = parts['A1'].notna()
+    counts = {
+        'chr:pos:a1:a2': int((is_pos & has_alleles).sum()),
+        'chr:pos': int((is_pos & ~has_alleles).sum()),
+        'rsID': int(is_rsid.sum()),
+        'malformed': int((~is_pos & ~is_rsid).sum())
+    }
+    decoded = pd.DataFrame(index=snpid.index)
+    decoded['CHR'] = normalize_chr(parts['CHR']).astype('Int8')
+    decoded['POS'] = pd.to_numeric(parts['POS'], errors='coerce').astype('Int32')
+    decoded['A1'] = parts['A1'].str.upper().astype('category')
+    decoded['A2'] = parts['A2'].str.upper().astype('category')
+    return decoded, counts
+
+
+def apply_schema(df):
+    """
+    Cast unified summary statistics to SUMSTAT_DTYPES.
+    Unlike astype(errors='ignore'), a column with 'NA' values is not left as object:
+    integer columns fall back to their nullable dtype, float columns get NaN.
+    """
+    for col, dtype in SUMSTAT_DTYPES.items():
+        if col not in df:
+            continue
+        if dtype in ('int8', 'int32', 'Int32'):
+            if col == 'CHR':
+                values = normalize_chr(df[col])
+            else:
+                values = pd.to_numeric(df[col], errors='coerce').round()
+            if values.isna().any():
+                dtype = NULLABLE_DTYPES.get(dtype, dtype)
+            df[col] = values.astype(dtype)
+        elif dtype == 'category':
+            df[col] = df[col].astype(str).str.upper().astype('category')
+        elif dtype.startswith('float'):
+            df[col] = pd.to_numeric(df[col], errors='coerce').astype(dtype)
+        else:
+            df[col] = df[col].astype(str)
+    return df
+
+
+def read_sumstat(path, columns=None, filters=None):
+    """
+    Read one unified summary statistics file (.csv from prepare-sumstat, or .parquet) with the typed schema.
+    columns: optional list of columns to load (projection)
+    filters: optional list of (column, op, value) predicates, i.e. [('Pvalue', '<=', 5e-8)];
+             for parquet they are pushed down to the row groups using the column statistics
+    """
+    if path.endswith('.parquet'):
+        pq = import_parquet()
+        df = pq.read_table(path, columns=columns, filters=filters).to_pandas()
+        return apply_schema(df)
+    dtype = {col: dtype for (col, dtype) in SUMSTAT_DTYPES.items() if not dtype.lower().startswith('int')}
+    dtype['SNPID'] = str
+    df = apply_schema(pd.read_csv(path, sep='\t', usecols=columns, dtype=dtype))
+    for col, op, value in filters or []:
+        if op == 'in':
+            df = df[df[col].isin(value)]
+        else:
+            df = df[FILTER_OPS[op](df[col], value)]
+    return df
+
+
+FILTER_OPS = {'<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge, '==': operator.eq, '!=': operator.ne}
+
+
+def import_parquet():
+    # pyarrow is optional; only needed for the columnar sumstat store
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        sys.exit('ERROR: pyarrow is required for parquet summary statistics. Install it with "pip install pyarrow".\n')
+    return pq
+
+
+def parquet_schema():
+    import pyarrow as pa
+    return pa.schema([
+        ('SNPID', pa.string()),
+        ('CHR', pa.int8()),
+        ('POS', pa.int32()),
+        ('Effect_Allele', pa.string()),
+        ('NonEffect_Allele', pa.string()),
+        ('Beta', pa.float32()),
+        ('SE', pa.float32()),
+        ('Pvalue', pa.float64()),
+        ('N_eff', pa.int32())
+    ])
+
+
+class ParquetPartitions(object):
+    """
+    One parquet file per chromosome ([prefix]_chr[nb].parquet). Every appended chunk becomes a row group,
+    with min/max statistics per column, so readers can skip row groups with filters.
+    """
+    def __init__(self, prefix):
+        import pyarrow as pa
+        self.pa = pa
+        self.pq = import_parquet()
+        self.schema = parquet_schema()
+        self.writers = {}
+        self.prefix = prefix
+
+    def write(self, chrnb, df):
+        if chrnb not in self.writers:
+            self.writers[chrnb] = self.pq.ParquetWriter('{}_chr{}.parquet'.format(self.prefix, chrnb), self.schema)
+        table = self.pa.Table.from_pandas(df, schema=self.schema, preserve_index=False)
+        self.writers[chrnb].write_table(table)
+
+    def close(self, chrnbs=range(1, 23)):
+        # chromosomes without any SNP still get an (empty) partition
+        for chrnb in chrnbs:
+            if chrnb not in self.writers:
+                self.write(chrnb, pd.DataFrame(columns=SUMSTAT_COLUMNS))
+        for writer in self.writers.values():
+            writer.close()
+
+
+def sumstat_path(prefix, chrnb):
+    # columnar partition if it exists, otherwise the tab-separated file
+    if os.path.exists('{}_chr{}.parquet'.format(prefix, chrnb)):
+        return '{}_chr{}.parquet'.format(prefix, chrnb)
+    return '{}_chr{}.csv'.format(prefix, chrnb)
+
+
+def export_tsv(prefix):
+    """
+    Write [prefix]_chr[nb].csv from the parquet partitions when the text file is missing or older,
+    for tools that need the tab-separated format (plink --extract/--clump, ldpred2.R).
+    """
+    for chrnb in range(1, 23):
+        parquet = '{}_chr{}.parquet'.format(prefix, chrnb)
+        csv = '{}_chr{}.csv'.format(prefix, chrnb)
+        if os.path.exists(parquet) and (not os.path.exists(csv) or os.path.getmtime(csv) < os.path.getmtime(parquet)):
+            read_sumstat(parquet).to_csv(csv, index=False, sep='\t', header=True, na_rep='NA')
+            print('Exported {}'.format(csv))
+
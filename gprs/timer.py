@@ -1,7 +1,23 @@
-# Define timer functions
-import atexit
-from time import time, strftime, localtime
-from datetime import timedelta
+# Run instrumentation: every stage, chromosome task and external command (plink, plink2, Rscript) is a span
+# with wall time, CPU time and peak RSS; each run writes a JSONL trace and prints its slowest spans
+import functools
+import itertools
+import json
+import os
+import resource
+import subprocess
+import sys
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from time import localtime, perf_counter, process_time, strftime, time
+
+TRACE_DIR = 'trace'
+SUMMARY_ROWS = 15
+# span ids are unique across the worker processes of a run: pid and a per-process counter
+_ids = itertools.count(1)
+__all__ = ['log', 'secondsToStr', 'span', 'traced']
+
 
 def secondsToStr(elapsed=None):
     if elapsed is None:
@@ -17,13 +33,180 @@ def log(s, elapsed=None, start=None):
         print("Elapsed time:", elapsed)
     print(line)
 
-def endlog(start):
-    end = time()
-    elapsed = end-start
-    log("Ending Analysis", secondsToStr(elapsed))
 
-def exitlog(start):
-    exit = time()
-    elapsed = exit-start
-    print("\n")
-    log("Exiting Program", secondsToStr(elapsed))
+def read_peak_rss():
+    # high-water resident set size of this process in MB (VmHWM on Linux, ru_maxrss elsewhere)
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+def reset_peak_rss():
+    # start a new high-water mark (Linux >= 4.0); elsewhere a span reports the peak of the process so far
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def children_cpu():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+class Tracer(object):
+    """
+    Spans of one process. Open spans are tracked across threads so resetting the RSS high-water mark for a
+    new span first folds the current peak into every open one; the stack of a thread gives span parents.
+    """
+    def __init__(self):
+        self.spans = []
+        self.open = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def stack(self):
+        if not hasattr(self.local, 'stack'):
+            self.local.stack = []
+        return self.local.stack
+
+    def current(self):
+        stack = self.stack()
+        return stack[-1]['id'] if len(stack) > 0 else None
+
+    def start(self, record):
+        with self.lock:
+            peak = read_peak_rss()
+            for x in self.open.values():
+                x['_peak'] = max(x['_peak'], peak)
+            reset_peak_rss()
+            record['_peak'] = 0
+            self.open[record['id']] = record
+
+    def end(self, record):
+        with self.lock:
+            peak = max(record.pop('_peak'), read_peak_rss())
+            del self.open[record['id']]
+            self.spans.append(record)
+        return peak
+
+    def extend(self, spans):
+        # spans returned by worker processes
+        with self.lock:
+            self.spans.extend(spans)
+
+
+TRACER = Tracer()
+
+
+@contextmanager
+def span(name, kind='stage', parent=None, **attrs):
+    """
+    Record the enclosed block as a span: wall and CPU seconds of this process, CPU seconds of child processes
+    that ended meanwhile, and peak RSS in MB. parent defaults to the enclosing span of this thread.
+    Yields the span record, so attributes can be added to it.
+    """
+    stack = TRACER.stack()
+    record = {'id': '{}-{}'.format(os.getpid(), next(_ids)), 'parent': parent if parent is not None else TRACER.current(),
+              'name': name, 'kind': kind, 'pid': os.getpid(), 'start': datetime.now().isoformat(timespec='milliseconds'),
+              'status': 'ok'}
+    record.update(attrs)
+    TRACER.start(record)
+    stack.append(record)
+    wall, cpu, child = perf_counter(), process_time(), children_cpu()
+    try:
+        yield record
+    except BaseException as e:
+        # sys.exit('ERROR: ...') of a stage is an error too
+        if not (isinstance(e, SystemExit) and e.code in (None, 0)):
+            record['status'] = 'error'
+        raise
+    finally:
+        stack.pop()
+        record['wall'] = perf_counter() - wall
+        record.setdefault('cpu', process_time() - cpu)
+        record.setdefault('child_cpu', children_cpu() - child)
+        peak = TRACER.end(record)
+        record.setdefault('peak_rss_mb', peak)
+
+
+def run(command, name=None, capture=False, parent=None):
+    """
+    Run a shell command as a 'command' span, with the resource usage of that child from os.wait4: CPU seconds
+    and peak RSS of the command (including the processes it waited for), instead of this process. On Linux that
+    peak is at least the RSS of this process when the command started, as exec keeps the high-water mark of the fork.
+    Output is streamed, or returned when capture is set. Returns (exit status, output).
+    """
+    with span(name if name is not None else command.split()[0], kind='command', parent=parent, command=command) as record:
+        proc = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE if capture else None,
+                                stderr=subprocess.STDOUT if capture else None)
+        output = ''
+        if capture:
+            output = proc.stdout.read().decode(errors='replace')
+            proc.stdout.close()
+        _, status, usage = os.wait4(proc.pid, 0)
+        proc.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+        record.update(returncode=proc.returncode, cpu=usage.ru_utime + usage.ru_stime, child_cpu=0.0,
+                      peak_rss_mb=usage.ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024))
+        if proc.returncode != 0:
+            record['status'] = 'error'
+    return proc.returncode, output
+
+
+def start_worker():
+    # a fresh tracer in a worker process: a forked worker inherits the spans of its parent
+    global TRACER
+    TRACER = Tracer()
+    return TRACER
+
+
+def write_trace(result_dir, stage, spans):
+    # [result_dir]/trace/[stage]_[time]_[pid].jsonl, one span per line
+    trace_dir = '{}/{}'.format(result_dir, TRACE_DIR)
+    os.makedirs(trace_dir, exist_ok=True)
+    path = '{}/{}_{}_{}.jsonl'.format(trace_dir, stage, strftime('%Y%m%d-%H%M%S', localtime()), os.getpid())
+    with open(path, 'w') as o:
+        for record in sorted(spans, key=lambda x: x['start']):
+            o.write(json.dumps(record, sort_keys=True) + '\n')
+    return path
+
+
+def summary(spans, rows=SUMMARY_ROWS):
+    # table of the slowest spans; CPU of a command is its own, of a stage or task the Python process plus ended children
+    line = '{:<40} {:<8} {:>12} {:>12} {:>12} {:>10} {:>6}'
+    print(line.format('Span', 'Kind', 'Wall(s)', 'CPU(s)', 'Child CPU(s)', 'Peak(MB)', 'Status'))
+    for record in sorted(spans, key=lambda x: x['wall'], reverse=True)[:rows]:
+        print(line.format(record['name'][:40], record['kind'], '{:.2f}'.format(record['wall']), '{:.2f}'.format(record['cpu']),
+                          '{:.2f}'.format(record['child_cpu']), '{:.0f}'.format(record['peak_rss_mb']), record['status']))
+
+
+def traced(stage):
+    """
+    Decorator of the GPRS analyses: logs the start, runs the method as a span and, when it is the outermost
+    analysis of the run, writes the trace to [result_dir]/trace, prints the slowest spans and the elapsed time.
+    Analyses called from another one (prs-stat -> prs-stat python) are spans of the same trace.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            outer = TRACER.current() is None
+            start = time()
+            log("Starting Analysis: {}".format(stage))
+            try:
+                with span(stage, **({'argv': ' '.join(sys.argv)} if outer else {})):
+                    return method(self, *args, **kwargs)
+            finally:
+                if outer:
+                    spans, TRACER.spans = TRACER.spans, []
+                    print("\n")
+                    summary(spans)
+                    print('Trace saved as {}'.format(write_trace(self.result_dir, stage.split()[0], spans)))
+                    log("Exiting Program", secondsToStr(time() - start))
+        return wrapper
+    return decorator
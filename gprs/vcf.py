@@ -0,0 +1,376 @@
+# Read ALT allele dosages (FORMAT/DS) from VCF files
+import os
+import gzip
+import zlib
+import struct
+import numpy as np
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+
+VARIANT_COLUMNS = ['CHROM', 'POS', 'ID', 'REF', 'ALT']
+# BGZF blocks (at most 64 KB of text each) inflated together; only one batch of a range is held in memory
+INFLATE_BATCH = 64
+
+
+def open_vcf(path):
+    # bgzip is gzip-compatible for sequential reading
+    if path.endswith('.gz') or path.endswith('.bgz'):
+        return gzip.open(path, 'rt')
+    return open(path)
+
+
+def read_samples(path):
+    # sample IDs from the #CHROM header line
+    with open_vcf(path) as f:
+        for line in f:
+            if line.startswith('#CHROM'):
+                return line.rstrip('\n').split('\t')[9:]
+    return []
+
+
+def parse_dosage(format_field, samples_field, n_samples):
+    """
+    DS values of one VCF record as float32 (missing '.' -> NaN).
+    samples_field is the tab-separated text after FORMAT.
+    """
+    keys = format_field.split(':')
+    ds = keys.index('DS')
+    if len(keys) == 1:
+        values = samples_field.rstrip('\n').split('\t')
+    else:
+        values = samples_field.rstrip('\n').replace('\t', ':').split(':')
+        if len(values) == n_samples * len(keys):
+            values = values[ds::len(keys)]
+        else:
+            # some samples drop trailing fields
+            values = [sample.split(':')[ds] if sample.count(':') >= ds else '.' for sample in samples_field.rstrip('\n').split('\t')]
+    try:
+        return np.array(values, dtype=np.float32)
+    except ValueError:
+        return pd.to_numeric(pd.Series(values), errors='coerce').to_numpy(np.float32)
+
+
+def parse_records(lines, n_samples, snp_ids=None, positions=None):
+    """
+    Parse VCF record lines into (variants DataFrame, dosages n_variants x n_samples).
+    Only biallelic records with DS, and (if given) an ID in snp_ids or a POS in positions, are kept.
+    """
+    variants = []
+    dosages = []
+    for line in lines:
+        if line.startswith('#'):
+            continue
+        fields = line.split('\t', 9)
+        if len(fields) < 10 or ',' in fields[4]:
+            continue
+        if snp_ids is not None and fields[2] not in snp_ids:
+            continue
+        if positions is not None and int(fields[1]) not in positions:
+            continue
+        if 'DS' not in fields[8].split(':'):
+            continue
+        variants.append(fields[:5])
+        dosages.append(parse_dosage(fields[8], fields[9], n_samples))
+    variants = pd.DataFrame(variants, columns=VARIANT_COLUMNS)
+    variants['POS'] = variants['POS'].astype(np.int64)
+    if len(dosages) == 0:
+        return variants, np.zeros((0, n_samples), dtype=np.float32)
+    return variants, np.vstack(dosages)
+
+
+def iter_dosages(path, snp_ids=None, block_size=512):
+    """
+    Stream a VCF once and yield (variants, dosages) blocks of at most block_size records.
+    snp_ids: optional set of variant IDs to keep; other records are skipped before parsing the samples
+    """
+    n_samples = len(read_samples(path))
+    block = []
+    with open_vcf(path) as f:
+        for line in f:
+            if line.startswith('#'):
+                continue
+            if snp_ids is not None and line.split('\t', 3)[2] not in snp_ids:
+                continue
+            block.append(line)
+            if len(block) == block_size:
+                yield parse_records(block, n_samples)
+                block = []
+    if len(block) > 0:
+        yield parse_records(block, n_samples)
+
+
+# BGZF random access
+# A virtual offset is (compressed block offset << 16 | offset inside the uncompressed block).
+
+def read_block(f, coffset):
+    # raw BGZF block at coffset, or b'' at end of file
+    f.seek(coffset)
+    header = f.read(12)
+    if len(header) < 12:
+        return b''
+    xlen = struct.unpack('<H', header[10:12])[0]
+    extra = f.read(xlen)
+    bsize = None
+    i = 0
+    while i < xlen:
+        si1, si2, slen = extra[i], extra[i + 1], struct.unpack('<H', extra[i + 2:i + 4])[0]
+        if si1 == 66 and si2 == 67:
+            bsize = struct.unpack('<H', extra[i + 4:i + 6])[0]
+        i += 4 + slen
+    if bsize is None:
+        raise Exception('Not a BGZF file (missing BC field); compress with bgzip')
+    return header + extra + f.read(bsize + 1 - 12 - xlen)
+
+
+def inflate(block):
+    # uncompressed content of one raw BGZF block
+    xlen = struct.unpack('<H', block[10:12])[0]
+    return zlib.decompress(block[12 + xlen:-8], -15)
+
+
+def reg2bins(beg, end, min_shift, depth):
+    # bins overlapping the 0-based half-open region [beg, end), as in the CSI/tabix specification
+    bins = []
+    end -= 1
+    level, first, shift = 0, 0, min_shift + depth * 3
+    while level <= depth:
+        bins.extend(range(first + (beg >> shift), first + (end >> shift) + 1))
+        first += 1 << (level * 3)
+        level += 1
+        shift -= 3
+    return bins
+
+
+def read_tabix_names(data, offset):
+    # sequence names in the tabix header (format, col_seq, col_beg, col_end, meta, skip, l_nm, names)
+    l_nm = struct.unpack('<i', data[offset + 24:offset + 28])[0]
+    names = data[offset + 28:offset + 28 + l_nm].split(b'\0')
+    return [x.decode() for x in names if len(x) > 0], offset + 28 + l_nm
+
+
+def read_index(path):
+    """
+    Parse a .tbi or .csi index next to the VCF.
+    Returns {sequence name: (bins {bin: [(vbeg, vend)]}, linear offsets)}, min_shift, depth; or None without index.
+    """
+    for ext in ('.tbi', '.csi'):
+        if os.path.exists(path + ext):
+            with gzip.open(path + ext, 'rb') as f:
+                data = f.read()
+            break
+    else:
+        return None
+    refs = {}
+    if data[:4] == b'TBI\1':
+        n_ref = struct.unpack('<i', data[4:8])[0]
+        names, offset = read_tabix_names(data, 8)
+        min_shift, depth, csi = 14, 5, False
+    elif data[:4] == b'CSI\1':
+        min_shift, depth, l_aux = struct.unpack('<iii', data[4:16])
+        names, _ = read_tabix_names(data, 16)
+        offset = 16 + l_aux
+        n_ref = struct.unpack('<i', data[offset:offset + 4])[0]
+        offset += 4
+        csi = True
+    else:
+        raise Exception('{} is not a tabix/CSI index'.format(path))
+    for i in range(n_ref):
+        n_bin = struct.unpack('<i', data[offset:offset + 4])[0]
+        offset += 4
+        bins = {}
+        for _ in range(n_bin):
+            bin_nb = struct.unpack('<I', data[offset:offset + 4])[0]
+            offset += 12 if csi else 4
+            n_chunk = struct.unpack('<i', data[offset:offset + 4])[0]
+            offset += 4
+            chunks = np.frombuffer(data, dtype='<u8', count=2 * n_chunk, offset=offset).reshape(-1, 2)
+            offset += 16 * n_chunk
+            bins[bin_nb] = [(int(a), int(b)) for (a, b) in chunks]
+        linear = np.zeros(0, dtype='<u8')
+        if not csi:
+            n_intv = struct.unpack('<i', data[offset:offset + 4])[0]
+            linear = np.frombuffer(data, dtype='<u8', count=n_intv, offset=offset + 4)
+            offset += 4 + 8 * n_intv
+        refs[names[i]] = (bins, linear)
+    return refs, min_shift, depth
+
+
+def build_position_index(path):
+    """
+    Scan a bgzipped VCF once and record, for each block where a record starts, the virtual offset
+    of that first record with its CHROM and POS. Saved as [vcf].gprsidx.npz for later runs.
+    """
+    index_file = path + '.gprsidx.npz'
+    if os.path.exists(index_file) and os.path.getmtime(index_file) >= os.path.getmtime(path):
+        index = np.load(index_file)
+        return index['voffset'], index['chrom'], index['pos']
+    print('No tabix/CSI index for {}, building a position index (once)...'.format(path))
+    voffsets, chroms, positions = [], [], []
+    at_line_start = True
+    pending = None  # (voffset, text) of a record whose CHROM/POS continues in the next block
+    coffset = 0
+    with open(path, 'rb') as f:
+        while True:
+            block = read_block(f, coffset)
+            if len(block) == 0:
+                break
+            data = inflate(block)
+            if pending is not None:
+                pending = (pending[0], pending[1] + data[:64])
+                fields = pending[1].split(b'\t', 2)
+                if len(fields) == 3:
+                    voffsets.append(pending[0])
+                    chroms.append(fields[0].decode())
+                    positions.append(int(fields[1]))
+                    pending = None
+            if at_line_start:
+                start = 0
+            else:
+                start = data.find(b'\n') + 1 if b'\n' in data else len(data)
+            # skip header lines to the first record starting in this block
+            while start < len(data) and data[start:start + 1] == b'#':
+                nl = data.find(b'\n', start)
+                start = len(data) if nl < 0 else nl + 1
+            if pending is None and start < len(data):
+                fields = data[start:start + 256].split(b'\t', 2)
+                if len(fields) == 3:
+                    voffsets.append(coffset << 16 | start)
+                    chroms.append(fields[0].decode())
+                    positions.append(int(fields[1]))
+                else:
+                    pending = (coffset << 16 | start, data[start:])
+            if len(data) > 0:
+                at_line_start = data.endswith(b'\n')
+            coffset += len(block)
+    voffsets = np.array(voffsets, dtype=np.uint64)
+    chroms = np.array(chroms, dtype=str)
+    positions = np.array(positions, dtype=np.int64)
+    try:
+        np.savez(index_file, voffset=voffsets, chrom=chroms, pos=positions)
+    except OSError:
+        print('Warning: cannot write {}; the position index is kept in memory only'.format(index_file))
+    return voffsets, chroms, positions
+
+
+def normalize_chrom(name):
+    name = str(name)
+    return name[3:] if name.lower().startswith('chr') else name
+
+
+class VcfReader(object):
+    """
+    Region-restricted DS reader for a bgzipped VCF. Uses the .tbi/.csi index when present,
+    or a position index built on first use, to decompress only the BGZF blocks holding the
+    requested positions; blocks are inflated in parallel threads (zlib releases the GIL).
+    """
+    def __init__(self, path, threads=4):
+        self.path = path
+        self.threads = threads
+        self.samples = read_samples(path)
+        self.index = read_index(path)
+        if self.index is None:
+            self.position_index = build_position_index(path)
+
+    def virtual_ranges(self, chrom, regions):
+        # (vbeg, vend) ranges covering the 1-based inclusive regions on chrom
+        ranges = []
+        if self.index is not None:
+            refs, min_shift, depth = self.index
+            names = {normalize_chrom(x): x for x in refs}
+            if normalize_chrom(chrom) not in names:
+                return []
+            bins, linear = refs[names[normalize_chrom(chrom)]]
+            for beg, end in regions:
+                min_offset = 0
+                if len(linear) > 0:
+                    min_offset = int(linear[min((beg - 1) >> min_shift, len(linear) - 1)])
+                for bin_nb in reg2bins(beg - 1, end, min_shift, depth):
+                    for vbeg, vend in bins.get(bin_nb, []):
+                        if vend > min_offset:
+                            ranges.append((max(vbeg, min_offset), vend))
+        else:
+            voffsets, chroms, positions = self.position_index
+            on_chrom = np.flatnonzero([normalize_chrom(x) == normalize_chrom(chrom) for x in chroms])
+            if len(on_chrom) == 0:
+                return []
+            first, pos = on_chrom[0], positions[on_chrom]
+            for beg, end in regions:
+                # start at the last indexed record before beg (records of chrom may start in the previous entry's block)
+                i = max(first + np.searchsorted(pos, beg, side='left') - 1, first - 1, 0)
+                # stop at the first indexed record after end
+                j = first + np.searchsorted(pos, end, side='right')
+                ranges.append((int(voffsets[i]), int(voffsets[j]) if j < len(voffsets) else None))
+        # merge overlapping ranges (None = to the end of file)
+        merged = []
+        for vbeg, vend in sorted(ranges, key=lambda x: x[0]):
+            if len(merged) > 0 and (merged[-1][1] is None or vbeg <= merged[-1][1]):
+                last_beg, last_end = merged[-1]
+                merged[-1] = (last_beg, None if (last_end is None or vend is None) else max(last_end, vend))
+            else:
+                merged.append((vbeg, vend))
+        return merged
+
+    def read_ranges(self, ranges):
+        """
+        Decompressed text of each virtual range, in pieces that end on line boundaries. Blocks are read and
+        inflated in parallel batches of INFLATE_BATCH, and each batch is released once its lines are yielded.
+        """
+        file_size = os.path.getsize(self.path)
+        with open(self.path, 'rb') as f, ThreadPoolExecutor(max_workers=self.threads) as pool:
+            for vbeg, vend in ranges:
+                coffset = vbeg >> 16
+                cend = file_size if vend is None else vend >> 16
+                skip = vbeg & 0xffff
+                rest = b''
+                end_of_file = False
+                while not end_of_file and coffset <= cend and coffset < file_size:
+                    batch = []
+                    while len(batch) < INFLATE_BATCH and coffset <= cend and coffset < file_size:
+                        block = read_block(f, coffset)
+                        if len(block) == 0:
+                            end_of_file = True
+                            break
+                        batch.append((coffset, block))
+                        coffset += len(block)
+                    if len(batch) == 0:
+                        break
+                    data = list(pool.map(inflate, [block for (offset, block) in batch]))
+                    if vend is not None and batch[-1][0] == cend:
+                        data[-1] = data[-1][:vend & 0xffff]
+                    data[0] = data[0][skip:]
+                    skip = 0
+                    # a line cut by the end of the batch is completed by the next one
+                    text = rest + b''.join(data)
+                    del batch, data
+                    cut = text.rfind(b'\n') + 1
+                    rest = text[cut:]
+                    if cut > 0:
+                        yield text[:cut]
+                    del text
+                if len(rest) > 0:
+                    yield rest
+
+    def fetch(self, chrom, positions, snp_ids=None, block_size=512, gap=100000):
+        """
+        Yield (variants, dosages) blocks for records at the given positions (and IDs, if given) on chrom.
+        Positions closer than `gap` bp are read as one region.
+        """
+        positions = np.unique(np.asarray(list(positions), dtype=np.int64))
+        if len(positions) == 0:
+            return
+        breaks = np.flatnonzero(np.diff(positions) > gap) + 1
+        regions = [(int(x[0]), int(x[-1])) for x in np.split(positions, breaks)]
+        wanted = set(positions.tolist())
+        chrom = normalize_chrom(chrom)
+        lines = []
+        for text in self.read_ranges(self.virtual_ranges(chrom, regions)):
+            # ranges start and end on record boundaries, but may include records of a neighbouring chromosome
+            for line in text.decode().split('\n'):
+                if len(line) == 0 or normalize_chrom(line.split('\t', 1)[0]) != chrom:
+                    continue
+                lines.append(line)
+                if len(lines) == block_size:
+                    yield parse_records(lines, len(self.samples), snp_ids, wanted)
+                    lines = []
+        if len(lines) > 0:
+            yield parse_records(lines, len(self.samples), snp_ids, wanted)
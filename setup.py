@@ -10,7 +10,12 @@ setup(
     packages=find_packages(),
     install_requires=[
         'click>=8.0.0',
-        'pandas>=1.1.5'
+        'numpy',
+        'pandas>=1.1.5',
+        'scipy'
     ],
+    extras_require={
+        'parquet': ['pyarrow']
+    },
     scripts=['bin/gprs']
 )
\ No newline at end of file